@@ -54,7 +54,7 @@ export default function ChatWidget() {
 
             // API Call - Using environment variable
             const apiUrl = process.env.NEXT_PUBLIC_API_URL || "http://localhost:4000";
-            const response = await fetch(`${apiUrl}/chat/message`, {
+            const response = await fetch(`${apiUrl}/chat/message/stream`, {
                 method: "POST",
                 headers: {
                     "Content-Type": "application/json",
@@ -67,12 +67,38 @@ export default function ChatWidget() {
                 })
             });
 
-            if (!response.ok) {
+            if (!response.ok || !response.body) {
                 throw new Error("Erreur de communication avec l'IA");
             }
 
-            const data = await response.json();
-            setMessages((prev) => [...prev, { role: "assistant", content: data.response }]);
+            // NDJSON stream: the answer grows token by token in its bubble
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let started = false;
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split("\n");
+                buffer = lines.pop() || "";
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const frame = JSON.parse(line);
+                    if (frame.type === "error") throw new Error(frame.detail);
+                    if (frame.type !== "token") continue;
+                    if (!started) {
+                        started = true;
+                        setIsLoading(false);
+                        setMessages((prev) => [...prev, { role: "assistant", content: frame.content }]);
+                    } else {
+                        setMessages((prev) => [
+                            ...prev.slice(0, -1),
+                            { role: "assistant", content: prev[prev.length - 1].content + frame.content }
+                        ]);
+                    }
+                }
+            }
 
         } catch (error) {
             console.error("Chat Error:", error);
@@ -0,0 +1,169 @@
+"""
+Regression benchmark for context_engine.render_courses / render_reports.
+
+Builds a heavy student (default 15 courses x 40 items, 5 categories, a
+report per course), checks the rendered text against the original
+category-breakdown loop (O(courses x categories x (items + grades x items)))
+and times both. Exits non-zero when the current rendering is slower than
+--max-ms, so it can guard the per-course maps.
+
+    PYTHONPATH=../shared python bench_context_engine.py
+    PYTHONPATH=../shared python bench_context_engine.py --courses 15 30 --items 80 --max-ms 20
+"""
+import sys
+import random
+import argparse
+import statistics
+import time
+
+from bson import ObjectId
+
+from context_engine import render_courses, render_reports
+from summaries import summarize_course
+
+
+def legacy_render(courses, sessions_map, teachers_map, grades, grade_items, categories, documents, reports) -> tuple:
+    """Course blocks and report lines as get_student_context built them before the maps"""
+    items_map = {i["_id"]: i for i in grade_items}
+    categories_map = {}
+    for cat in categories:
+        categories_map.setdefault(cat["courseId"], []).append(cat)
+    docs_map = {}
+    for d in documents:
+        docs_map.setdefault(d.get("courseId"), []).append(d.get("name", "Untitled Doc"))
+
+    reports_context = []
+    for r in reports:
+        r_course = next((c for c in courses if c["_id"] == r.get("courseId")), None)
+        course_title = r_course.get("title", "Unknown Course") if r_course else "General"
+        reports_context.append(f"- [{course_title}]: {r.get('report', '')}")
+
+    rich_courses_context = []
+    for course in courses:
+        c_id = course["_id"]
+        session = sessions_map.get(course.get("sessionId"))
+        session_str = f"{session.get('name', 'Unknown Session')}" if session else ""
+        c_teacher_name = teachers_map.get(course.get("teacherId"), "Unknown Instructor")
+
+        earned_points = 0
+        total_possible_points = 0
+        c_grades = [g for g in grades if g.get("courseId") == c_id]
+        cat_strings = []
+        for cat in categories_map.get(c_id, []):
+            cat_items = [i for i in grade_items if i.get("categoryId") == cat["_id"]]
+            cat_item_ids = [i["_id"] for i in cat_items]
+            cat_grades = [g for g in c_grades if g.get("itemId") in cat_item_ids]
+            cat_earned = sum([g.get("score", 0) for g in cat_grades])
+            cat_possible = sum([items_map.get(g.get("itemId"), {}).get("maxPoints", 100) for g in cat_grades])
+            if cat_possible > 0:
+                cat_strings.append(f"{cat['name']} ({cat['weight']}%): {cat_earned / cat_possible * 100:.1f}%")
+            else:
+                cat_strings.append(f"{cat['name']} ({cat['weight']}%): No grades")
+
+        for g in c_grades:
+            item = items_map.get(g.get("itemId"))
+            earned_points += g.get("score", 0)
+            total_possible_points += item["maxPoints"] if item and "maxPoints" in item else g.get("maxPoints", 100)
+        if total_possible_points > 0:
+            avg_str = f"{earned_points / total_possible_points * 100:.1f}%"
+        else:
+            avg_str = "No grades yet"
+
+        c_docs = docs_map.get(c_id, [])
+        docs_str = ", ".join(c_docs) if c_docs else "No documents"
+        course_details = f"Course: {course.get('title', 'Unnamed Course')} ({session_str})\n"
+        course_details += f"  - Professor: {c_teacher_name}\n"
+        course_details += f"  - Overall Average: {avg_str}\n"
+        if cat_strings:
+            course_details += f"  - Breakdown: {', '.join(cat_strings)}\n"
+        course_details += f"  - Materials: {docs_str}"
+        rich_courses_context.append(course_details)
+
+    if not rich_courses_context:
+        rich_courses_context.append("No active courses found.")
+    return rich_courses_context, reports_context
+
+
+def synthetic_student(n_courses: int, n_items: int, n_categories: int, seed: int = 0) -> dict:
+    """Rows shaped like the projected documents build_student_context loads (one grade per item)"""
+    rng = random.Random(seed)
+    session_id, teacher_id = ObjectId(), ObjectId()
+    data = {
+        "sessions_map": {session_id: {"_id": session_id, "name": "Automne 2026"}},
+        "teachers_map": {teacher_id: "Marie Tremblay"},
+        "student_id": str(ObjectId()),
+        "courses": [], "grades": [], "grade_items": [], "categories": [], "documents": [], "reports": [],
+    }
+    for c in range(n_courses):
+        c_id = ObjectId()
+        data["courses"].append({"_id": c_id, "title": f"Cours {c}", "sessionId": session_id, "teacherId": teacher_id})
+        cats = [{"_id": ObjectId(), "courseId": c_id, "name": f"Catégorie {k}", "weight": 100 // n_categories}
+                for k in range(n_categories)]
+        data["categories"].extend(cats)
+        for i in range(n_items):
+            item = {"_id": ObjectId(), "courseId": c_id, "categoryId": cats[i % n_categories]["_id"],
+                    "maxPoints": rng.choice([10, 20, 50, 100])}
+            data["grade_items"].append(item)
+            if rng.random() < 0.7:
+                data["grades"].append({"_id": ObjectId(), "courseId": c_id, "studentId": data["student_id"],
+                                       "itemId": item["_id"], "score": rng.randint(0, item["maxPoints"])})
+        data["documents"].extend({"courseId": c_id, "name": f"Notes {c}.{d}.pdf"} for d in range(3))
+        data["reports"].append({"courseId": c_id, "report": f"Rapport du cours {c}"})
+    rng.shuffle(data["grades"])
+    return data
+
+
+def render(data: dict) -> tuple:
+    """Course stats computed as the summaries store does, then rendered"""
+    rows = {kind: {} for kind in ("grade_items", "categories", "grades")}
+    for kind, by_course in rows.items():
+        for row in data[kind]:
+            by_course.setdefault(row["courseId"], []).append(row)
+    course_stats = {
+        str(c["_id"]): summarize_course(rows["grade_items"].get(c["_id"], []), rows["categories"].get(c["_id"], []),
+                                        rows["grades"].get(c["_id"], []), [data["student_id"]])[data["student_id"]]["stats"]
+        for c in data["courses"]
+    }
+    courses = render_courses(data["courses"], data["sessions_map"], data["teachers_map"], course_stats,
+                             data["documents"])
+    return courses, render_reports(data["reports"], data["courses"])
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", type=int, nargs="+", default=[15])
+    parser.add_argument("--items", type=int, default=40, help="grade items per course")
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-ms", type=float, default=25.0, help="fail above this median (current rendering)")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'courses':>7} {'items':>6} {'grades':>7} {'legacy ms':>10} {'maps ms':>8} {'speedup':>8}")
+    for n in args.courses:
+        data = synthetic_student(n, args.items, args.categories, seed=n)
+        legacy = lambda: legacy_render(data["courses"], data["sessions_map"], data["teachers_map"], data["grades"],
+                                       data["grade_items"], data["categories"], data["documents"], data["reports"])
+        assert render(data) == legacy(), f"{n} courses: rendered context differs from the reference"
+
+        before = timed(legacy, args.repeat)
+        after = timed(lambda: render(data), args.repeat)
+        print(f"{n:>7} {args.items:>6} {len(data['grades']):>7} {before * 1000:>10.1f} {after * 1000:>8.1f} "
+              f"{before / after:>7.1f}x")
+        if after * 1000 > args.max_ms:
+            print(f"  regression: {after * 1000:.1f} ms > {args.max_ms} ms")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
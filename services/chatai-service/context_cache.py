@@ -0,0 +1,199 @@
+"""
+Student context cache for /chat/message.
+
+A chat session sends several messages a few seconds apart against data
+that rarely changes, so the context text built by context_engine is kept
+per student:
+
+- ContextCache: TTL + size-bounded LRU. Concurrent misses for the same
+  student share one build. Entries remember their course ids so a change
+  to a course (documents, items, categories) drops every student of it.
+- ContextWatcher: invalidates entries from a change stream on the academic
+  collections (replica set / Atlas). On a standalone mongod it falls back
+  to polling `updatedAt`; deletions are then only caught by the TTL.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "120"))
+CONTEXT_CACHE_MAX_ENTRIES = int(os.getenv("CONTEXT_CACHE_MAX_ENTRIES", "1000"))
+CONTEXT_POLL_INTERVAL = float(os.getenv("CONTEXT_POLL_INTERVAL", "15"))
+
+# Collections whose changes alter a context, and the field that says whose
+STUDENT_COLLECTIONS = ("grades", "studentreports", "enrollments", "student_course_summaries")
+COURSE_COLLECTIONS = ("documents", "gradeitems", "gradecategories")
+
+
+class ContextCache:
+    def __init__(self, ttl: float = CONTEXT_CACHE_TTL, max_entries: int = CONTEXT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # studentId -> (expires_at, context, course_ids)
+        self._by_course: Dict[str, set] = {}  # courseId -> studentIds
+        self._building: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get_or_build(self, student_id: str, build: Callable[[], Awaitable[tuple]]):
+        """Cached context, or build() -> (context, course_ids); course_ids None = don't cache"""
+        entry = self._entries.get(student_id)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(student_id)
+                self.hits += 1
+                return entry[1]
+            self._drop(student_id)
+
+        pending = self._building.get(student_id)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._building[student_id] = future
+        try:
+            context, course_ids = await build()
+            # Invalidated while building: serve it once, don't keep it
+            if self._building.get(student_id) is future and course_ids is not None:
+                self._store(student_id, context, course_ids)
+            future.set_result(context)
+            return context
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved: nobody else may be awaiting it
+            future.exception()
+            raise
+        finally:
+            if self._building.get(student_id) is future:
+                del self._building[student_id]
+
+    def invalidate_student(self, student_id: str) -> None:
+        self._building.pop(student_id, None)
+        if student_id in self._entries:
+            self._drop(student_id)
+            self.invalidations += 1
+
+    def invalidate_course(self, course_id: str) -> None:
+        for student_id in list(self._by_course.get(course_id, ())):
+            self.invalidate_student(student_id)
+
+    def clear(self) -> None:
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._by_course.clear()
+        self._building.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / total, 3) if total else None,
+            "invalidations": self.invalidations,
+        }
+
+    def _store(self, student_id: str, context, course_ids: list) -> None:
+        if student_id in self._entries:
+            self._drop(student_id)
+        self._entries[student_id] = (time.monotonic() + self.ttl, context, course_ids)
+        for course_id in course_ids:
+            self._by_course.setdefault(course_id, set()).add(student_id)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, student_id: str) -> None:
+        _, _, course_ids = self._entries.pop(student_id)
+        for course_id in course_ids:
+            students = self._by_course.get(course_id)
+            if students is not None:
+                students.discard(student_id)
+                if not students:
+                    del self._by_course[course_id]
+
+
+class ContextWatcher:
+    """Drops cached contexts when their underlying data changes"""
+
+    def __init__(self, db, cache: ContextCache, poll_interval: float = CONTEXT_POLL_INTERVAL):
+        self.db = db
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def apply(self, collection: str, doc: Optional[dict]) -> None:
+        """Invalidate for one changed document (None: unknown, e.g. a delete)"""
+        if doc is None:
+            self.cache.clear()
+        elif collection in STUDENT_COLLECTIONS:
+            if doc.get("studentId") is not None:
+                self.cache.invalidate_student(str(doc["studentId"]))
+        elif doc.get("courseId") is not None:
+            self.cache.invalidate_course(str(doc["courseId"]))
+
+    async def _run(self) -> None:
+        try:
+            await self._watch()
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            # Standalone mongod: no change streams
+            logger.warning(f"Context cache: change stream unavailable ({e}), polling every {self.poll_interval}s")
+        await self._poll()
+
+    async def _watch(self) -> None:
+        collections = list(STUDENT_COLLECTIONS + COURSE_COLLECTIONS)
+        pipeline = [{"$match": {"ns.coll": {"$in": collections}}}]
+        async with self.db.watch(pipeline, full_document="updateLookup") as stream:
+            logger.info("Context cache: watching academic collections")
+            async for change in stream:
+                collection = change.get("ns", {}).get("coll")
+                if change["operationType"] in ("insert", "update", "replace"):
+                    self.apply(collection, change.get("fullDocument"))
+                elif change["operationType"] in ("delete", "drop", "invalidate"):
+                    self.apply(collection, None)
+
+    async def _poll(self) -> None:
+        collections = STUDENT_COLLECTIONS + COURSE_COLLECTIONS
+        for name in collections:
+            try:
+                await self.db[name].create_index("updatedAt")
+            except PyMongoError as e:
+                logger.warning(f"Context cache: could not index {name}.updatedAt: {e}")
+        since = datetime.now(timezone.utc)
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            now = datetime.now(timezone.utc)
+            try:
+                for name in collections:
+                    cursor = self.db[name].find({"updatedAt": {"$gt": since}}, {"studentId": 1, "courseId": 1})
+                    async for doc in cursor:
+                        self.apply(name, doc)
+                since = now
+            except PyMongoError as e:
+                logger.warning(f"Context cache poll failed: {e}")
+
+
+context_cache = ContextCache()
@@ -1,204 +1,297 @@
+import os
+import time
+import asyncio
+import hashlib
 import logging
+from collections import deque
 from bson import ObjectId
 
+from retrieval import retrieval_index
+from summaries import load_summaries, compute_summaries
+
 # Configuration
 logger = logging.getLogger(__name__)
 
-async def get_student_context(db, student_id: str) -> str:
-    """Fetches student courses and grades to build context."""
+# Documents per cursor batch: rows are folded as they stream, nothing is capped
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "500"))
+# Course material chunks added for the current question
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+
+# Projections: only the fields the context text uses
+PERSON_FIELDS = {"firstName": 1, "lastName": 1}
+SESSION_FIELDS = {"name": 1}
+ENROLLMENT_FIELDS = {"courseId": 1}
+COURSE_FIELDS = {"title": 1, "sessionId": 1, "teacherId": 1, "programId": 1}
+REPORT_FIELDS = {"courseId": 1, "report": 1}
+DOCUMENT_FIELDS = {"courseId": 1, "name": 1}
+PROGRAM_FIELDS = {"name": 1}
+
+def _find(collection, query, fields):
+    return collection.find(query, fields).batch_size(CURSOR_BATCH_SIZE)
+
+async def _collect(cursor, field=None) -> list:
+    """Cursor rows (or one field of them, rows without it skipped)"""
+    if field is None:
+        return [doc async for doc in cursor]
+    return [doc[field] async for doc in cursor if field in doc]
+
+async def _none():
+    return None
+
+# Recent context build timings per stage (seconds)
+_stage_timings = {}
+
+def _record_timings(timings: dict) -> None:
+    timings["total"] = sum(timings.values())
+    for stage, seconds in timings.items():
+        _stage_timings.setdefault(stage, deque(maxlen=1000)).append(seconds)
+    logger.debug("Context build: " + ", ".join(f"{k}={v * 1000:.1f}ms" for k, v in timings.items()))
+
+def context_stage_stats() -> dict:
+    """p50 / p99 per stage of the recent context builds"""
+    stats = {}
+    for stage, samples in _stage_timings.items():
+        ordered = sorted(samples)
+        stats[stage] = {
+            "count": len(ordered),
+            "p50Ms": round(ordered[len(ordered) // 2] * 1000, 1),
+            "p99Ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 1),
+        }
+    return stats
+
+def _group(rows: list, field: str = "courseId") -> dict:
+    """rows grouped by one of their fields, in cursor order"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.get(field), []).append(row)
+    return groups
+
+def render_courses(courses: list, sessions_map: dict, teachers_map: dict, course_stats: dict,
+                   documents: list, averages: dict = None) -> list:
+    """
+    One text block per course. Averages and category breakdowns come from
+    `course_stats`, courseId (str) -> grade_stats summary (see shared/summaries.py);
+    documents are grouped by course once.
+    `averages`, when given, is filled with courseId (str) -> overall average (None: no grades).
+    """
+    docs_map = {c_id: [d.get("name", "Untitled Doc") for d in docs] for c_id, docs in _group(documents).items()}
+
+    rich_courses_context = []
+    for course in courses:
+        c_name = course.get("title", "Unnamed Course")
+        c_id = course["_id"]
+
+        # Session Info
+        session = sessions_map.get(course.get("sessionId"))
+        session_str = f"{session.get('name', 'Unknown Session')}" if session else ""
+
+        # Teacher
+        c_teacher_name = teachers_map.get(course.get("teacherId"), "Unknown Instructor")
+
+        # Overall average + category breakdown
+        stats = course_stats.get(str(c_id)) or {"average": None, "hasGrades": False, "categories": []}
+
+        cat_strings = []
+        for cat in stats["categories"]:
+            if cat["average"] is not None:
+                cat_strings.append(f"{cat['name']} ({cat['weight']}%): {cat['average']:.1f}%")
+            else:
+                cat_strings.append(f"{cat['name']} ({cat['weight']}%): No grades")
+
+        if averages is not None:
+            averages[str(c_id)] = stats["average"]
+        if stats["hasGrades"]:
+            avg_str = f"{stats['average']:.1f}%"
+        else:
+            avg_str = "No grades yet"
+
+        # Documents
+        c_docs = docs_map.get(c_id, [])
+        docs_str = ", ".join(c_docs) if c_docs else "No documents"
+
+        course_details = f"Course: {c_name} ({session_str})\n"
+        course_details += f"  - Professor: {c_teacher_name}\n"
+        course_details += f"  - Overall Average: {avg_str}\n"
+        if cat_strings:
+            course_details += f"  - Breakdown: {', '.join(cat_strings)}\n"
+        course_details += f"  - Materials: {docs_str}"
+
+        rich_courses_context.append(course_details)
+
+    if not rich_courses_context:
+        rich_courses_context.append("No active courses found.")
+    return rich_courses_context
+
+def render_reports(reports: list, courses: list) -> list:
+    """Teacher reports, each tagged with its course title (course looked up by id)"""
+    titles = {c["_id"]: c.get("title", "Unknown Course") for c in courses}
+    return [f"- [{titles.get(r.get('courseId'), 'General')}]: {r.get('report', '')}" for r in reports]
+
+class StudentContext:
+    """
+    The student context split into sections, so the prompt builder can keep
+    the relevant ones. text() with every section is the full context.
+    """
+    __slots__ = ("student_name", "program_name", "course_count", "courses", "reports", "course_titles",
+                 "course_averages", "excerpts")
+
+    def __init__(self, student_name: str, program_name: str, course_count: int, courses: list, reports: list,
+                 course_titles: dict = None, course_averages: dict = None, excerpts: list = None):
+        self.student_name = student_name
+        self.program_name = program_name
+        self.course_count = course_count
+        self.courses = courses  # one text block per course
+        self.reports = reports  # one line per teacher report
+        self.course_titles = course_titles or {}  # courseId (str) -> title
+        self.course_averages = course_averages or {}  # courseId (str) -> overall average (None: no grades)
+        self.excerpts = excerpts or []  # course material chunks relevant to the current question
+
+    def with_excerpts(self, excerpts: list) -> "StudentContext":
+        """Copy with the given excerpts (the cached context itself is never modified)"""
+        return StudentContext(self.student_name, self.program_name, self.course_count, self.courses,
+                              self.reports, self.course_titles, self.course_averages, excerpts)
+
+    def header(self) -> str:
+        return f"""Student: {self.student_name}
+Program: {self.program_name}
+Total Active Courses: {self.course_count}
+        """
+
+    def text(self, courses: list = None, reports: list = None, excerpts: list = None) -> str:
+        """Context text with the given sections (default: all of them)"""
+        courses = self.courses if courses is None else courses
+        reports = self.reports if reports is None else reports
+        excerpts = self.excerpts if excerpts is None else excerpts
+        text = f"""{self.header()}
+=== ENROLLED COURSES & MATERIALS ===
+{chr(10).join(courses)}
+
+=== TEACHER REPORTS ===
+{chr(10).join(reports) if reports else "No teacher reports available."}
+"""
+        if excerpts:
+            text += f"""
+=== COURSE MATERIAL EXCERPTS ===
+{chr(10).join(excerpts)}
+"""
+        return text
+
+    def __str__(self) -> str:
+        return self.text()
+
+    def version(self) -> str:
+        """Hash of the full text: changes whenever the data behind it (or the excerpts) change"""
+        return hashlib.sha1(self.text().encode("utf-8")).hexdigest()
+
+async def add_excerpts(db, context, question: str):
+    """`context` plus the chunks of its course documents most relevant to `question`
+    (retrieval index: segments built by ia-service, read here)"""
+    if not isinstance(context, StudentContext) or not context.course_titles or not question.strip():
+        return context
+    course_ids = list(context.course_titles)
+    try:
+        hits = retrieval_index.search(question, course_ids, RETRIEVAL_TOP_K)
+    except Exception as e:
+        logger.error(f"Retrieval failed: {e}")
+        return context
+    return context.with_excerpts([
+        f"- [{context.course_titles.get(h['courseId'], 'Course')}] {h['name']} (p. {h['page']}): {' '.join(h['text'].split())}"
+        for h in hits
+    ])
+
+async def get_student_context(db, student_id: str, question: str = "") -> str:
+    """Fetches student courses and grades to build context.
+    With a question, the relevant course material excerpts are added."""
+    context, _ = await build_student_context(db, student_id)
+    return str(await add_excerpts(db, context, question))
+
+async def build_student_context(db, student_id: str) -> tuple:
+    """
+    (StudentContext, ids of the courses it covers). On failure: (error
+    message, None), which must not be cached.
+    """
     try:
         # Correctly parsing ObjectId
         try:
             sid = ObjectId(student_id)
         except:
-            return "Student ID invalid."
+            return "Student ID invalid.", None
 
-        # Fetch Student
-        student = await db.users.find_one({"_id": sid, "role": "student"})
+        timings = {}
+
+        # Stage 1: everything that only depends on the student id
+        stage_start = time.perf_counter()
+        student, active_sessions, all_enrolled_course_ids, reports = await asyncio.gather(
+            db.users.find_one({"_id": sid, "role": "student"}, PERSON_FIELDS),
+            # Active sessions, with their names (courses are only taken from these)
+            _collect(_find(db.sessions, {"state": "ACTIVE"}, SESSION_FIELDS)),
+            _collect(_find(db.enrollments, {"studentId": sid}, ENROLLMENT_FIELDS), "courseId"),
+            _collect(_find(db.studentreports, {"studentId": sid}, REPORT_FIELDS)),
+        )
+        timings["student"] = time.perf_counter() - stage_start
         if not student:
-            return "Unknown student."
+            return "Unknown student.", None
 
         student_name = f"{student.get('firstName', '')} {student.get('lastName', '')}"
+        sessions_map = {s["_id"]: s for s in active_sessions}
 
-        # 1. Fetch Active Sessions
-        active_sessions_cursor = db.sessions.find({"state": "ACTIVE"})
-        active_sessions = await active_sessions_cursor.to_list(length=20)
-        active_session_ids = [s["_id"] for s in active_sessions]
-
-        # 2. Fetch Enrollments
-        enrollments_cursor = db.enrollments.find({"studentId": sid})
-        enrollments = await enrollments_cursor.to_list(length=100)
-        
-        all_enrolled_course_ids = [e["courseId"] for e in enrollments if "courseId" in e]
-        
-        # 3. Filter Valid Courses (Active Session Only)
-        courses_cursor = db.courses.find({
+        # Stage 2: Filter Valid Courses (Active Session Only)
+        stage_start = time.perf_counter()
+        courses = await _collect(_find(db.courses, {
             "_id": {"$in": all_enrolled_course_ids},
-            "sessionId": {"$in": active_session_ids}
-        })
-        courses = await courses_cursor.to_list(length=len(all_enrolled_course_ids))
+            "sessionId": {"$in": list(sessions_map)}
+        }, COURSE_FIELDS))
+        timings["courses"] = time.perf_counter() - stage_start
         
         # Updated list of valid course IDs
         course_ids = [c["_id"] for c in courses]
-        
-        # 2. Fetch Grades (for performance context)
-        grades_cursor = db.grades.find({"studentId": sid})
-        grades = await grades_cursor.to_list(length=200)
+        in_courses = {"$in": course_ids}
+        teacher_ids = [c["teacherId"] for c in courses if "teacherId" in c and c["teacherId"]]
+        program_id = courses[0].get("programId") if courses else None
 
-        # 3. Build Context
-        courses_context = []
-        
-        if courses:
-            # We already have 'courses' list from step 1
-            pass
-            
-            # Fetch Teachers
-            teacher_ids = [c["teacherId"] for c in courses if "teacherId" in c and c["teacherId"]]
-            teachers_map = {}
-            if teacher_ids:
-                teachers_cursor = db.users.find({"_id": {"$in": teacher_ids}})
-                teachers = await teachers_cursor.to_list(length=len(teacher_ids))
-                for t in teachers:
-                    teachers_map[t["_id"]] = f"{t.get('firstName', '')} {t.get('lastName', '')}"
-
-        # 4. Fetch GradeItems & Categories & Sessions
-        # Batched fetching for performance
-        
-        # Items
-        grade_items_cursor = db.gradeitems.find({"courseId": {"$in": course_ids}} if course_ids else {})
-        grade_items = await grade_items_cursor.to_list(length=1000)
-        items_map = {i["_id"]: i for i in grade_items} # ID -> Item
-        
-        # Categories
-        categories_cursor = db.gradecategories.find({"courseId": {"$in": course_ids}} if course_ids else {})
-        categories = await categories_cursor.to_list(length=200)
-        categories_map = {} # courseId -> list of categories
-        for cat in categories:
-            cid = cat["courseId"]
-            if cid not in categories_map:
-                categories_map[cid] = []
-            categories_map[cid].append(cat)
-            
-        # Sessions
-        session_ids = [c["sessionId"] for c in courses if "sessionId" in c]
-        sessions_cursor = db.sessions.find({"_id": {"$in": session_ids}} if session_ids else {})
-        sessions = await sessions_cursor.to_list(length=50)
-        sessions_map = {s["_id"]: s for s in sessions}
-
-        # 5. Fetch Student Reports
-        reports_cursor = db.studentreports.find({"studentId": sid})
-        reports = await reports_cursor.to_list(length=50)
-        reports_context = []
-        for r in reports:
-            # Match report to course title if possible
-            r_course = next((c for c in courses if c["_id"] == r.get("courseId")), None)
-            course_title = r_course.get("title", "Unknown Course") if r_course else "General"
-            reports_context.append(f"- [{course_title}]: {r.get('report', '')}")
-
-        # 6. Fetch Course Documents
-        documents_cursor = db.documents.find({"courseId": {"$in": course_ids}} if course_ids else {})
-        documents = await documents_cursor.to_list(length=100)
-        docs_map = {}
-        for d in documents:
-            c_id = d.get("courseId")
-            if c_id not in docs_map:
-                docs_map[c_id] = []
-            docs_map[c_id].append(d.get("name", "Untitled Doc"))
-
-        # Re-build rich context
-        rich_courses_context = []
-        for course in courses:
-            c_name = course.get("title", "Unnamed Course")
-            c_id = course["_id"]
-            
-            # Session Info
-            c_session_id = course.get("sessionId")
-            session = sessions_map.get(c_session_id)
-            session_str = f"{session.get('name', 'Unknown Session')}" if session else ""
-            
-            # Teacher
-            c_teacher_id = course.get("teacherId")
-            c_teacher_name = teachers_map.get(c_teacher_id, "Unknown Instructor")
-            
-            # Correct Weighted Grade Calculation (Overall)
-            earned_points = 0
-            total_possible_points = 0
-            
-            # Get grades for this course
-            c_grades = [g for g in grades if g.get("courseId") == c_id]
-            
-            # Category Breakdown Calculation
-            c_categories = categories_map.get(c_id, [])
-            cat_strings = []
-            
-            for cat in c_categories:
-                # Find items for this category
-                cat_items = [i for i in grade_items if i.get("categoryId") == cat["_id"]]
-                cat_item_ids = [i["_id"] for i in cat_items]
-                
-                # Find grades for these items
-                cat_grades = [g for g in c_grades if g.get("itemId") in cat_item_ids]
-                
-                cat_earned = sum([g.get("score", 0) for g in cat_grades])
-                cat_possible = sum([items_map.get(g.get("itemId"), {}).get("maxPoints", 100) for g in cat_grades])
-                
-                if cat_possible > 0:
-                    cat_avg = (cat_earned / cat_possible) * 100
-                    cat_strings.append(f"{cat['name']} ({cat['weight']}%): {cat_avg:.1f}%")
-                else:
-                    cat_strings.append(f"{cat['name']} ({cat['weight']}%): No grades")
-
-            # Overall Calc
-            for g in c_grades:
-                g_item_id = g.get("itemId")
-                item = items_map.get(g_item_id)
-                possible = item["maxPoints"] if item and "maxPoints" in item else g.get("maxPoints", 100)
-                score = g.get("score", 0)
-                earned_points += score
-                total_possible_points += possible
-                
-            if total_possible_points > 0:
-                final_avg = (earned_points / total_possible_points) * 100
-                avg_str = f"{final_avg:.1f}%"
-            else:
-                avg_str = "No grades yet"
-            
-            # Documents
-            c_docs = docs_map.get(c_id, [])
-            docs_str = ", ".join(c_docs) if c_docs else "No documents"
-            
-            course_details = f"Course: {c_name} ({session_str})\n"
-            course_details += f"  - Professor: {c_teacher_name}\n"
-            course_details += f"  - Overall Average: {avg_str}\n"
-            if cat_strings:
-                course_details += f"  - Breakdown: {', '.join(cat_strings)}\n"
-            course_details += f"  - Materials: {docs_str}"
-
-            rich_courses_context.append(course_details)
-        
-        if not rich_courses_context:
-            rich_courses_context.append("No active courses found.")
-            
-        # 7. Fetch Program Info
-        program_name = "Unknown Program"
-        if courses and "programId" in courses[0]:
-            p_id = courses[0]["programId"]
-            program = await db.programs.find_one({"_id": p_id})
-            if program:
-                program_name = program.get("name", "Unknown Program")
-
-        context_str = f"""Student: {student_name}
-Program: {program_name}
-Total Active Courses: {len(courses)}
-        
-=== ENROLLED COURSES & MATERIALS ===
-{chr(10).join(rich_courses_context)}
+        # Stage 3: everything that depends on the course ids, concurrently
+        async def course_stats():
+            # Materialized summaries (one indexed lookup), computed here only for courses the store lacks
+            summaries = {c_id: s["stats"] for c_id, s in (await load_summaries(db, sid, course_ids)).items()}
+            missing = [c for c in course_ids if str(c) not in summaries]
+            if missing:
+                computed = await compute_summaries(db, missing, [sid])
+                summaries.update({c_id: rows[str(sid)]["stats"] for c_id, rows in computed.items()})
+            return summaries
 
-=== TEACHER REPORTS ===
-{chr(10).join(reports_context) if reports_context else "No teacher reports available."}
-"""
-        return context_str
+        async def fetch_program():
+            if program_id is None:
+                return None
+            return await db.programs.find_one({"_id": program_id}, PROGRAM_FIELDS)
+
+        stage_start = time.perf_counter()
+        teachers, stats_map, documents, program = await asyncio.gather(
+            _collect(_find(db.users, {"_id": {"$in": teacher_ids}}, PERSON_FIELDS)) if teacher_ids else _none(),
+            course_stats(),
+            _collect(_find(db.documents, {"courseId": in_courses}, DOCUMENT_FIELDS)),
+            fetch_program(),
+        )
+        timings["courseData"] = time.perf_counter() - stage_start
+        stage_start = time.perf_counter()
+
+        teachers_map = {t["_id"]: f"{t.get('firstName', '')} {t.get('lastName', '')}" for t in teachers or []}
+        course_averages = {}
+        rich_courses_context = render_courses(
+            courses, sessions_map, teachers_map, stats_map, documents, course_averages
+        )
+        reports_context = render_reports(reports, courses)
+
+        # Program Info (fetched with the course data)
+        program_name = "Unknown Program"
+        if program:
+            program_name = program.get("name", "Unknown Program")
+        course_titles = {str(c["_id"]): c.get("title", "Unnamed Course") for c in courses}
+        context = StudentContext(student_name, program_name, len(courses), rich_courses_context, reports_context,
+                                 course_titles, course_averages)
+        timings["render"] = time.perf_counter() - stage_start
+        _record_timings(timings)
+        return context, [str(c) for c in course_ids]
 
     except Exception as e:
         logger.error(f"Error fetching context: {e}")
-        return "Error fetching student context."
+        return "Error fetching student context.", None
@@ -1,13 +1,22 @@
 import os
+import json
+import time
+import asyncio
 import logging
 from typing import List, Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from motor.motor_asyncio import AsyncIOMotorClient
 from groq import AsyncGroq
 from bson import ObjectId
-from context_engine import get_student_context
+from context_engine import StudentContext, build_student_context, add_excerpts, context_stage_stats
+from context_cache import context_cache, ContextWatcher
+from prompt_builder import build_prompt, PromptPlan
+from response_cache import response_cache
+from quick_answers import quick_answer
+from retrieval import retrieval_index
 
 # Configuration
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +24,12 @@ logger = logging.getLogger(__name__)
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017/edu_platform")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Invalidate cached contexts from Mongo changes (see context_cache.py)
+CONTEXT_WATCH = os.getenv("CONTEXT_WATCH", "true").lower() == "true"
+
+CHAT_MODEL = "llama-3.3-70b-versatile" # Newest model
+CHAT_TEMPERATURE = 0.3
+CHAT_MAX_TOKENS = 800
 
 app = FastAPI(title="EduPlatform ChatAI Service", version="1.0")
 
@@ -31,6 +46,16 @@ mongo_client = AsyncIOMotorClient(MONGO_URI)
 db = mongo_client.edu_platform
 
 groq_client = AsyncGroq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+context_watcher = ContextWatcher(db, context_cache)
+
+@app.on_event("startup")
+async def startup():
+    if CONTEXT_WATCH:
+        await context_watcher.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await context_watcher.stop()
 
 # Models
 class ChatMessage(BaseModel):
@@ -47,55 +72,181 @@ class ChatRequest(BaseModel):
 async def health():
     return {"status": "ok", "service": "chatai-service"}
 
+@app.get("/chat/metrics")
+async def metrics():
+    return {
+        "contextCache": context_cache.stats(),
+        "contextStages": context_stage_stats(),
+        "retrieval": retrieval_index.stats(),
+        "responses": response_cache.stats(),
+    }
+
+def _history(request: ChatRequest) -> list:
+    return [{"role": m.role, "content": m.content} for m in request.history]
+
+def plan_prompt(context, request: ChatRequest) -> PromptPlan:
+    """Budgeted messages for Groq (see prompt_builder.py), logged with their token counts"""
+    plan = build_prompt(context, request.message, _history(request))
+    logger.info(f"Prompt for {request.studentId}: {plan.usage}")
+    return plan
+
+async def student_context(student_id: str):
+    """StudentContext (cached per student between messages), or an error message"""
+    built = False
+
+    async def build():
+        nonlocal built
+        built = True
+        return await build_student_context(db, student_id)
+
+    context = await context_cache.get_or_build(student_id, build)
+    # Size and origin only: the text itself holds grades, reports and names
+    logger.info(f"Context for {student_id}: {len(str(context))} chars ({'built' if built else 'cached'})")
+    return context
+
+async def lookup_answer(request: ChatRequest) -> tuple:
+    """
+    (answer, source, cache key, context). The answer comes straight from the
+    structured context ("direct", see quick_answers.py) or from the response
+    cache ("cache"); it is None when the LLM has to answer ("llm").
+    """
+    context = await student_context(request.studentId)
+    answer = quick_answer(context, request.message)
+    if answer is not None:
+        return answer, "direct", None, context
+
+    context = await add_excerpts(db, context, request.message)
+    if not isinstance(context, StudentContext):
+        # Error message instead of a context: never cached
+        return None, "llm", None, context
+    key = response_cache.key(context.version(), request.message, _history(request))
+    answer = response_cache.get(key)
+    return answer, "cache" if answer is not None else "llm", key, context
+
+def ndjson(payload) -> str:
+    return json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+
+def _chunk_usage(chunk) -> Optional[Dict[str, Any]]:
+    """Token usage of a streamed chunk (Groq sends it on the last one, under x_groq)"""
+    return _usage(getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None))
+
+def _usage(usage) -> Optional[Dict[str, Any]]:
+    if usage is None:
+        return None
+    return {
+        "promptTokens": usage.prompt_tokens,
+        "completionTokens": usage.completion_tokens,
+        "totalTokens": usage.total_tokens,
+    }
+
 @app.post("/chat/message")
 async def chat_message(request: ChatRequest):
     if not groq_client:
         raise HTTPException(status_code=503, detail="AI Service not configured")
 
     try:
-        # 1. Build Context
-        context = await get_student_context(db, request.studentId)
-        logger.info(f"Generated Context for {request.studentId}:\n{context}") # Debug log
-
-        # 2. System Prompt
-        system_prompt = f"""You are an advanced AI educational tutor.
-        
-        Context Data:
-        {context}
-        
-        Instructions:
-        - Help the student succeed using ONLY the provided context.
-        - BE CONCISE. Answer ONLY what is asked. 
-        - DO NOT list all courses unless explicitly asked.
-        - If asked "What is my program?", just state the Program Name from the context.
-        
-        - If the student asks about "reports" or "feedback":
-          - CHECK the "TEACHER REPORTS" section above.
-          - If it says "No teacher reports available", YOU MUST SAY there are no reports. DO NOT INVENT ONE.
-          
-        - Do not halluciation data that is not in the context.
-        """
-
-        # 3. Construct Messages
-        messages = [{"role": "system", "content": system_prompt}]
-        # Add history (limit to last 5 for context window)
-        for msg in request.history[-5:]:
-            messages.append({"role": msg.role, "content": msg.content})
-        
-        # Add current message
-        messages.append({"role": "user", "content": request.message})
-
-        # 4. Call Groq
+        started = time.perf_counter()
+        # 1. Direct / cached answer, else Context (+ course material for this question)
+        answer, source, key, context = await lookup_answer(request)
+        if answer is not None:
+            response_cache.record(source, time.perf_counter() - started)
+            return {"response": answer, "context_used": True, "source": source}
+
+        # 2. Budgeted messages
+        plan = plan_prompt(context, request)
+
+        # 3. Call Groq
         completion = await groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile", # Newest model
-            messages=messages,
-            temperature=0.3, 
-            max_tokens=800
+            model=CHAT_MODEL,
+            messages=plan.messages,
+            temperature=CHAT_TEMPERATURE,
+            max_tokens=CHAT_MAX_TOKENS
         )
 
         response = completion.choices[0].message.content
-        return {"response": response, "context_used": True}
+        if key is not None and response:
+            response_cache.put(key, response)
+        response_cache.record(source, time.perf_counter() - started)
+        return {
+            "response": response,
+            "context_used": True,
+            "source": source,
+            "prompt": plan.usage,
+            "usage": _usage(getattr(completion, "usage", None)),
+        }
 
     except Exception as e:
         logger.error(f"Chat Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/chat/message/stream")
+async def chat_message_stream(request: ChatRequest, http_request: Request):
+    """
+    Same answer as /chat/message, streamed as NDJSON while Groq generates it:
+    {"type": "token", "content": ...} lines, then one {"type": "done"} line with
+    its source, usage and timings ({"type": "error"} instead if it fails
+    midway). Direct and cached answers come as a single token line. A client
+    disconnect closes the upstream Groq stream.
+    """
+    if not groq_client:
+        raise HTTPException(status_code=503, detail="AI Service not configured")
+
+    async def generate():
+        started = time.perf_counter()
+        timing = {}
+        usage = None
+        stream = None
+        try:
+            answer, source, key, context = await lookup_answer(request)
+            timing["contextMs"] = round((time.perf_counter() - started) * 1000, 1)
+            if answer is not None:
+                yield ndjson({"type": "token", "content": answer})
+                timing["firstTokenMs"] = timing["totalMs"] = round((time.perf_counter() - started) * 1000, 1)
+                response_cache.record(source, time.perf_counter() - started)
+                yield ndjson({"type": "done", "source": source, "usage": None, "timing": timing, "context_used": True})
+                return
+
+            plan = plan_prompt(context, request)
+            stream = await groq_client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=plan.messages,
+                temperature=CHAT_TEMPERATURE,
+                max_tokens=CHAT_MAX_TOKENS,
+                stream=True
+            )
+            parts = []
+            async for chunk in stream:
+                usage = _chunk_usage(chunk) or usage
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if not content:
+                    continue
+                if "firstTokenMs" not in timing:
+                    timing["firstTokenMs"] = round((time.perf_counter() - started) * 1000, 1)
+                parts.append(content)
+                yield ndjson({"type": "token", "content": content})
+                if await http_request.is_disconnected():
+                    logger.info(f"Chat stream: client of {request.studentId} went away")
+                    return
+
+            # Only complete answers are cached
+            if key is not None and parts:
+                response_cache.put(key, "".join(parts))
+            timing["totalMs"] = round((time.perf_counter() - started) * 1000, 1)
+            response_cache.record(source, time.perf_counter() - started)
+            yield ndjson({"type": "done", "source": source, "model": CHAT_MODEL, "usage": usage, "prompt": plan.usage,
+                         "timing": timing, "context_used": True})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Chat Stream Error: {e}")
+            yield ndjson({"type": "error", "detail": str(e)})
+        finally:
+            # Stops the Groq generation when we stop reading (disconnect / error)
+            if stream is not None:
+                await stream.close()
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
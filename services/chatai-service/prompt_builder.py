@@ -0,0 +1,196 @@
+"""
+Token-budgeted prompt assembly for the chat routes.
+
+The full student context grows with the student's load (every course block,
+every teacher report) and the history is sent as is, so prompts get long
+for the students who ask the most. build_prompt keeps the prompt under
+PROMPT_TOKEN_BUDGET:
+
+- history: the last HISTORY_VERBATIM_MESSAGES messages are kept verbatim
+  (within HISTORY_TOKEN_BUDGET); older ones are folded into a short
+  extractive summary in the system prompt
+- context: the header (student, program) always goes in; course blocks,
+  teacher reports and course material excerpts are ranked by their word
+  overlap with the question (course titles weigh more, report wording
+  favours the reports, excerpts were retrieved for the question) and added
+  greedily until the budget is spent, then put back in their original order
+  with a note naming what was left out
+
+Tokens are estimated from the text length (CHARS_PER_TOKEN), no tokenizer
+is needed; Groq's usage gives the exact count afterwards.
+"""
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, Union
+
+from context_engine import StudentContext
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+HISTORY_VERBATIM_MESSAGES = int(os.getenv("HISTORY_VERBATIM_MESSAGES", "4"))
+CHARS_PER_TOKEN = float(os.getenv("CHARS_PER_TOKEN", "4"))
+
+# Older messages: at most this many, each clipped, in the history summary
+HISTORY_SUMMARY_MESSAGES = 10
+HISTORY_SUMMARY_CHARS = 160
+
+TITLE_WEIGHT = 3
+REPORT_WORDS = {
+    "report", "reports", "feedback", "comment", "comments", "teacher", "teachers",
+    "rapport", "rapports", "commentaire", "commentaires", "professeur", "prof", "enseignant",
+}
+STOP_WORDS = {
+    "the", "and", "for", "what", "how", "are", "was", "with", "about", "can", "you", "your", "my",
+    "les", "des", "une", "est", "que", "qui", "pour", "dans", "avec", "mon", "mes", "quel", "quelle",
+    "course", "cours",
+}
+
+SYSTEM_PROMPT = """You are an advanced AI educational tutor.
+        
+        Context Data:
+        {context}
+        
+        Instructions:
+        - Help the student succeed using ONLY the provided context.
+        - BE CONCISE. Answer ONLY what is asked. 
+        - DO NOT list all courses unless explicitly asked.
+        - If asked "What is my program?", just state the Program Name from the context.
+        
+        - If the student asks about "reports" or "feedback":
+          - CHECK the "TEACHER REPORTS" section above.
+          - If it says "No teacher reports available", YOU MUST SAY there are no reports. DO NOT INVENT ONE.
+          
+        - Do not halluciation data that is not in the context.
+        """
+
+
+def count_tokens(text: str) -> int:
+    """Estimated tokens of a text (~CHARS_PER_TOKEN characters each)"""
+    return int(len(text) / CHARS_PER_TOKEN + 0.5) if text else 0
+
+
+def words(text: str) -> set:
+    """Lowercased, accent-free words of 3+ letters and numbers, stop words removed"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return {w for w in re.findall(r"[a-z0-9]+", text) if (len(w) >= 3 or w.isdigit()) and w not in STOP_WORDS}
+
+
+def score_section(question: set, section: str) -> int:
+    """Word overlap with the question, first line (course title) weighted"""
+    title, _, body = section.partition("\n")
+    title_words = words(title)
+    return TITLE_WEIGHT * len(question & title_words) + len(question & (words(body) - title_words))
+
+
+def select_sections(context: StudentContext, question: str, budget: int) -> tuple:
+    """(context text within `budget` tokens, kept course blocks, kept reports, kept excerpts, omitted count)"""
+    full = context.text()
+    if count_tokens(full) <= budget:
+        return full, len(context.courses), len(context.reports), len(context.excerpts), 0
+
+    asked = words(question)
+    report_bonus = TITLE_WEIGHT if asked & REPORT_WORDS else 0
+    sections = [("course", n, text, score_section(asked, text)) for n, text in enumerate(context.courses)]
+    sections += [("report", n, text, score_section(asked, text) + report_bonus) for n, text in enumerate(context.reports)]
+    sections += [("excerpt", n, text, score_section(asked, text) + TITLE_WEIGHT) for n, text in enumerate(context.excerpts)]
+    # Best first; equal scores keep the context order (courses before reports)
+    ranked = sorted(sections, key=lambda s: -s[3])
+
+    # Room left once the header, the section titles and the worst-case notes are in
+    spent = count_tokens(context.text(_dropped_courses_note(context.courses),
+                                      _dropped_reports_note(len(context.reports)), []))
+    if context.excerpts:
+        spent += count_tokens("\n=== COURSE MATERIAL EXCERPTS ===\n")
+    kept = set()
+    for kind, n, text, _ in ranked:
+        cost = count_tokens(text) + 1
+        if spent + cost <= budget:
+            kept.add((kind, n))
+            spent += cost
+
+    courses = [t for n, t in enumerate(context.courses) if ("course", n) in kept]
+    reports = [t for n, t in enumerate(context.reports) if ("report", n) in kept]
+    excerpts = [t for n, t in enumerate(context.excerpts) if ("excerpt", n) in kept]
+    dropped_courses = [t for n, t in enumerate(context.courses) if ("course", n) not in kept]
+    omitted = len(sections) - len(kept)
+    text = context.text(courses + _dropped_courses_note(dropped_courses),
+                        reports + _dropped_reports_note(len(context.reports) - len(reports)), excerpts)
+    return text, len(courses), len(reports), len(excerpts), omitted
+
+
+def _dropped_courses_note(dropped: list) -> list:
+    if not dropped:
+        return []
+    titles = [block.partition("\n")[0].replace("Course: ", "", 1) for block in dropped]
+    return [f"Details left out (ask about them by name): {'; '.join(titles)}"]
+
+
+def _dropped_reports_note(dropped: int) -> list:
+    # Keeps "No teacher reports available" out of the text when some exist
+    return [f"- ({dropped} more teacher report(s) about other courses left out)"] if dropped else []
+
+
+def select_history(history: List[Dict[str, str]]) -> tuple:
+    """(verbatim messages, summary text of the older ones)"""
+    verbatim, spent = [], 0
+    for msg in reversed(history[-HISTORY_VERBATIM_MESSAGES:] if HISTORY_VERBATIM_MESSAGES > 0 else []):
+        cost = count_tokens(msg["content"])
+        if spent + cost > HISTORY_TOKEN_BUDGET:
+            break
+        verbatim.insert(0, msg)
+        spent += cost
+
+    older = history[:len(history) - len(verbatim)][-HISTORY_SUMMARY_MESSAGES:]
+    lines = []
+    for msg in older:
+        content = " ".join(msg["content"].split())
+        if len(content) > HISTORY_SUMMARY_CHARS:
+            content = content[:HISTORY_SUMMARY_CHARS].rsplit(" ", 1)[0] + "..."
+        lines.append(f"- {'Student' if msg['role'] == 'user' else 'Tutor'}: {content}")
+    return verbatim, "\n".join(lines)
+
+
+class PromptPlan:
+    """Messages for Groq and the token accounting behind them"""
+    __slots__ = ("messages", "usage")
+
+    def __init__(self, messages: list, usage: Dict[str, Any]):
+        self.messages = messages
+        self.usage = usage
+
+
+def build_prompt(context: Union[StudentContext, str], message: str, history: List[Dict[str, str]],
+                 budget: int = PROMPT_TOKEN_BUDGET) -> PromptPlan:
+    verbatim, summary = select_history(history)
+    summary_text = f"\n        Earlier in this conversation (summary):\n{summary}\n" if summary else ""
+
+    history_tokens = sum(count_tokens(m["content"]) for m in verbatim)
+    message_tokens = count_tokens(message)
+    fixed_tokens = count_tokens(SYSTEM_PROMPT.format(context="")) + count_tokens(summary_text)
+
+    if isinstance(context, StudentContext):
+        context_budget = budget - fixed_tokens - history_tokens - message_tokens
+        context_text, courses, reports, excerpts, omitted = select_sections(context, message, context_budget)
+    else:
+        # Error message instead of a context
+        context_text, courses, reports, excerpts, omitted = str(context), 0, 0, 0, 0
+
+    messages = [{"role": "system", "content": SYSTEM_PROMPT.format(context=context_text) + summary_text}]
+    messages += [{"role": m["role"], "content": m["content"]} for m in verbatim]
+    messages.append({"role": "user", "content": message})
+
+    context_tokens = count_tokens(context_text)
+    return PromptPlan(messages, {
+        "budget": budget,
+        "estimatedTokens": fixed_tokens + context_tokens + history_tokens + message_tokens,
+        "contextTokens": context_tokens,
+        "historyTokens": history_tokens,
+        "messageTokens": message_tokens,
+        "coursesKept": courses,
+        "reportsKept": reports,
+        "excerptsKept": excerpts,
+        "sectionsOmitted": omitted,
+        "historySummarized": len(history) - len(verbatim),
+    })
@@ -0,0 +1,102 @@
+"""
+Direct answers to the questions the structured student context answers on
+its own: program, teacher reports, number of courses, average in a course.
+
+Only whole questions that match one of the patterns below (after
+normalize_question) are answered here, in the language they were asked in;
+anything else, or a course name that does not match exactly one course,
+goes to the LLM.
+"""
+import re
+from typing import Optional
+
+from context_engine import StudentContext
+from response_cache import normalize_question
+
+PROGRAM = {
+    "en": [r"(what is|what s|whats|which is) my program(me)?( name)?", r"(which|what) program am i (in|enrolled in)"],
+    "fr": [r"(quel est|c est quoi) (le nom de )?mon programme", r"(dans )?quel programme (suis je|je suis)( inscrit| inscrite)?"],
+}
+REPORTS = {
+    "en": [r"(do i have|are there|have i got|did i get) any (teacher )?(reports?|feedback)( from my teachers)?"],
+    "fr": [r"(est ce que )?j ai (des|un|de) (rapports?|commentaires?)( de mes (profs|professeurs|enseignants))?",
+           r"ai je (des|un) (rapports?|commentaires?)"],
+}
+COURSE_COUNT = {
+    "en": [r"how many courses (do i have|am i (taking|enrolled in))( this (session|semester))?"],
+    "fr": [r"combien (de cours (ai je|j ai|est ce que j ai)|ai je de cours|j ai de cours)( cette session)?"],
+}
+AVERAGE = {
+    "en": [r"(what is|what s|whats) my (overall )?(average|grade) in (the )?(?P<course>.+)"],
+    "fr": [r"(quelle est|c est quoi) ma moyenne (en|dans|pour|du|de) (le cours |cours |la |le |l )?(?P<course>.+)"],
+}
+
+
+def _match(patterns: dict, question: str) -> tuple:
+    """(language, match) of the first pattern matching the whole question"""
+    for language, expressions in patterns.items():
+        for expression in expressions:
+            match = re.fullmatch(expression, question)
+            if match:
+                return language, match
+    return None, None
+
+
+def _find_course(context: StudentContext, name: str) -> Optional[str]:
+    """
+    Id of the only course whose whole title is `name` (normalized, optionally
+    followed by "course" / "class" / "cours"). Anything else, e.g. an exam of
+    a course or extra words, is left to the LLM.
+    """
+    name = re.sub(r" (course|class|cours)$", "", name)
+    matches = [cid for cid, title in context.course_titles.items() if normalize_question(title) == name]
+    return matches[0] if len(matches) == 1 else None
+
+
+def quick_answer(context, question: str) -> Optional[str]:
+    if not isinstance(context, StudentContext):
+        return None
+    question = normalize_question(question)
+
+    language, match = _match(PROGRAM, question)
+    if match:
+        if context.program_name == "Unknown Program":
+            return None
+        if language == "fr":
+            return f"Ton programme est {context.program_name}."
+        return f"Your program is {context.program_name}."
+
+    language, match = _match(REPORTS, question)
+    if match:
+        count = len(context.reports)
+        if language == "fr":
+            if not count:
+                return "Tu n'as aucun rapport d'enseignant pour le moment."
+            return f"Tu as {count} rapport(s) d'enseignant :\n" + "\n".join(context.reports)
+        if not count:
+            return "You don't have any teacher reports yet."
+        return f"You have {count} teacher report(s):\n" + "\n".join(context.reports)
+
+    language, match = _match(COURSE_COUNT, question)
+    if match:
+        titles = ", ".join(context.course_titles.values())
+        if language == "fr":
+            return f"Tu as {context.course_count} cours actif(s)" + (f" : {titles}." if titles else ".")
+        return f"You have {context.course_count} active course(s)" + (f": {titles}." if titles else ".")
+
+    language, match = _match(AVERAGE, question)
+    if match:
+        course_id = _find_course(context, match.group("course"))
+        if course_id is None or course_id not in context.course_averages:
+            return None
+        title = context.course_titles[course_id]
+        average = context.course_averages[course_id]
+        if language == "fr":
+            if average is None:
+                return f"Tu n'as pas encore de notes en {title}."
+            return f"Ta moyenne générale en {title} est de {average:.1f}%."
+        if average is None:
+            return f"You don't have any grades in {title} yet."
+        return f"Your overall average in {title} is {average:.1f}%."
+
+    return None
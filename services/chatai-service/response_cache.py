@@ -0,0 +1,93 @@
+"""
+Answer cache for the chat routes.
+
+Students ask the same questions again and again. An answer is reused when
+the same student context (its version hash, so any change to the grades,
+reports or documents behind it makes a new key), the same question once
+normalized, and the same recent history come back within
+RESPONSE_CACHE_TTL. Entries are LRU-evicted past RESPONSE_CACHE_MAX_ENTRIES.
+
+The cache also keeps the latency of every answer by source (direct: see
+quick_answers.py, cache, llm) for /chat/metrics.
+"""
+import os
+import re
+import time
+import hashlib
+import unicodedata
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# History messages that are part of the key (older ones are ignored)
+RESPONSE_CACHE_HISTORY = int(os.getenv("RESPONSE_CACHE_HISTORY", "2"))
+
+
+def normalize_question(text: str) -> str:
+    """Lowercased, accent-free, punctuation-free, single-spaced"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, answer)
+        self._latencies: Dict[str, deque] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(context_version: str, question: str, history: List[Dict[str, str]]) -> str:
+        recent = history[-RESPONSE_CACHE_HISTORY:] if RESPONSE_CACHE_HISTORY > 0 else []
+        parts = [context_version, normalize_question(question)]
+        parts += [f"{m['role']}:{normalize_question(m['content'])}" for m in recent]
+        return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, answer: str) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, answer)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def record(self, source: str, seconds: float) -> None:
+        """Latency of one answer by where it came from"""
+        self._latencies.setdefault(source, deque(maxlen=1000)).append(seconds)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        latency = {}
+        for source, samples in self._latencies.items():
+            ordered = sorted(samples)
+            latency[source] = {
+                "count": len(ordered),
+                "p50Ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                "p99Ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 1),
+            }
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / total, 3) if total else None,
+            "latency": latency,
+        }
+
+
+response_cache = ResponseCache()
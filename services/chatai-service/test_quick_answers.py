@@ -0,0 +1,29 @@
+"""
+Regression tests for quick_answers.quick_answer.
+
+    PYTHONPATH=../shared python -m pytest -q test_quick_answers.py
+"""
+from context_engine import StudentContext
+from quick_answers import quick_answer
+
+
+def context():
+    titles = {"c1": "Art", "c2": "Programmation 1", "c3": "Smart Contracts"}
+    averages = {"c1": 81.25, "c2": 64.0, "c3": None}
+    return StudentContext("Ana B", "Informatique", 3, [], [], titles, averages)
+
+
+def test_average_of_a_course_by_its_whole_title():
+    assert quick_answer(context(), "What's my average in Art?") == "Your overall average in Art is 81.2%."
+    assert quick_answer(context(), "what is my average in the art course") == "Your overall average in Art is 81.2%."
+    assert quick_answer(context(), "Quelle est ma moyenne en programmation 1 ?") == \
+        "Ta moyenne générale en Programmation 1 est de 64.0%."
+    assert quick_answer(context(), "What is my average in smart contracts?") == \
+        "You don't have any grades in Smart Contracts yet."
+
+
+def test_partial_or_longer_course_names_go_to_the_llm():
+    assert quick_answer(context(), "What is my average in smart?") is None
+    assert quick_answer(context(), "What is my average in programmation?") is None
+    assert quick_answer(context(), "What's my grade in the final exam of Art?") is None
+    assert quick_answer(context(), "What is my average in art history?") is None
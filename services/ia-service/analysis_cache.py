@@ -0,0 +1,127 @@
+import os
+import copy
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(24 * 3600)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "20000"))
+ANALYSIS_CACHE_MEMORY_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MEMORY_ENTRIES", "512"))
+# Check the collection size every N writes
+_TRIM_EVERY = 200
+
+
+def fingerprint(model: str, prompt: str, **params) -> str:
+    """Cache key: everything that determines the completion"""
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    for k in sorted(params):
+        h.update(f"\n{k}={params[k]}".encode("utf-8"))
+    h.update(b"\n")
+    h.update(prompt.encode("utf-8"))
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Cache of parsed LLM course analyses, keyed by the prompt fingerprint.
+    The prompt embeds the course stats, reports and document content, so a
+    new grade or report produces a new key and the old entry simply ages out.
+
+    - Memory tier: LRU of recent analyses (no DB round trip on reloads).
+    - Mongo tier (`iaanalysiscache`): survives restarts, expired by a TTL
+      index and trimmed to `max_entries` (oldest first).
+    """
+
+    def __init__(self, collection, ttl: int = ANALYSIS_CACHE_TTL,
+                 max_entries: int = ANALYSIS_CACHE_MAX_ENTRIES,
+                 memory_entries: int = ANALYSIS_CACHE_MEMORY_ENTRIES):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> (expires_at, analysis)
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self) -> None:
+        try:
+            await self.collection.create_index("expiresAt", expireAfterSeconds=0)
+            await self.collection.create_index("createdAt")
+        except PyMongoError as e:
+            logger.warning(f"Analysis cache: could not create indexes: {e}")
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            del self._memory[key]
+
+        try:
+            doc = await self.collection.find_one({"_id": key, "expiresAt": {"$gt": now}})
+        except PyMongoError as e:
+            logger.warning(f"Analysis cache read failed: {e}")
+            doc = None
+
+        if not doc:
+            self.misses += 1
+            return None
+        expires_at = doc["expiresAt"]
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        self._remember(key, expires_at, doc["analysis"])
+        self.hits += 1
+        return copy.deepcopy(doc["analysis"])
+
+    async def put(self, key: str, analysis: Dict[str, Any]) -> None:
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl)
+        self._remember(key, expires_at, copy.deepcopy(analysis))
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {"analysis": analysis, "createdAt": now, "expiresAt": expires_at},
+                upsert=True
+            )
+            self._writes += 1
+            if self._writes % _TRIM_EVERY == 0:
+                await self._trim()
+        except PyMongoError as e:
+            logger.warning(f"Analysis cache write failed: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / total, 3) if total else None,
+            "memoryEntries": len(self._memory),
+        }
+
+    def _remember(self, key: str, expires_at: datetime, analysis: Dict[str, Any]) -> None:
+        self._memory[key] = (expires_at, analysis)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    async def _trim(self) -> None:
+        """Drop the oldest entries beyond max_entries"""
+        count = await self.collection.estimated_document_count()
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        cursor = self.collection.find({}, {"_id": 1}).sort("createdAt", 1).limit(excess)
+        old_ids = [d["_id"] async for d in cursor]
+        if old_ids:
+            await self.collection.delete_many({"_id": {"$in": old_ids}})
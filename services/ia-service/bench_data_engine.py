@@ -0,0 +1,161 @@
+"""
+Microbenchmark for data_engine.assemble_courses.
+
+Builds synthetic students (10-50 courses, thousands of grades), checks that
+the indexed assembly returns exactly what the previous per-course rescans
+returned, and times both.
+
+    python bench_data_engine.py
+    python bench_data_engine.py --courses 10 25 50 --items 60 --repeat 20
+"""
+import random
+import argparse
+import statistics
+import time
+
+from bson import ObjectId
+
+from data_engine import assemble_courses
+from records import (
+    CourseRecord, GradeRecord, ItemRecord, CategoryRecord, DocumentRecord, ReportRecord, to_json
+)
+
+RECORD_TYPES = {
+    "course": CourseRecord, "grades": GradeRecord, "items": ItemRecord,
+    "categories": CategoryRecord, "documents": DocumentRecord, "reports": ReportRecord,
+}
+
+
+def _serialize_doc(doc):
+    """Full-document copy with stringified ObjectIds (pre-records output)"""
+    if not doc:
+        return {}
+    new_doc = doc.copy()
+    for k, v in new_doc.items():
+        if isinstance(v, ObjectId):
+            new_doc[k] = str(v)
+    return new_doc
+
+
+def restrict_to_records(courses: list) -> list:
+    """Legacy dicts reduced to the fields the records keep"""
+    def pick(record_type, doc):
+        return {name: doc.get(name) for name in record_type.__slots__}
+    result = []
+    for course in courses:
+        result.append({
+            key: pick(RECORD_TYPES[key], value) if key == "course"
+            else [pick(RECORD_TYPES[key], v) for v in value]
+            for key, value in course.items()
+        })
+    return result
+
+
+def legacy_assemble(enrollments, courses_map, all_grades, all_items,
+                    all_categories, all_docs, all_reports) -> list:
+    """Assembly stage as it was before indexing (reference for equality)"""
+    all_category_ids = set(c["_id"] for c in all_categories)
+    result_courses = []
+    for enrollment in enrollments:
+        c_id = enrollment.get("courseId")
+        if c_id not in courses_map:
+            continue
+        course_obj = courses_map[c_id]
+        c_grades = [g for g in all_grades if g.get("courseId") == c_id]
+        c_items_raw = [i for i in all_items if i.get("courseId") == c_id]
+        c_categories = [c for c in all_categories if c.get("courseId") == c_id]
+        valid_items = []
+        for item in c_items_raw:
+            has_max = item.get("maxPoints", 0) > 0
+            cat_id = item.get("categoryId")
+            has_cat = cat_id in all_category_ids
+            if has_max and has_cat:
+                valid_items.append(item)
+        if valid_items:
+            total_course_points = sum(i["maxPoints"] for i in valid_items)
+            total_evaluated_points = 0
+            for item in valid_items:
+                has_grade = any(g for g in c_grades if g.get("itemId") == item["_id"])
+                if has_grade:
+                    total_evaluated_points += item["maxPoints"]
+            if total_course_points > 0:
+                if total_evaluated_points / total_course_points >= 0.99:
+                    continue
+        c_docs = [d for d in all_docs if d.get("courseId") == c_id]
+        c_reports = [r for r in all_reports if r.get("courseId") == c_id]
+        result_courses.append({
+            "course": _serialize_doc(course_obj),
+            "grades": [_serialize_doc(g) for g in c_grades],
+            "items": [_serialize_doc(i) for i in valid_items],
+            "categories": [_serialize_doc(c) for c in c_categories],
+            "documents": [_serialize_doc(d) for d in c_docs],
+            "reports": [_serialize_doc(r) for r in c_reports]
+        })
+    return result_courses
+
+
+def synthetic_student(n_courses: int, items_per_course: int, seed: int = 0) -> tuple:
+    """Rows shaped like the Mongo documents get_student_data loads"""
+    rng = random.Random(seed)
+    sid = ObjectId()
+    courses, enrollments, grades, items, categories, docs, reports = [], [], [], [], [], [], []
+
+    for c in range(n_courses):
+        cid = ObjectId()
+        courses.append({"_id": cid, "title": f"Course {c}", "code": f"C{c:03d}", "sessionId": ObjectId()})
+        enrollments.append({"_id": ObjectId(), "studentId": sid, "courseId": cid})
+        cats = [ObjectId() for _ in range(4)]
+        categories += [{"_id": k, "courseId": cid, "name": f"Cat {j}", "weight": 25} for j, k in enumerate(cats)]
+        # Some courses are complete (skipped), most are in progress
+        graded_share = 1.0 if c % 7 == 0 else rng.uniform(0.2, 0.9)
+        for i in range(items_per_course):
+            iid = ObjectId()
+            # A few items have no points or an unknown category
+            cat = cats[i % 4] if i % 23 else ObjectId()
+            items.append({"_id": iid, "courseId": cid, "categoryId": cat, "title": f"Item {i}",
+                          "maxPoints": 0 if i % 31 == 30 else rng.choice([10, 20, 50, 100])})
+            if rng.random() < graded_share:
+                grades.append({"_id": ObjectId(), "studentId": sid, "courseId": cid, "itemId": iid,
+                               "score": rng.randint(0, 10), "maxPoints": 10})
+        docs += [{"_id": ObjectId(), "courseId": cid, "name": f"Doc {d}", "url": f"/uploads/documents/{c}-{d}.pdf"}
+                 for d in range(3)]
+        reports += [{"_id": ObjectId(), "studentId": sid, "courseId": cid, "report": "Bon travail"}]
+
+    rng.shuffle(grades)
+    rng.shuffle(items)
+    courses_map = {c["_id"]: c for c in courses}
+    return enrollments, courses_map, grades, items, categories, docs, reports
+
+
+def timed(fn, args, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--courses", type=int, nargs="+", default=[10, 20, 35, 50])
+    parser.add_argument("--items", type=int, default=80, help="grade items per course")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'courses':>7} {'grades':>7} {'items':>7} {'legacy ms':>10} {'indexed ms':>11} {'speedup':>8}")
+    for n in args.courses:
+        data = synthetic_student(n, args.items, seed=n)
+        expected = restrict_to_records(legacy_assemble(*data))
+        # Materialized stats are not part of the legacy output (no summaries here: always None)
+        actual = [{k: v for k, v in c.items() if k != "stats"} for c in to_json(assemble_courses(*data))]
+        assert actual == expected, f"Output differs for {n} courses"
+
+        legacy = timed(legacy_assemble, data, args.repeat)
+        indexed = timed(assemble_courses, data, args.repeat)
+        print(f"{n:>7} {len(data[2]):>7} {len(data[3]):>7} {legacy * 1000:>10.2f} "
+              f"{indexed * 1000:>11.2f} {legacy / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
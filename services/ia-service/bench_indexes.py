@@ -0,0 +1,156 @@
+"""
+Index benchmark against a local mongod.
+
+Seeds a college-sized dataset (thousands of students, hundreds of courses,
+hundreds of thousands of grades) into a scratch database, then times
+get_student_data and reports the documents examined by each hot query,
+first without the indexes and then after indexes.ensure_indexes.
+
+    docker run -d -p 27017:27017 mongo:7
+    python bench_indexes.py --uri mongodb://localhost:27017
+    python bench_indexes.py --students 5000 --courses 300 --sample 100
+
+The scratch database (--db, default edu_bench) is dropped when seeding.
+"""
+import random
+import asyncio
+import argparse
+import statistics
+import time
+
+from bson import ObjectId
+from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from data_engine import get_student_data
+from indexes import INDEXES, ensure_indexes, hot_queries
+
+
+def seed(db, students: int, courses: int, per_student: int, items: int, seed_value: int = 0) -> list:
+    """Insert the dataset, returns the student ids"""
+    rng = random.Random(seed_value)
+    college = ObjectId()
+    active, closed = ObjectId(), ObjectId()
+    db.sessions.insert_many([
+        {"_id": active, "name": "H26", "state": "ACTIVE", "collegeId": college},
+        {"_id": closed, "name": "A25", "state": "CLOSED", "collegeId": college},
+    ] + [{"name": f"S{i}", "state": "CLOSED", "collegeId": ObjectId()} for i in range(50)])
+
+    course_ids = [ObjectId() for _ in range(courses)]
+    db.courses.insert_many([
+        {"_id": cid, "title": f"Course {i}", "code": f"C{i:04d}", "description": "Description " * 20,
+         "sessionId": active if i % 3 else closed, "teacherId": ObjectId(), "programId": ObjectId(),
+         "collegeId": college}
+        for i, cid in enumerate(course_ids)
+    ])
+
+    course_items = {}
+    categories, grade_items = [], []
+    for cid in course_ids:
+        cats = [ObjectId() for _ in range(4)]
+        categories += [{"_id": k, "courseId": cid, "name": f"Cat {j}", "weight": 25} for j, k in enumerate(cats)]
+        course_items[cid] = [ObjectId() for _ in range(items)]
+        grade_items += [{"_id": iid, "courseId": cid, "categoryId": cats[n % 4], "title": f"Item {n}",
+                         "maxPoints": rng.choice([10, 20, 50, 100])}
+                        for n, iid in enumerate(course_items[cid])]
+    db.gradecategories.insert_many(categories)
+    db.gradeitems.insert_many(grade_items)
+    db.documents.insert_many([
+        {"courseId": cid, "name": f"Doc {d}", "url": f"/uploads/documents/{i}-{d}.pdf", "mimeType": "application/pdf"}
+        for i, cid in enumerate(course_ids) for d in range(5)
+    ])
+
+    student_ids = [ObjectId() for _ in range(students)]
+    db.users.insert_many([{"_id": sid, "role": "student", "firstName": "Étudiant", "lastName": str(i),
+                           "collegeId": college} for i, sid in enumerate(student_ids)])
+    enrollments, grades, reports = [], [], []
+    for sid in student_ids:
+        for cid in rng.sample(course_ids, per_student):
+            enrollments.append({"studentId": sid, "courseId": cid, "collegeId": college})
+            graded = rng.uniform(0.2, 0.9)
+            grades += [{"studentId": sid, "courseId": cid, "itemId": iid, "score": rng.randint(0, 10),
+                        "maxPoints": 10, "collegeId": college}
+                       for iid in course_items[cid] if rng.random() < graded]
+            if rng.random() < 0.3:
+                reports.append({"studentId": sid, "courseId": cid, "report": "Progrès constants."})
+        if len(grades) > 50000:
+            db.grades.insert_many(grades)
+            grades = []
+    if grades:
+        db.grades.insert_many(grades)
+    db.enrollments.insert_many(enrollments)
+    if reports:
+        db.studentreports.insert_many(reports)
+    return student_ids
+
+
+def docs_examined(db) -> dict:
+    """Documents examined by each hot query (executionStats)"""
+    examined = {}
+    for label, collection, query in hot_queries():
+        explained = db.command({"explain": {"find": collection, "filter": query}, "verbosity": "executionStats"})
+        examined[label] = explained["executionStats"]["totalDocsExamined"]
+    return examined
+
+
+async def time_students(uri: str, db_name: str, student_ids: list, engine: str) -> list:
+    db = AsyncIOMotorClient(uri)[db_name]
+    samples = []
+    for sid in student_ids:
+        start = time.perf_counter()
+        await get_student_data(db, str(sid), None, engine)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summary(samples: list) -> str:
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return f"p50 {statistics.median(ordered) * 1000:8.1f} ms   p99 {p99 * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="edu_bench")
+    parser.add_argument("--students", type=int, default=3000)
+    parser.add_argument("--courses", type=int, default=200)
+    parser.add_argument("--per-student", type=int, default=6, help="enrollments per student")
+    parser.add_argument("--items", type=int, default=40, help="grade items per course")
+    parser.add_argument("--sample", type=int, default=50, help="students timed per phase")
+    parser.add_argument("--engine", default="concurrent")
+    parser.add_argument("--no-seed", action="store_true", help="reuse the existing scratch database")
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    db = client[args.db]
+    if args.no_seed:
+        student_ids = [u["_id"] for u in db.users.find({"role": "student"}, {"_id": 1})]
+    else:
+        client.drop_database(args.db)
+        start = time.perf_counter()
+        student_ids = seed(db, args.students, args.courses, args.per_student, args.items)
+        print(f"Seeded {db.grades.estimated_document_count()} grades, "
+              f"{db.enrollments.estimated_document_count()} enrollments in {time.perf_counter() - start:.1f}s")
+
+    sample = random.Random(1).sample(student_ids, min(args.sample, len(student_ids)))
+
+    for collection in INDEXES:
+        db[collection].drop_indexes()
+    before = docs_examined(db)
+    before_t = asyncio.run(time_students(args.uri, args.db, sample, args.engine))
+
+    asyncio.run(ensure_indexes(AsyncIOMotorClient(args.uri)[args.db]))
+    after = docs_examined(db)
+    after_t = asyncio.run(time_students(args.uri, args.db, sample, args.engine))
+
+    print(f"\n{'query':<22} {'examined (no index)':>20} {'examined (indexed)':>19}")
+    for label in before:
+        print(f"{label:<22} {before[label]:>20} {after[label]:>19}")
+    print(f"\nget_student_data ({args.engine}, {len(sample)} students)")
+    print(f"  no indexes  {summary(before_t)}")
+    print(f"  indexed     {summary(after_t)}")
+
+
+if __name__ == "__main__":
+    main()
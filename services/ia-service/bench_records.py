@@ -0,0 +1,103 @@
+"""
+Benchmark: full documents + _serialize_doc copies vs projected rows + records.
+
+For realistic course / grade / document rows (with the extra fields the
+platform stores but the analysis never reads) it measures:
+- BSON bytes on the wire (what a find() without / with projection returns)
+- BSON decode time
+- peak memory (tracemalloc) of the materialized rows
+
+    python bench_records.py
+    python bench_records.py --rows 20000 --repeat 5
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import bson
+from bson import ObjectId
+
+from records import CourseRecord, GradeRecord, DocumentRecord
+
+
+def _serialize_doc(doc):
+    """Full-document copy with stringified ObjectIds (pre-records output)"""
+    new_doc = doc.copy()
+    for k, v in new_doc.items():
+        if isinstance(v, ObjectId):
+            new_doc[k] = str(v)
+    return new_doc
+
+
+def full_rows(n: int) -> dict:
+    """Rows as stored (fields the models define, timestamps, audit data...)"""
+    now = datetime.now(timezone.utc)
+    courses = [{
+        "_id": ObjectId(), "title": f"Course {i}", "code": f"C{i:04d}",
+        "description": "Introduction aux structures de données et aux algorithmes. " * 6,
+        "sessionId": ObjectId(), "teacherId": ObjectId(), "programId": ObjectId(),
+        "collegeId": ObjectId(), "schedule": [{"day": d, "start": "08:00", "end": "10:00", "room": "B-201"}
+                                              for d in ("lundi", "mercredi")],
+        "createdAt": now, "updatedAt": now, "__v": 0,
+    } for i in range(max(n // 50, 1))]
+    grades = [{
+        "_id": ObjectId(), "studentId": ObjectId(), "courseId": ObjectId(), "itemId": ObjectId(),
+        "teacherId": ObjectId(), "collegeId": ObjectId(), "score": i % 10, "maxPoints": 10,
+        "feedback": "Bon travail, revoir la question 3.", "createdAt": now, "updatedAt": now, "__v": 0,
+    } for i in range(n)]
+    documents = [{
+        "_id": ObjectId(), "courseId": ObjectId(), "teacherId": ObjectId(), "collegeId": ObjectId(),
+        "name": f"Notes de cours {i}.pdf", "url": f"/uploads/documents/{i}.pdf",
+        "mimeType": "application/pdf", "size": 123456, "description": "Chapitre " * 10,
+        "createdAt": now, "updatedAt": now, "__v": 0,
+    } for i in range(max(n // 20, 1))]
+    return {"courses": (courses, CourseRecord), "grades": (grades, GradeRecord),
+            "documents": (documents, DocumentRecord)}
+
+
+def project(doc: dict, fields: dict) -> dict:
+    return {k: doc[k] for k in fields if k in doc}
+
+
+def measure(encoded: list, build) -> tuple:
+    """(decode seconds, peak bytes) for decoding `encoded` and building rows"""
+    start = time.perf_counter()
+    decoded = [bson.decode(b) for b in encoded]
+    decode_s = time.perf_counter() - start
+
+    tracemalloc.start()
+    rows = [build(bson.decode(b)) for b in encoded]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del rows, decoded
+    return decode_s, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="grades (courses = rows/50, documents = rows/20)")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'collection':>10} {'rows':>6} {'full KB':>8} {'proj KB':>8} "
+          f"{'full dec ms':>11} {'proj dec ms':>11} {'dict MB':>8} {'record MB':>9}")
+    for name, (rows, record_type) in full_rows(args.rows).items():
+        fields = record_type.projection()
+        full = [bson.encode(d) for d in rows]
+        projected = [bson.encode(project(d, fields)) for d in rows]
+
+        full_runs = [measure(full, _serialize_doc) for _ in range(args.repeat)]
+        proj_runs = [measure(projected, record_type.from_doc) for _ in range(args.repeat)]
+
+        print(f"{name:>10} {len(rows):>6} "
+              f"{sum(map(len, full)) / 1024:>8.0f} {sum(map(len, projected)) / 1024:>8.0f} "
+              f"{statistics.median(r[0] for r in full_runs) * 1000:>11.2f} "
+              f"{statistics.median(r[0] for r in proj_runs) * 1000:>11.2f} "
+              f"{statistics.median(r[1] for r in full_runs) / 2**20:>8.2f} "
+              f"{statistics.median(r[1] for r in proj_runs) / 2**20:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Course / cohort analysis: every enrolled student of one or more courses.
+
+Each course is loaded once (course, items, categories, documents, then the
+whole roster's enrollments, grades and reports, one query each), the stats
+of all its students come from one grade_stats roster computation, and
+document content is fetched once per course and shared by every student's
+prompt (indexed chunks relevant to the student's reports when the course is
+in the retrieval index).
+
+LLM summaries are optional: they go through a small pool of workers on the
+scheduler's batch lane, so interactive /ia/analyze/student requests keep
+priority. Events are yielded as they are ready:
+
+- {"type": "course"}   course metadata and risk distribution
+- {"type": "student"}  one per enrolled student, with their stats
+- {"type": "summary"}  one per requested LLM summary, in completion order
+- {"type": "error"}    a course that could not be analyzed
+"""
+import os
+import json
+import asyncio
+import logging
+from functools import partial
+from typing import AsyncIterator, List, Optional
+
+import numpy as np
+from bson import ObjectId
+
+from grade_stats import CourseStats, RISK_LABELS
+from records import CourseRecord, ItemRecord, CategoryRecord, DocumentRecord, ReportRecord
+from data_engine import COURSE_FIELDS, ITEM_FIELDS, CATEGORY_FIELDS, DOCUMENT_FIELDS, CURSOR_BATCH_SIZE
+from utils import determine_context, fetch_documents_content, retrieve_course_content, call_ai
+from http_client import http_pool
+from scheduler import PRIORITY_BATCH
+from retrieval import retrieval_index
+
+logger = logging.getLogger(__name__)
+
+# Concurrent LLM summaries of one cohort request
+COHORT_LLM_WORKERS = int(os.getenv("COHORT_LLM_WORKERS", "2"))
+# Upper bounds of one request
+COHORT_MAX_COURSES = int(os.getenv("COHORT_MAX_COURSES", "50"))
+COHORT_MAX_SUMMARIES = int(os.getenv("COHORT_MAX_SUMMARIES", "200"))
+
+ROSTER_GRADE_FIELDS = {"studentId": 1, "itemId": 1, "score": 1}
+ROSTER_REPORT_FIELDS = {"studentId": 1, "courseId": 1, "report": 1, "createdAt": 1}
+NAME_FIELDS = {"firstName": 1, "lastName": 1}
+
+
+def _find(collection, query, fields):
+    return collection.find(query, fields).batch_size(CURSOR_BATCH_SIZE)
+
+
+async def _all(cursor) -> list:
+    return [doc async for doc in cursor]
+
+
+async def _grade_columns(cursor) -> tuple:
+    """Roster grades folded straight into (studentIds, itemIds, scores) columns"""
+    students, items, scores = [], [], []
+    async for g in cursor:
+        if g.get("studentId") and g.get("itemId"):
+            students.append(str(g["studentId"]))
+            items.append(str(g["itemId"]))
+            scores.append(g.get("score"))
+    return students, items, scores
+
+
+async def resolve_courses(db, course_ids: Optional[List[str]] = None, program_id: Optional[str] = None,
+                          college_id: Optional[str] = None) -> List[ObjectId]:
+    """
+    Explicit course ids, or the program's courses in the active sessions.
+    Raises ValueError when either is more than COHORT_MAX_COURSES courses.
+    """
+    if course_ids:
+        if len(course_ids) > COHORT_MAX_COURSES:
+            raise ValueError(f"Too many courses (max {COHORT_MAX_COURSES})")
+        return [ObjectId(c) for c in course_ids]
+    session_query = {"state": "ACTIVE"}
+    if college_id:
+        session_query["collegeId"] = ObjectId(college_id)
+    session_ids = [s["_id"] async for s in _find(db.sessions, session_query, {"_id": 1})]
+    cursor = _find(db.courses, {"programId": ObjectId(program_id), "sessionId": {"$in": session_ids}}, {"_id": 1})
+    # One past the limit tells a full program from a truncated one
+    ids = [c["_id"] async for c in cursor.limit(COHORT_MAX_COURSES + 1)]
+    if len(ids) > COHORT_MAX_COURSES:
+        raise ValueError(f"Too many courses (max {COHORT_MAX_COURSES})")
+    return ids
+
+
+async def load_course(db, course_id: ObjectId) -> Optional[dict]:
+    """Course metadata and roster rows, each collection read once"""
+    course = await db.courses.find_one({"_id": course_id}, COURSE_FIELDS)
+    if not course:
+        return None
+    by_course = {"courseId": course_id}
+    items, categories, documents, enrollments, grades, reports = await asyncio.gather(
+        _all(_find(db.gradeitems, by_course, ITEM_FIELDS)),
+        _all(_find(db.gradecategories, by_course, CATEGORY_FIELDS)),
+        _all(_find(db.documents, by_course, DOCUMENT_FIELDS)),
+        _all(_find(db.enrollments, by_course, {"studentId": 1})),
+        _grade_columns(_find(db.grades, by_course, ROSTER_GRADE_FIELDS)),
+        _all(_find(db.studentreports, by_course, ROSTER_REPORT_FIELDS)),
+    )
+    # Same validity rule as data_engine: points > 0 and a known category
+    categories = [CategoryRecord.from_doc(c) for c in categories]
+    category_ids = {c._id for c in categories}
+    items = [i for i in map(ItemRecord.from_doc, items) if (i.maxPoints or 0) > 0 and i.categoryId in category_ids]
+
+    student_ids = list(dict.fromkeys(str(e["studentId"]) for e in enrollments if e.get("studentId")))
+    names = {}
+    if student_ids:
+        cursor = _find(db.users, {"_id": {"$in": [ObjectId(s) for s in student_ids]}}, NAME_FIELDS)
+        async for u in cursor:
+            names[str(u["_id"])] = f"{u.get('firstName', '')} {u.get('lastName', '')}".strip()
+
+    reports_by_student = {}
+    for r in reports:
+        reports_by_student.setdefault(str(r.get("studentId")), []).append(ReportRecord.from_doc(r))
+
+    return {
+        "course": CourseRecord.from_doc(course),
+        "items": items,
+        "categories": categories,
+        "documents": [DocumentRecord.from_doc(d) for d in documents],
+        "students": student_ids,
+        "names": names,
+        "grades": grades,
+        "reports": reports_by_student,
+    }
+
+
+def roster_stats(data: dict) -> tuple:
+    """(engine, stats arrays) for every student of a loaded course"""
+    engine = CourseStats(
+        ((i._id, i.maxPoints, i.categoryId) for i in data["items"]),
+        ((c._id, c.name, c.weight) for c in data["categories"])
+    )
+    return engine, engine.for_roster(data["students"], *data["grades"])
+
+
+def course_event(data: dict, stats: dict) -> dict:
+    averages = stats["average"]
+    graded = averages[~np.isnan(averages)]
+    distribution = {label: int((stats["risk"] == n).sum()) for n, label in enumerate(RISK_LABELS)}
+    distribution["aucune note"] = int((stats["risk"] < 0).sum())
+    return {
+        "type": "course",
+        "courseId": data["course"]._id,
+        "course": data["course"].to_json(),
+        "studentsCount": len(data["students"]),
+        "itemsCount": len(data["items"]),
+        "documentsCount": len(data["documents"]),
+        "averageMean": round(float(graded.mean()), 1) if len(graded) else None,
+        "riskDistribution": distribution,
+    }
+
+
+def _once(factory, tasks: list):
+    """Getter of one task, started by the first call and shared by the later ones (added to `tasks`)"""
+    started = []
+
+    def get() -> asyncio.Task:
+        if not started:
+            started.append(asyncio.ensure_future(factory()))
+            tasks.append(started[0])
+        return started[0]
+
+    return get
+
+
+async def summarize_student(job: dict, cache) -> dict:
+    """LLM summary of one student in one course (batch priority, runs on a worker)"""
+    course, stats = job["course"], job["stats"]
+    retrieved = contents = None
+    if job["documents"]:
+        # Course synced once (shared task), then this student's reports looked up
+        await job["synced"]()
+        retrieved = await retrieve_course_content(job["db"], course, job["reports"], sync=False)
+        if retrieved is None:
+            contents = await job["contents"]()
+    course_summary = {
+        "title": course.title or "Cours",
+        "code": course.code or "",
+        "description": course.description or "",
+        "average": stats["average"],
+        "completion": stats["completion"],
+        "hasGrades": stats["hasGrades"],
+    }
+    context_type, context_data = await determine_context(
+        stats["hasGrades"], job["reports"], job["documents"], contents, retrieved
+    )
+    analysis = await call_ai(json.dumps(course_summary), context_type, context_data, cache, priority=PRIORITY_BATCH)
+    analysis["risk"] = stats["risk"]
+    return {"type": "summary", "courseId": course._id, "studentId": job["studentId"], "analysis": analysis}
+
+
+async def analyze_cohort(db, course_ids: List[ObjectId], summaries: bool = False,
+                         summary_risk: Optional[List[str]] = None, cache=None) -> AsyncIterator[dict]:
+    """Yield the events of the module docstring for every course of `course_ids`"""
+    jobs = asyncio.Queue()
+    results = asyncio.Queue()
+    queued = delivered = 0
+    shared = []
+
+    async def worker():
+        while True:
+            job = await jobs.get()
+            try:
+                result = await summarize_student(job, cache)
+            except Exception as e:
+                logger.error(f"Cohort summary failed for {job['studentId']}: {e}")
+                result = {"type": "summary", "courseId": job["course"]._id, "studentId": job["studentId"],
+                          "error": "Analyse indisponible"}
+            await results.put(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(COHORT_LLM_WORKERS)] if summaries else []
+    try:
+        for course_id in course_ids:
+            try:
+                data = await load_course(db, course_id)
+            except Exception as e:
+                logger.error(f"Cohort load failed for course {course_id}: {e}")
+                data = None
+            if data is None:
+                yield {"type": "error", "courseId": str(course_id), "detail": "Cours introuvable ou illisible"}
+                continue
+
+            engine, stats = roster_stats(data)
+            yield course_event(data, stats)
+
+            # Per course, shared by its students' summaries: the index sync and,
+            # for students without indexed matches, the document prefixes
+            course = data["course"]
+            context_docs = [d for d in data["documents"][:3] if d.url]
+            synced = _once(partial(retrieval_index.sync_courses, db, [course._id]), shared)
+            contents = _once(partial(fetch_documents_content, http_pool.client, context_docs, db), shared)
+            for row, student_id in enumerate(data["students"]):
+                student_stats = engine.summary(stats, row)
+                yield {
+                    "type": "student",
+                    "courseId": data["course"]._id,
+                    "studentId": student_id,
+                    "name": data["names"].get(student_id, ""),
+                    "stats": student_stats,
+                }
+                wanted = summaries and queued < COHORT_MAX_SUMMARIES and (
+                    not summary_risk or student_stats["risk"] in summary_risk
+                )
+                if not wanted:
+                    continue
+                jobs.put_nowait({
+                    "db": db, "course": course, "studentId": student_id, "stats": student_stats,
+                    "reports": data["reports"].get(student_id, []), "documents": data["documents"],
+                    "synced": synced, "contents": contents,
+                })
+                queued += 1
+
+            # Summaries that finished while this course was loading
+            while not results.empty():
+                delivered += 1
+                yield results.get_nowait()
+
+        while delivered < queued:
+            delivered += 1
+            yield await results.get()
+    finally:
+        # Client went away (or done): stop the remaining summaries
+        for task in workers + shared:
+            task.cancel()
@@ -1,14 +1,52 @@
+import os
+import time
+import asyncio
 import logging
+from collections import deque
 from bson import ObjectId
 
+from records import (
+    CourseRecord, GradeRecord, ItemRecord, CategoryRecord, DocumentRecord, ReportRecord, SummaryRecord
+)
+from summaries import SUMMARIES_COLLECTION
+
 logger = logging.getLogger(__name__)
 
-async def get_student_data(db, student_id: str, college_id: str = None) -> dict:
+# Which fetch strategy get_student_data uses by default (see ENGINES)
+DATA_ENGINE = os.getenv("DATA_ENGINE", "concurrent")
+# Documents per cursor batch (rows are folded as they arrive, nothing is capped)
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "500"))
+
+# Fields each query needs (the records' fields + what filtering uses)
+ID_ONLY = {"_id": 1}
+ENROLLMENT_FIELDS = {"courseId": 1}
+COURSE_FIELDS = CourseRecord.projection()
+GRADE_FIELDS = GradeRecord.projection()
+ITEM_FIELDS = ItemRecord.projection()
+CATEGORY_FIELDS = CategoryRecord.projection()
+DOCUMENT_FIELDS = DocumentRecord.projection()
+REPORT_FIELDS = ReportRecord.projection()
+SUMMARY_FIELDS = SummaryRecord.projection()
+
+async def get_student_data(db, student_id: str, college_id: str = None, engine: str = None) -> dict:
     """
     Fetches data for student analysis, REPLICATING iaStudentController.js logic:
     1. Filter by Active Session.
     2. Filter out Completed Courses (>99% evaluated).
+
+    Each course carries its materialized "stats" (student_course_summaries)
+    when the store has them up to date; otherwise they are computed from the grades.
+
+    `engine` selects how the rows are fetched (default: DATA_ENGINE), the
+    assembled result is the same for every engine.
     """
+    name = engine or DATA_ENGINE
+    fetch = ENGINES.get(name)
+    if fetch is None:
+        logger.warning(f"Unknown data engine '{name}', using sequential")
+        name, fetch = "sequential", _fetch_sequential
+
+    start = time.perf_counter()
     try:
         try:
             sid = ObjectId(student_id)
@@ -16,131 +54,281 @@ async def get_student_data(db, student_id: str, college_id: str = None) -> dict:
             logger.error(f"Invalid student ID: {student_id}")
             return {"courses": []}
 
-        # 1. Fetch Active Sessions
         session_query = {"state": "ACTIVE"}
         if college_id:
             try:
                 session_query["collegeId"] = ObjectId(college_id)
             except:
                 pass
-        
-        active_sessions = await db.sessions.find(session_query).to_list(length=100)
-        active_session_ids = [s["_id"] for s in active_sessions]
 
-        if not active_session_ids:
+        rows = await fetch(db, sid, session_query)
+        if rows is None:
             return {"courses": []}
 
-        # 2. Fetch Active Courses (in those sessions)
-        courses_cursor = db.courses.find({"sessionId": {"$in": active_session_ids}})
-        active_courses = await courses_cursor.to_list(length=500)
-        active_course_ids = [c["_id"] for c in active_courses]
-        courses_map = {c["_id"]: c for c in active_courses}
-        
-        if not active_course_ids:
-            return {"courses": []}
+        # 5. Filter & Assemble
+        return {"courses": assemble_rows(*rows)}
 
-        # 3. Fetch Enrollments (for this student, in these courses)
-        enrollments_cursor = db.enrollments.find({
-            "studentId": sid,
-            "courseId": {"$in": active_course_ids}
-        })
-        enrollments = await enrollments_cursor.to_list(length=100)
-        
-        # 4. Fetch Grades, Items, Docs, Reports, CATEGORIES for these courses
-        active_enrolled_course_ids = [e["courseId"] for e in enrollments]
+    except Exception as e:
+        logger.error(f"Error in get_student_data ({name}): {e}")
+        return {"courses": []}
+    finally:
+        _latencies.setdefault(name, deque(maxlen=1000)).append(time.perf_counter() - start)
 
-        grades_cursor = db.grades.find({"studentId": sid, "courseId": {"$in": active_enrolled_course_ids}})
-        all_grades = await grades_cursor.to_list(length=500)
+class CourseRows:
+    """
+    Related rows of the enrolled courses, folded into per-course record lists
+    as the cursors stream (no intermediate full-result lists, no caps).
+    """
+    KINDS = {
+        "grades": GradeRecord,
+        "items": ItemRecord,
+        "categories": CategoryRecord,
+        "documents": DocumentRecord,
+        "reports": ReportRecord,
+        "summaries": SummaryRecord,
+    }
 
-        items_cursor = db.gradeitems.find({"courseId": {"$in": active_enrolled_course_ids}})
-        all_items = await items_cursor.to_list(length=1000)
+    def __init__(self):
+        self.by_kind = {kind: {} for kind in self.KINDS}
 
-        categories_cursor = db.gradecategories.find({"courseId": {"$in": active_enrolled_course_ids}})
-        all_categories = await categories_cursor.to_list(length=200)
-        # Map for quick existence check
-        # categoryId in items is an ObjectId.
-        all_category_ids = set(c["_id"] for c in all_categories)
+    def add(self, kind: str, doc: dict) -> None:
+        record = self.KINDS[kind].from_doc(doc)
+        self.by_kind[kind].setdefault(record.courseId, []).append(record)
 
-        docs_cursor = db.documents.find({"courseId": {"$in": active_enrolled_course_ids}})
-        all_docs = await docs_cursor.to_list(length=200)
+    async def fold(self, kind: str, cursor) -> None:
+        async for doc in cursor:
+            self.add(kind, doc)
 
-        reports_cursor = db.studentreports.find({"studentId": sid, "courseId": {"$in": active_enrolled_course_ids}})
-        all_reports = await reports_cursor.to_list(length=100)
+    def get(self, kind: str, course_id: str) -> list:
+        return self.by_kind[kind].get(course_id, [])
 
-        # 5. Filter & Assemble
-        result_courses = []
+    def category_ids(self) -> set:
+        return {c._id for rows in self.by_kind["categories"].values() for c in rows}
 
-        for enrollment in enrollments:
-            c_id = enrollment.get("courseId")
-            if c_id not in courses_map:
-                continue
-            
-            course_obj = courses_map[c_id]
-            
-            # Filter related data
-            c_grades = [g for g in all_grades if g.get("courseId") == c_id]
-            c_items_raw = [i for i in all_items if i.get("courseId") == c_id]
-            c_categories = [c for c in all_categories if c.get("courseId") == c_id]
-            
-            # --- CHECK COMPLETION LOGIC (Replicating computeFinalGrade) ---
-            # 1. Items with valid maxPoints AND Valid Category (Strict Parity)
-            valid_items = []
-            for item in c_items_raw:
-                has_max = item.get("maxPoints", 0) > 0
-                cat_id = item.get("categoryId")
-                has_cat = cat_id in all_category_ids
-                
-                if has_max and has_cat:
-                    valid_items.append(item)
-            
-            if not valid_items:
-                # No items = Not started. Include it.
-                pass
-            else:
-                total_course_points = sum(i["maxPoints"] for i in valid_items)
-                
-                # Check evaluated points
-                total_evaluated_points = 0
-                for item in valid_items:
-                    # Find grade for item
-                    has_grade = any(g for g in c_grades if g.get("itemId") == item["_id"])
-                    if has_grade:
-                        total_evaluated_points += item["maxPoints"]
-                
-                if total_course_points > 0:
-                    completion_ratio = total_evaluated_points / total_course_points
-                    # If > 99% complete, SKIP this course
-                    if completion_ratio >= 0.99:
-                        continue 
-            
-            # -------------------------------------------------------------
+def _find(collection, query, fields):
+    return collection.find(query, fields).batch_size(CURSOR_BATCH_SIZE)
 
-            c_docs = [d for d in all_docs if d.get("courseId") == c_id]
-            c_reports = [r for r in all_reports if r.get("courseId") == c_id]
+async def _load_courses(cursor) -> dict:
+    return {c["_id"]: c async for c in cursor}
 
-            result_courses.append({
-                "course": _serialize_doc(course_obj),
-                "grades": [_serialize_doc(g) for g in c_grades],
-                "items": [_serialize_doc(i) for i in valid_items], # Only return valid items
-                "categories": [_serialize_doc(c) for c in c_categories],
-                "documents": [_serialize_doc(d) for d in c_docs],
-                "reports": [_serialize_doc(r) for r in c_reports]
-            })
+async def _fetch_sequential(db, sid, session_query):
+    """One query after the other (9 round trips)"""
+    # 1. Fetch Active Sessions
+    active_session_ids = [s["_id"] async for s in _find(db.sessions, session_query, ID_ONLY)]
 
-        return {"courses": result_courses}
+    if not active_session_ids:
+        return None
 
-    except Exception as e:
-        logger.error(f"Error in get_student_data: {e}")
-        return {"courses": []}
+    # 2. Fetch Active Courses (in those sessions)
+    courses_map = await _load_courses(_find(db.courses, {"sessionId": {"$in": active_session_ids}}, COURSE_FIELDS))
+    active_course_ids = list(courses_map)
+    
+    if not active_course_ids:
+        return None
+
+    # 3. Fetch Enrollments (for this student, in these courses)
+    enrollments = [e async for e in _find(db.enrollments, {
+        "studentId": sid,
+        "courseId": {"$in": active_course_ids}
+    }, ENROLLMENT_FIELDS)]
+    
+    # 4. Fetch Grades, Items, Docs, Reports, CATEGORIES for these courses
+    course_ids = [e["courseId"] for e in enrollments]
+    rows = CourseRows()
+    for kind, collection, query, fields in _related_queries(db, sid, course_ids):
+        await rows.fold(kind, _find(collection, query, fields))
+
+    return enrollments, courses_map, rows
+
+async def _fetch_concurrent(db, sid, session_query):
+    """Same queries, independent ones in parallel (3 round-trip stages)"""
+    # Stage 1: active sessions
+    active_session_ids = [s["_id"] async for s in _find(db.sessions, session_query, ID_ONLY)]
+    if not active_session_ids:
+        return None
+
+    # Stage 2: active courses + the student's enrollments (filtered below)
+    async def student_enrollments():
+        return [e async for e in _find(db.enrollments, {"studentId": sid}, ENROLLMENT_FIELDS)]
+
+    courses_map, enrollments = await asyncio.gather(
+        _load_courses(_find(db.courses, {"sessionId": {"$in": active_session_ids}}, COURSE_FIELDS)),
+        student_enrollments(),
+    )
+    if not courses_map:
+        return None
+    enrollments = [e for e in enrollments if e.get("courseId") in courses_map]
+    course_ids = [e["courseId"] for e in enrollments]
+
+    # Stage 3: everything that only depends on the enrolled course ids
+    rows = CourseRows()
+    await asyncio.gather(*(
+        rows.fold(kind, _find(collection, query, fields))
+        for kind, collection, query, fields in _related_queries(db, sid, course_ids)
+    ))
+    return enrollments, courses_map, rows
+
+def _related_queries(db, sid, course_ids) -> list:
+    """(kind, collection, filter, projection) of the per-course rows"""
+    in_courses = {"$in": course_ids}
+    return [
+        ("grades", db.grades, {"studentId": sid, "courseId": in_courses}, GRADE_FIELDS),
+        ("items", db.gradeitems, {"courseId": in_courses}, ITEM_FIELDS),
+        ("categories", db.gradecategories, {"courseId": in_courses}, CATEGORY_FIELDS),
+        ("documents", db.documents, {"courseId": in_courses}, DOCUMENT_FIELDS),
+        ("reports", db.studentreports, {"studentId": sid, "courseId": in_courses}, REPORT_FIELDS),
+        ("summaries", db[SUMMARIES_COLLECTION], {"studentId": sid, "courseId": in_courses}, SUMMARY_FIELDS),
+    ]
+
+async def _fetch_aggregate(db, sid, session_query):
+    """Single $lookup aggregation on enrollments (1 round trip, MongoDB 5.0+)"""
+    def related(collection, fields, per_student=False):
+        stages = [{"$project": fields}]
+        if per_student:
+            stages.insert(0, {"$match": {"studentId": sid}})
+        return {"$lookup": {
+            "from": collection, "localField": "courseId", "foreignField": "courseId",
+            "pipeline": stages, "as": collection
+        }}
+
+    pipeline = [
+        {"$match": {"studentId": sid}},
+        {"$project": ENROLLMENT_FIELDS},
+        {"$lookup": {
+            "from": "courses", "localField": "courseId", "foreignField": "_id",
+            "pipeline": [{"$project": COURSE_FIELDS}], "as": "course"
+        }},
+        {"$unwind": "$course"},
+        {"$lookup": {
+            "from": "sessions", "localField": "course.sessionId", "foreignField": "_id",
+            "pipeline": [{"$match": session_query}, {"$project": {"_id": 1}}],
+            "as": "activeSession"
+        }},
+        {"$match": {"activeSession.0": {"$exists": True}}},
+        related("grades", GRADE_FIELDS, per_student=True),
+        related("gradeitems", ITEM_FIELDS),
+        related("gradecategories", CATEGORY_FIELDS),
+        related("documents", DOCUMENT_FIELDS),
+        related("studentreports", REPORT_FIELDS, per_student=True),
+        related(SUMMARIES_COLLECTION, SUMMARY_FIELDS, per_student=True),
+    ]
+    kinds = {"grades": "grades", "gradeitems": "items", "gradecategories": "categories",
+             "documents": "documents", "studentreports": "reports", SUMMARIES_COLLECTION: "summaries"}
+
+    enrollments = []
+    courses_map = {}
+    rows = CourseRows()
+    # Fold each enrollment row as it arrives (one copy per course even if enrolled twice)
+    async for row in db.enrollments.aggregate(pipeline, batchSize=CURSOR_BATCH_SIZE):
+        course = row.pop("course")
+        row.pop("activeSession", None)
+        first = course["_id"] not in courses_map
+        courses_map[course["_id"]] = course
+        for collection, kind in kinds.items():
+            docs = row.pop(collection, [])
+            if first:
+                for doc in docs:
+                    rows.add(kind, doc)
+        enrollments.append(row)
+
+    if not enrollments:
+        return None
+    return enrollments, courses_map, rows
+
+ENGINES = {
+    "sequential": _fetch_sequential,
+    "concurrent": _fetch_concurrent,
+    "aggregate": _fetch_aggregate,
+}
+
+# Recent get_student_data latencies per engine (A/B comparison)
+_latencies = {}
+
+def engine_latency_stats() -> dict:
+    stats = {}
+    for name, samples in _latencies.items():
+        ordered = sorted(samples)
+        if not ordered:
+            continue
+        stats[name] = {
+            "count": len(ordered),
+            "p50Ms": round(ordered[len(ordered) // 2] * 1000, 1),
+            "p99Ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 1),
+        }
+    return {"default": DATA_ENGINE, "engines": stats}
+
+def assemble_courses(enrollments, courses_map, all_grades, all_items,
+                     all_categories, all_docs, all_reports) -> list:
+    """assemble_rows for already materialized row lists"""
+    rows = CourseRows()
+    for kind, docs in (("grades", all_grades), ("items", all_items), ("categories", all_categories),
+                       ("documents", all_docs), ("reports", all_reports)):
+        for doc in docs:
+            rows.add(kind, doc)
+    return assemble_rows(enrollments, courses_map, rows)
+
+def assemble_rows(enrollments, courses_map, rows: CourseRows) -> list:
+    """
+    Filter & assemble per-course data for the enrolled courses from the
+    rows already folded per course.
+    """
+    # Map for quick existence check (record ids are strings)
+    all_category_ids = rows.category_ids()
+
+    result_courses = []
+
+    for enrollment in enrollments:
+        c_id = enrollment.get("courseId")
+        if c_id not in courses_map:
+            continue
+        
+        course_obj = courses_map[c_id]
+        key = str(c_id)
+        
+        # Related data
+        c_grades = rows.get("grades", key)
+        c_items_raw = rows.get("items", key)
+        
+        # --- CHECK COMPLETION LOGIC (Replicating computeFinalGrade) ---
+        # 1. Items with valid maxPoints AND Valid Category (Strict Parity)
+        valid_items = [
+            item for item in c_items_raw
+            if (item.maxPoints or 0) > 0 and item.categoryId in all_category_ids
+        ]
+        # Materialized stats only when they were computed from the rows loaded
+        # here: in polling mode deletions reach the store late, so completion
+        # always follows the live rows below
+        summary = rows.get("summaries", key)
+        fresh = summary and summary[0].matches(c_grades, c_items_raw)
+
+        if not valid_items:
+            # No items = Not started. Include it.
+            pass
+        else:
+            total_course_points = sum(i.maxPoints for i in valid_items)
+            
+            # Check evaluated points (items that have a grade)
+            graded_item_ids = set(g.itemId for g in c_grades)
+            total_evaluated_points = sum(
+                item.maxPoints for item in valid_items if item._id in graded_item_ids
+            )
+            
+            if total_course_points > 0:
+                completion_ratio = total_evaluated_points / total_course_points
+                # If > 99% complete, SKIP this course
+                if completion_ratio >= 0.99:
+                    continue 
+        
+        # -------------------------------------------------------------
+
+        result_courses.append({
+            "course": CourseRecord.from_doc(course_obj),
+            "grades": list(c_grades),
+            "items": valid_items, # Only return valid items
+            "categories": list(rows.get("categories", key)),
+            "documents": list(rows.get("documents", key)),
+            "reports": list(rows.get("reports", key)),
+            "stats": summary[0].stats if fresh else None
+        })
 
-def _serialize_doc(doc):
-    """Helper to convert ObjectId to string for consistency"""
-    if not doc:
-        return {}
-    new_doc = doc.copy()
-    if "_id" in new_doc:
-        new_doc["_id"] = str(new_doc["_id"])
-    for k, v in new_doc.items():
-        if isinstance(v, ObjectId):
-            new_doc[k] = str(v)
-    return new_doc
+    return result_courses
@@ -0,0 +1,195 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", "/app/cache/documents")
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOC_CACHE_MEMORY_ENTRIES = int(os.getenv("DOC_CACHE_MEMORY_ENTRIES", "256"))
+
+
+class DocumentTextCache:
+    """
+    Two-tier cache for text extracted from uploaded documents.
+
+    - Entries are stored per file path and tagged with a signature built from
+      (mtime, size, limit). A replaced upload changes the signature, so the
+      stale entry is dropped on the next lookup.
+    - Memory tier: small LRU of the most recent entries.
+    - Disk tier: one JSON file per document, LRU-evicted once the directory
+      grows past `max_bytes`. Survives restarts.
+    """
+
+    def __init__(self, cache_dir: str = DOC_CACHE_DIR, max_bytes: int = DOC_CACHE_MAX_BYTES,
+                 memory_entries: int = DOC_CACHE_MEMORY_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # path_key -> (signature, text)
+        self._disk = OrderedDict()    # filename -> size (oldest first)
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._disk_enabled = self._load_disk_index()
+
+    # ---------- Keys ----------
+
+    @staticmethod
+    def signature(file_path: str, limit: Optional[int] = None) -> Optional[str]:
+        """Signature of the file as it is on disk now (None if missing)"""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return None
+        return f"{st.st_mtime_ns}:{st.st_size}:{limit}"
+
+    @staticmethod
+    def _path_key(file_path: str) -> str:
+        return hashlib.sha256(os.path.abspath(file_path).encode("utf-8")).hexdigest()
+
+    # ---------- Public API ----------
+
+    def get(self, file_path: str, limit: Optional[int] = None) -> Optional[str]:
+        sig = self.signature(file_path, limit)
+        if sig is None:
+            return None
+        key = self._path_key(file_path)
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] == sig:
+                    self._memory.move_to_end(key)
+                    return entry[1]
+                # File was replaced since it was cached
+                del self._memory[key]
+
+        text = self._disk_get(key, sig)
+        if text is not None:
+            self._memory_put(key, sig, text)
+        return text
+
+    def put(self, file_path: str, text: str, limit: Optional[int] = None) -> None:
+        sig = self.signature(file_path, limit)
+        if sig is None:
+            return
+        key = self._path_key(file_path)
+        self._memory_put(key, sig, text)
+        self._disk_put(key, sig, text)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memoryEntries": len(self._memory),
+                "diskEntries": len(self._disk),
+                "diskBytes": self._disk_bytes,
+                "diskEnabled": self._disk_enabled,
+            }
+
+    # ---------- Memory tier ----------
+
+    def _memory_put(self, key: str, sig: str, text: str) -> None:
+        with self._lock:
+            self._memory[key] = (sig, text)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    # ---------- Disk tier ----------
+
+    def _load_disk_index(self) -> bool:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = []
+            for e in os.scandir(self.cache_dir):
+                if e.is_file() and e.name.endswith(".json"):
+                    st = e.stat()
+                    entries.append((st.st_mtime, e.name, st.st_size))
+        except OSError as e:
+            logger.warning(f"Document cache disabled on disk ({self.cache_dir}): {e}")
+            return False
+
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_bytes += size
+        return True
+
+    def _disk_get(self, key: str, sig: str) -> Optional[str]:
+        if not self._disk_enabled:
+            return None
+        name = f"{key}.json"
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name not in self._disk:
+                return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._disk_remove(name)
+            return None
+
+        if entry.get("sig") != sig:
+            self._disk_remove(name)
+            return None
+
+        # Bump recency (on disk too, so LRU order survives restarts)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if name in self._disk:
+                self._disk.move_to_end(name)
+        return entry.get("text", "")
+
+    def _disk_put(self, key: str, sig: str, text: str) -> None:
+        if not self._disk_enabled:
+            return
+        name = f"{key}.json"
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"sig": sig, "text": text}, f, ensure_ascii=False)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Document cache write failed: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(name, 0)
+            self._disk[name] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                old_name, old_size = self._disk.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_name)
+
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+            except OSError:
+                pass
+
+    def _disk_remove(self, name: str) -> None:
+        with self._lock:
+            self._disk_bytes -= self._disk.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+
+# Process-wide instance used by utils.fetch_document_content
+doc_cache = DocumentTextCache()
@@ -0,0 +1,87 @@
+import os
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "50"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+# Max wait for a free connection when the pool is exhausted
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+
+
+def http_timeout(read: float = HTTP_TIMEOUT) -> httpx.Timeout:
+    """The pool's timeouts with another read/write budget (slow calls), connect/pool unchanged"""
+    return httpx.Timeout(read, connect=HTTP_CONNECT_TIMEOUT, pool=HTTP_POOL_TIMEOUT)
+
+
+class SharedHttpClient:
+    """
+    One httpx.AsyncClient for the whole process (pdf-extractor, ...), so
+    bursts of analyses reuse warm keep-alive connections.
+    Opened in FastAPI startup, closed at shutdown.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._requests = 0
+        self._errors = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use too, so scripts work without the app lifecycle
+        if self._client is None or self._client.is_closed:
+            self._client = self._create()
+        return self._client
+
+    def _create(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=http_timeout(),
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+
+    async def _on_request(self, request: httpx.Request) -> None:
+        self._requests += 1
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        if response.status_code >= 500:
+            self._errors += 1
+
+    async def start(self) -> None:
+        self.client
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def metrics(self) -> dict:
+        """Connection pool usage (idle = kept alive and reusable)"""
+        connections = []
+        if self._client is not None:
+            # httpcore's pool is not part of httpx's public API, read it defensively
+            pool = getattr(self._client._transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "connections": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "maxConnections": HTTP_MAX_CONNECTIONS,
+            "maxKeepalive": HTTP_MAX_KEEPALIVE,
+            "requests": self._requests,
+            "serverErrors": self._errors,
+        }
+
+
+http_pool = SharedHttpClient()
@@ -0,0 +1,177 @@
+"""
+Indexes for the queries of the AI services (ia-service and chatai-service).
+
+Both services filter the academic collections on the same keys; nothing on
+the Node side declares indexes for them. This module owns that set:
+
+- ensure_indexes: creates the missing compound indexes (existing ones,
+  whatever their name, are left alone).
+- verify_query_plans: runs explain() on every hot query and warns when the
+  winning plan is a COLLSCAN.
+
+Both run in the background when ia-service starts (ENSURE_INDEXES=false to
+skip) and from the command line:
+
+    python indexes.py --ensure --check
+"""
+import os
+import asyncio
+import logging
+import argparse
+from typing import Dict, List
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "true").lower() == "true"
+
+# collection -> key lists (compound, in equality-first order)
+INDEXES = {
+    "sessions": [[("state", 1), ("collegeId", 1)]],
+    "courses": [[("sessionId", 1)]],
+    "enrollments": [[("studentId", 1), ("courseId", 1)], [("courseId", 1)]],
+    "grades": [[("studentId", 1), ("courseId", 1)], [("courseId", 1)]],
+    "gradeitems": [[("courseId", 1)]],
+    "gradecategories": [[("courseId", 1)]],
+    "documents": [[("courseId", 1)]],
+    "studentreports": [[("studentId", 1), ("courseId", 1)], [("courseId", 1)]],
+}
+
+
+def hot_queries() -> List[tuple]:
+    """(label, collection, filter) for the queries the services run per request"""
+    sid, college = ObjectId(), ObjectId()
+    ids = [ObjectId() for _ in range(5)]
+    return [
+        ("active sessions", "sessions", {"state": "ACTIVE", "collegeId": college}),
+        ("courses by session", "courses", {"sessionId": {"$in": ids}}),
+        ("student enrollments", "enrollments", {"studentId": sid}),
+        ("student grades", "grades", {"studentId": sid, "courseId": {"$in": ids}}),
+        ("course items", "gradeitems", {"courseId": {"$in": ids}}),
+        ("course categories", "gradecategories", {"courseId": {"$in": ids}}),
+        ("course documents", "documents", {"courseId": {"$in": ids}}),
+        ("student reports", "studentreports", {"studentId": sid, "courseId": {"$in": ids}}),
+        # Course / cohort analysis (cohort.py)
+        ("course roster", "enrollments", {"courseId": ids[0]}),
+        ("course grades", "grades", {"courseId": ids[0]}),
+        ("course reports", "studentreports", {"courseId": ids[0]}),
+    ]
+
+
+async def ensure_indexes(db) -> Dict[str, list]:
+    """Create the missing indexes. Returns {"created": [...], "existing": [...], "failed": [...]}"""
+    report = {"created": [], "existing": [], "failed": []}
+    for collection, specs in INDEXES.items():
+        try:
+            present = [list(ix["key"].items()) async for ix in db[collection].list_indexes()]
+        except PyMongoError as e:
+            logger.warning(f"Indexes: cannot list {collection}: {e}")
+            report["failed"] += [f"{collection}.{_label(keys)}" for keys in specs]
+            continue
+        for keys in specs:
+            label = f"{collection}.{_label(keys)}"
+            if keys in present:
+                report["existing"].append(label)
+                continue
+            try:
+                await db[collection].create_index(keys)
+                report["created"].append(label)
+                logger.info(f"Indexes: created {label}")
+            except PyMongoError as e:
+                report["failed"].append(label)
+                logger.warning(f"Indexes: could not create {label}: {e}")
+    return report
+
+
+async def explain_query(db, collection: str, query: dict) -> dict:
+    return await db.command({"explain": {"find": collection, "filter": query}, "verbosity": "queryPlanner"})
+
+
+def _stages(plan) -> List[str]:
+    """Every stage name of a (classic or SBE) plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages += _stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages += _stages(value)
+    return stages
+
+
+async def verify_query_plans(db) -> List[dict]:
+    """explain() each hot query; one entry per query with its winning plan stages"""
+    results = []
+    for label, collection, query in hot_queries():
+        try:
+            explained = await explain_query(db, collection, query)
+        except PyMongoError as e:
+            logger.warning(f"Indexes: explain failed for '{label}': {e}")
+            results.append({"query": label, "collection": collection, "error": str(e)})
+            continue
+        stages = _stages(explained.get("queryPlanner", {}).get("winningPlan", {}))
+        collscan = "COLLSCAN" in stages
+        if collscan:
+            logger.warning(f"⚠️ COLLSCAN: '{label}' on {collection} scans the whole collection "
+                           f"(filter {list(query)}); run `python indexes.py --ensure`")
+        results.append({"query": label, "collection": collection, "stages": stages, "collscan": collscan})
+    return results
+
+
+_last_report = {}
+
+
+async def startup_check(db) -> None:
+    """Ensure + verify, in the background of the service startup"""
+    try:
+        _last_report["ensure"] = await ensure_indexes(db)
+        _last_report["plans"] = await verify_query_plans(db)
+    except Exception as e:
+        logger.error(f"Index check failed: {e}")
+
+
+def index_report() -> dict:
+    plans = _last_report.get("plans", [])
+    return {
+        **_last_report.get("ensure", {}),
+        "collscans": [p["query"] for p in plans if p.get("collscan")],
+    }
+
+
+def _label(keys) -> str:
+    return "+".join(k for k, _ in keys)
+
+
+async def _cli(ensure: bool, check: bool) -> int:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/edu_platform")
+    db = AsyncIOMotorClient(mongo_uri).edu_platform
+    if ensure:
+        report = await ensure_indexes(db)
+        for state, labels in report.items():
+            for label in labels:
+                print(f"{state:>8}  {label}")
+    collscans = 0
+    if check:
+        for result in await verify_query_plans(db):
+            status = "ERROR" if "error" in result else ("COLLSCAN" if result["collscan"] else "ok")
+            collscans += status != "ok"
+            print(f"{status:>8}  {result['query']} ({result['collection']})")
+    return 1 if collscans else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ensure and verify the AI services' MongoDB indexes")
+    parser.add_argument("--ensure", action="store_true", help="create the missing indexes")
+    parser.add_argument("--check", action="store_true", help="explain() the hot queries, exit 1 on COLLSCAN")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if not (args.ensure or args.check):
+        parser.error("nothing to do (use --ensure and/or --check)")
+    raise SystemExit(asyncio.run(_cli(args.ensure, args.check)))
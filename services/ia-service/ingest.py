@@ -0,0 +1,324 @@
+"""
+Document text ingestion.
+
+Extracts the text of every course document once, when it is uploaded, and
+stores it (normalized, with per-page offsets) in the `documenttexts`
+collection. The analysis path then reads from this store instead of calling
+pdf-extractor.
+
+- DocumentIngestor: background task started with the service. Follows the
+  `documents` collection through a change stream and runs a periodic sync
+  pass that also catches replaced files and works without a replica set.
+- Every course whose texts changed gets its retrieval segment rebuilt
+  (shared/retrieval.py).
+- A failed extraction is retried by later passes with exponential backoff
+  (INGEST_RETRY_BASE, doubling up to INGEST_RETRY_MAX), or as soon as the
+  file changes.
+- Backfill (restart-safe, already-extracted documents are skipped):
+
+    python ingest.py --backfill --workers 4
+"""
+import os
+import re
+import time
+import asyncio
+import logging
+import argparse
+import unicodedata
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+from pymongo.errors import PyMongoError
+
+from retrieval import retrieval_index
+from http_client import http_timeout
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACTOR_URL = os.getenv("PDF_EXTRACTOR_URL", "http://pdf-extractor:5001")
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", "/app/uploads")
+INGEST_MAX_CHARS = int(os.getenv("INGEST_MAX_CHARS", "500000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_SYNC_INTERVAL = float(os.getenv("INGEST_SYNC_INTERVAL", "300"))
+# Read budget of one full-document extraction (connect / pool: the shared client's)
+INGEST_TIMEOUT = float(os.getenv("INGEST_TIMEOUT", "120"))
+# Failed extractions (extractor down, timeout...) are retried with exponential backoff
+INGEST_RETRY_BASE = float(os.getenv("INGEST_RETRY_BASE", "60"))
+INGEST_RETRY_MAX = float(os.getenv("INGEST_RETRY_MAX", "21600"))
+
+TEXTS_COLLECTION = "documenttexts"
+
+
+def normalize_text(text: str) -> str:
+    """NFC, no trailing spaces, collapsed runs of spaces and blank lines"""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = re.sub(r"[ \t\f\v]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def normalize_pages(content: str, page_offsets: List[dict]) -> tuple:
+    """Normalize page by page so offsets still point at page starts"""
+    if not page_offsets:
+        page_offsets = [{"page": 1, "offset": 0}]
+    bounds = [o["offset"] for o in page_offsets[1:]] + [len(content)]
+
+    parts = []
+    offsets = []
+    position = 0
+    for entry, end in zip(page_offsets, bounds):
+        page_text = normalize_text(content[entry["offset"]:end])
+        offsets.append({"page": entry["page"], "offset": position})
+        parts.append(page_text)
+        position += len(page_text) + 1  # "\n" separator
+    return "\n".join(parts), offsets
+
+
+def document_path(doc: dict) -> Optional[str]:
+    """Path relative to the uploads root (as pdf-extractor expects it)"""
+    url = doc.get("url")
+    if not url:
+        return None
+    return f"documents/{url.split('/')[-1]}"
+
+
+def file_signature(relative_path: str) -> Optional[dict]:
+    try:
+        st = os.stat(os.path.join(UPLOADS_DIR, relative_path))
+    except OSError:
+        return None
+    return {"mtimeNs": st.st_mtime_ns, "size": st.st_size}
+
+
+def same_file(entry: Optional[dict], signature: Optional[dict]) -> bool:
+    """True if the entry was made from the file as it is now"""
+    if not entry or signature is None:
+        return False
+    return entry.get("mtimeNs") == signature["mtimeNs"] and entry.get("size") == signature["size"]
+
+
+def is_current(entry: Optional[dict], signature: Optional[dict]) -> bool:
+    """True if the entry needs no new extraction: text extracted from the file
+    as it is now, or a failure on it whose retry is not due yet"""
+    if not same_file(entry, signature):
+        return False
+    if entry.get("error"):
+        return time.time() < entry.get("retryAt", 0)
+    return True
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before retrying a failed extraction, after `attempts` failures"""
+    return min(INGEST_RETRY_MAX, INGEST_RETRY_BASE * 2 ** max(attempts - 1, 0))
+
+
+async def ensure_store_indexes(db) -> None:
+    await db[TEXTS_COLLECTION].create_index("documentId", unique=True)
+    await db[TEXTS_COLLECTION].create_index("courseId")
+
+
+async def get_stored_texts(db, documents: list) -> Dict[str, str]:
+    """
+    Stored text for the given DocumentRecords, url -> text.
+    Entries whose file changed since extraction are ignored.
+    """
+    by_id = {d._id: d for d in documents if d._id}
+    ids = list(by_id)
+    if not ids:
+        return {}
+    texts = {}
+    cursor = db[TEXTS_COLLECTION].find(
+        {"documentId": {"$in": ids}, "error": None},
+        {"documentId": 1, "path": 1, "mtimeNs": 1, "size": 1, "text": 1}
+    )
+    async for entry in cursor:
+        doc = by_id.get(entry["documentId"])
+        if doc and is_current(entry, file_signature(entry.get("path", ""))):
+            texts[doc.url] = entry.get("text", "")
+    return texts
+
+
+async def ingest_document(db, http_client: httpx.AsyncClient, doc: dict, force: bool = False) -> str:
+    """Extract and store one `documents` entry.
+    Returns "stored", "skipped", "missing" or "failed"."""
+    doc_id = str(doc["_id"])
+    path = document_path(doc)
+    signature = file_signature(path) if path else None
+    if signature is None:
+        logger.debug(f"Ingest: file missing for document {doc_id} ({path})")
+        return "missing"
+
+    existing = await db[TEXTS_COLLECTION].find_one(
+        {"documentId": doc_id}, {"mtimeNs": 1, "size": 1, "error": 1, "attempts": 1, "retryAt": 1}
+    )
+    if not force and is_current(existing, signature):
+        return "skipped"
+
+    record = {
+        "documentId": doc_id,
+        "courseId": str(doc.get("courseId", "")),
+        "url": doc.get("url"),
+        "path": path,
+        **signature,
+        "extractedAt": datetime.now(timezone.utc),
+    }
+    try:
+        resp = await http_client.post(
+            f"{PDF_EXTRACTOR_URL}/extract/path",
+            json={"path": path, "max_chars": INGEST_MAX_CHARS},
+            timeout=http_timeout(INGEST_TIMEOUT)
+        )
+        if resp.status_code != 200:
+            raise RuntimeError(f"pdf-extractor returned {resp.status_code}")
+        data = resp.json()
+        text, offsets = normalize_pages(data.get("content", ""), data.get("pageOffsets", []))
+        record.update({
+            "text": text,
+            "pageOffsets": offsets,
+            "totalPages": data.get("totalPages"),
+            "error": None,
+        })
+        result = "stored"
+    except Exception as e:
+        # Keep the failure: retried with backoff, or at once if the file changes
+        attempts = 1
+        if existing and existing.get("error") and same_file(existing, signature):
+            attempts = existing.get("attempts", 0) + 1
+        delay = retry_delay(attempts)
+        logger.error(f"Ingest failed for document {doc_id} (attempt {attempts}, retry in {delay:.0f}s): {e}")
+        record.update({"text": "", "pageOffsets": [], "error": str(e),
+                       "attempts": attempts, "retryAt": time.time() + delay})
+        result = "failed"
+
+    await db[TEXTS_COLLECTION].replace_one({"documentId": doc_id}, record, upsert=True)
+    return result
+
+
+async def sync_all(db, http_client: httpx.AsyncClient, workers: int = INGEST_WORKERS,
+                   force: bool = False, changed: Optional[set] = None) -> Dict[str, int]:
+    """Walk the whole `documents` collection with a bounded pool of workers.
+    Ids of the courses whose stored texts changed are added to `changed`."""
+    counts = {"stored": 0, "skipped": 0, "missing": 0, "failed": 0}
+    queue = asyncio.Queue(maxsize=workers * 4)
+
+    async def worker():
+        while True:
+            doc = await queue.get()
+            try:
+                if doc is None:
+                    return
+                result = await ingest_document(db, http_client, doc, force)
+                counts[result] += 1
+                if changed is not None and result in ("stored", "failed"):
+                    changed.add(str(doc.get("courseId", "")))
+            except Exception as e:
+                logger.error(f"Ingest worker error: {e}")
+                counts["failed"] += 1
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        async for doc in db.documents.find({}, {"url": 1, "courseId": 1}).sort("_id", 1):
+            await queue.put(doc)
+    finally:
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks)
+    return counts
+
+
+async def remove_document(db, document_id) -> Optional[str]:
+    """Drop a document's stored text; returns its course id (None if it had none)"""
+    entry = await db[TEXTS_COLLECTION].find_one_and_delete({"documentId": str(document_id)}, {"courseId": 1})
+    return entry.get("courseId") if entry else None
+
+
+class DocumentIngestor:
+    """Keeps `documenttexts` in step with `documents` while the service runs"""
+
+    def __init__(self, db, http_client: httpx.AsyncClient, sync_interval: float = INGEST_SYNC_INTERVAL):
+        self.db = db
+        self.sync_interval = sync_interval
+        self._tasks = []
+        self._http = http_client
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._watch()),
+            asyncio.create_task(self._sync_loop()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _watch(self) -> None:
+        """Change stream on `documents` (replica set / Atlas only)"""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        try:
+            async with self.db.documents.watch(pipeline, full_document="updateLookup") as stream:
+                logger.info("Ingest: watching documents collection")
+                async for change in stream:
+                    if change["operationType"] == "delete":
+                        course_id = await remove_document(self.db, change["documentKey"]["_id"])
+                    elif change.get("fullDocument"):
+                        doc = change["fullDocument"]
+                        result = await ingest_document(self.db, self._http, doc)
+                        course_id = str(doc.get("courseId", "")) if result in ("stored", "failed") else None
+                    else:
+                        course_id = None
+                    if course_id:
+                        await retrieval_index.sync_courses(self.db, [course_id], force=True)
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            # Standalone mongod: no change streams, the sync loop does the work
+            logger.warning(f"Ingest: change stream unavailable ({e}), relying on periodic sync")
+
+    async def _sync_loop(self) -> None:
+        try:
+            await ensure_store_indexes(self.db)
+        except PyMongoError as e:
+            logger.warning(f"Ingest: could not create indexes: {e}")
+        while True:
+            try:
+                changed = set()
+                counts = await sync_all(self.db, self._http, changed=changed)
+                if counts["stored"] or counts["failed"]:
+                    logger.info(f"Ingest sync: {counts}")
+                await retrieval_index.sync_courses(self.db, changed, force=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingest sync error: {e}")
+            await asyncio.sleep(self.sync_interval)
+
+
+async def _backfill(workers: int, force: bool) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    mongo_uri = os.getenv("MONGO_URI", "mongodb://mongo:27017/edu_platform")
+    db = AsyncIOMotorClient(mongo_uri).edu_platform
+    await ensure_store_indexes(db)
+    changed = set()
+    async with httpx.AsyncClient() as http_client:
+        counts = await sync_all(db, http_client, workers, force, changed)
+    rebuilt = await retrieval_index.sync_courses(db, changed, force=True)
+    print(f"Backfill done: {counts}, {rebuilt} course indexes rebuilt")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract and store the text of course documents")
+    parser.add_argument("--backfill", action="store_true", help="process every document in the collection")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="concurrent extractions")
+    parser.add_argument("--force", action="store_true", help="re-extract documents that are up to date")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if not args.backfill:
+        parser.error("nothing to do (use --backfill)")
+    asyncio.run(_backfill(args.workers, args.force))
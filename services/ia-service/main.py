@@ -2,20 +2,34 @@ import asyncio
 import os
 import json
 import logging
-from typing import Optional
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from motor.motor_asyncio import AsyncIOMotorClient
+from bson.errors import InvalidId
 
 # Import utils
 from utils import (
     calculate_course_stats,
     determine_context,
+    fetch_documents_content,
+    retrieve_course_content,
     call_ai
 )
 # Import data engine
-from data_engine import get_student_data
+from data_engine import get_student_data, engine_latency_stats
+from ingest import DocumentIngestor
+from http_client import http_pool
+from doc_cache import doc_cache
+from analysis_cache import AnalysisCache
+from scheduler import groq_scheduler
+from records import to_json
+from indexes import ENSURE_INDEXES, startup_check, index_report
+from cohort import analyze_cohort, resolve_courses, COHORT_MAX_COURSES
+from retrieval import retrieval_index
+from summaries import SummaryUpdater
 
 # Configuration
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -23,6 +37,10 @@ logger = logging.getLogger(__name__)
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://mongo:27017/edu_platform")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+# Extract uploaded documents in the background (see ingest.py)
+INGEST_WATCH = os.getenv("INGEST_WATCH", "true").lower() == "true"
+# Keep student_course_summaries up to date from grade changes (see shared/summaries.py)
+SUMMARIES_WATCH = os.getenv("SUMMARIES_WATCH", "true").lower() == "true"
 
 if not GROQ_API_KEY:
     logger.warning("⚠️ GROQ_API_KEY non défini!")
@@ -41,52 +59,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+ingestor = None
+summary_updater = SummaryUpdater(db)
+analysis_cache = AnalysisCache(db.iaanalysiscache)
+
+
+@app.on_event("startup")
+async def startup():
+    global ingestor
+    await http_pool.start()
+    asyncio.create_task(analysis_cache.ensure_indexes())
+    if ENSURE_INDEXES:
+        asyncio.create_task(startup_check(db))
+    if INGEST_WATCH:
+        ingestor = DocumentIngestor(db, http_pool.client)
+        await ingestor.start()
+    if SUMMARIES_WATCH:
+        await summary_updater.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if ingestor:
+        await ingestor.stop()
+    await summary_updater.stop()
+    await http_pool.stop()
+
 
 class StudentIaRequest(BaseModel):
     studentId: str
     collegeId: Optional[str] = None
+    # Data engine override for A/B comparisons: sequential | concurrent | aggregate
+    engine: Optional[str] = None
+
+class CohortRequest(BaseModel):
+    # Either explicit courses or a program (its courses in the active sessions)
+    courseIds: Optional[List[str]] = None
+    programId: Optional[str] = None
+    collegeId: Optional[str] = None
+    # LLM summaries per student (batch priority), optionally only for some risk bands
+    summaries: bool = False
+    summaryRisk: Optional[List[str]] = None
 
 # Helper function for parallel processing
-async def analyze_single_course(course_data):
+async def analyze_single_course(course_data, doc_contents=None):
     try:
-        course = course_data.get("course", {})
+        course = course_data["course"]
         grades = course_data.get("grades", [])
         items = course_data.get("items", [])
+        categories = course_data.get("categories", [])
         documents = course_data.get("documents", [])
         reports = course_data.get("reports", [])
 
-        # Calculer stats via utils
-        stats = calculate_course_stats(grades, items)
+        # Stats matérialisées (student_course_summaries), sinon calculées via utils
+        stats = course_data.get("stats") or calculate_course_stats(grades, items, categories)
         has_grades = stats["hasGrades"]
 
         # Préparer le résumé pour l'IA
         course_summary = {
-            "title": course.get("title", "Cours"),
-            "code": course.get("code", ""),
-            "description": course.get("description", ""),
+            "title": course.title or "Cours",
+            "code": course.code or "",
+            "description": course.description or "",
             "average": stats["average"],
             "completion": stats["completion"],
             "hasGrades": has_grades,
         }
 
         # Déterminer le contexte d'analyse (Async) via utils
-        context_type, context_data = await determine_context(has_grades, reports, documents)
+        # Extraits pertinents de l'index de recherche, sinon début des documents
+        retrieved = await retrieve_course_content(db, course, reports) if documents else None
+        context_type, context_data = await determine_context(has_grades, reports, documents, doc_contents, retrieved)
         
         # Appeler l'IA via utils
-        analysis = await call_ai(json.dumps(course_summary), context_type, context_data)
+        analysis = await call_ai(json.dumps(course_summary), context_type, context_data, analysis_cache)
         
-        # Application des règles de classification de risque
-        if has_grades and stats["average"] is not None:
-            if stats["average"] < 60:
-                analysis["risk"] = "élevé"
-            elif stats["average"] < 75:
-                analysis["risk"] = "moyen"
-            else:
-                analysis["risk"] = "faible"
-        else:
-            analysis["risk"] = None
+        # Classification de risque (bandes de grade_stats)
+        analysis["risk"] = stats["risk"]
         
-        return {
+        return to_json({
             "course": course,
             "grades": grades,
             "items": items,
@@ -94,16 +144,31 @@ async def analyze_single_course(course_data):
             "reports": reports,
             "stats": stats,
             "analysis": analysis
-        }
+        })
     except Exception as e:
-        logger.error(f"Error analyzing course {course_data.get('course',{}).get('title')}: {e}")
+        course = course_data.get("course")
+        logger.error(f"Error analyzing course {getattr(course, 'title', None)}: {e}")
         # Return partial data or empty analysis on failure to not break the whole request
         return {
-            "course": course_data.get("course", {}),
+            "course": to_json(course) if course else {},
             "stats": {"error": "Analysis failed"},
             "analysis": {"risk": "inconnu", "shortSummary": "Erreur d'analyse", "advice": "Réessayez plus tard.", "focusPoints": [], "quiz": []}
         }
 
+async def prefetch_documents(courses_data):
+    """Extract every course's context documents in one pdf-extractor call
+    (courses in the retrieval index use their indexed chunks instead)"""
+    context_docs = [
+        doc for c in courses_data if not retrieval_index.has_course(c["course"]._id)
+        for doc in c.get("documents", [])[:3] if doc.url
+    ]
+    if not context_docs:
+        return {}
+    return await fetch_documents_content(http_pool.client, context_docs, db)
+
+def ndjson(payload) -> str:
+    return json.dumps(payload, ensure_ascii=False, default=str) + "\n"
+
 # ===== ROUTES =====
 
 @app.get("/")
@@ -126,20 +191,36 @@ async def health():
     }
 
 
+@app.get("/ia/metrics")
+async def metrics():
+    return {
+        "http": http_pool.metrics(),
+        "docCache": doc_cache.stats(),
+        "analysisCache": analysis_cache.stats(),
+        "groq": groq_scheduler.metrics(),
+        "dataEngine": engine_latency_stats(),
+        "indexes": index_report(),
+        "retrieval": retrieval_index.stats(),
+        "summaries": summary_updater.stats()
+    }
+
+
 @app.post("/ia/assist/student")
 @app.post("/ia/analyze/student")
 async def analyze_student(request: StudentIaRequest):
     """Analyse complète d'un étudiant (Direct DB Access) - PARALLEL EXECUTION"""
     try:
         # Récupérer les données via Data Engine (MongoDB Direct)
-        data = await get_student_data(db, request.studentId, request.collegeId)
+        data = await get_student_data(db, request.studentId, request.collegeId, request.engine)
         courses_data = data.get("courses", [])
 
         if not courses_data:
             return {"success": True, "courses": []}
 
+        doc_contents = await prefetch_documents(courses_data)
+
         # Parallel Execution
-        tasks = [analyze_single_course(c) for c in courses_data]
+        tasks = [analyze_single_course(c, doc_contents) for c in courses_data]
         analyzed_courses = await asyncio.gather(*tasks)
 
         return {
@@ -152,6 +233,103 @@ async def analyze_student(request: StudentIaRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ia/analyze/student/stream")
+async def analyze_student_stream(request: StudentIaRequest):
+    """
+    Variante streaming (NDJSON) de /ia/analyze/student:
+    - une ligne {"type": "stats"} par cours, immédiatement
+    - une ligne {"type": "course"} par cours dès que son analyse IA est prête
+      (ordre de complétion, même contenu que dans la réponse non-streaming)
+    - une ligne finale {"type": "done"}
+    """
+    async def generate():
+        tasks = []
+        try:
+            data = await get_student_data(db, request.studentId, request.collegeId, request.engine)
+            courses_data = data.get("courses", [])
+
+            for c in courses_data:
+                course = c["course"]
+                yield ndjson({
+                    "type": "stats",
+                    "courseId": course._id,
+                    "course": course.to_json(),
+                    "stats": c.get("stats") or calculate_course_stats(c.get("grades", []), c.get("items", []), c.get("categories", [])),
+                    "documentsCount": len(c.get("documents", [])),
+                    "reportsCount": len(c.get("reports", []))
+                })
+
+            if courses_data:
+                doc_contents = await prefetch_documents(courses_data)
+                tasks = [asyncio.create_task(analyze_single_course(c, doc_contents)) for c in courses_data]
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    yield ndjson({
+                        "type": "course",
+                        "courseId": result.get("course", {}).get("_id"),
+                        **result
+                    })
+
+            yield ndjson({"type": "done", "success": True, "count": len(courses_data)})
+        except Exception as e:
+            logger.error(f"Erreur analyse (stream): {e}")
+            yield ndjson({"type": "error", "success": False, "detail": str(e)})
+        finally:
+            # Client went away: stop the remaining analyses
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def stream_cohort(course_ids, request: CohortRequest) -> StreamingResponse:
+    """NDJSON stream of cohort.analyze_cohort events, then a "done" line"""
+    async def generate():
+        count = 0
+        try:
+            async for event in analyze_cohort(db, course_ids, request.summaries, request.summaryRisk, analysis_cache):
+                count += event["type"] == "student"
+                yield ndjson(event)
+            yield ndjson({"type": "done", "success": True, "courses": len(course_ids), "students": count})
+        except Exception as e:
+            logger.error(f"Erreur analyse cohorte: {e}")
+            yield ndjson({"type": "error", "success": False, "detail": str(e)})
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/ia/analyze/course/{course_id}")
+async def analyze_course(course_id: str, request: Optional[CohortRequest] = None):
+    """Statistiques (et résumés IA optionnels) de tous les étudiants d'un cours, en NDJSON"""
+    try:
+        course_ids = await resolve_courses(db, [course_id])
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Identifiant de cours invalide")
+    return stream_cohort(course_ids, request or CohortRequest())
+
+
+@app.post("/ia/analyze/cohort")
+async def analyze_cohort_route(request: CohortRequest):
+    """Même analyse pour plusieurs cours (courseIds) ou un programme (programId)"""
+    if not request.courseIds and not request.programId:
+        raise HTTPException(status_code=400, detail="courseIds ou programId requis")
+    try:
+        course_ids = await resolve_courses(db, request.courseIds, request.programId, request.collegeId)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Identifiant invalide")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Trop de cours (max {COHORT_MAX_COURSES})")
+    return stream_cohort(course_ids, request)
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 4003))
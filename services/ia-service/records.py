@@ -0,0 +1,87 @@
+"""
+Compact records for the rows the analysis actually uses.
+
+Each record declares its fields once: they are the Mongo projection of
+the query that loads it and the keys of its JSON form. Records use
+__slots__ (no per-instance dict) and stringify ObjectIds when they are
+built, instead of copying and walking every field of the full document.
+"""
+from typing import Any, Dict
+from bson import ObjectId
+
+
+class Record:
+    __slots__ = ()
+
+    @classmethod
+    def projection(cls) -> Dict[str, int]:
+        return {name: 1 for name in cls.__slots__}
+
+    @classmethod
+    def from_doc(cls, doc: dict) -> "Record":
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            value = doc.get(name)
+            if isinstance(value, ObjectId):
+                value = str(value)
+            setattr(record, name, value)
+        return record
+
+    def to_json(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other) -> bool:
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class CourseRecord(Record):
+    __slots__ = ("_id", "title", "code", "description", "sessionId", "teacherId", "programId")
+
+
+class GradeRecord(Record):
+    __slots__ = ("_id", "courseId", "itemId", "score", "maxPoints")
+
+
+class ItemRecord(Record):
+    __slots__ = ("_id", "courseId", "categoryId", "title", "maxPoints")
+
+
+class CategoryRecord(Record):
+    __slots__ = ("_id", "courseId", "name", "weight")
+
+
+class DocumentRecord(Record):
+    __slots__ = ("_id", "courseId", "name", "url")
+
+
+class ReportRecord(Record):
+    __slots__ = ("_id", "courseId", "report", "createdAt")
+
+
+class SummaryRecord(Record):
+    """Materialized stats of one student in one course (shared/summaries.py)"""
+    __slots__ = ("courseId", "stats", "completed", "gradeIds", "itemIds")
+
+    def matches(self, grades: list, items: list) -> bool:
+        """Computed from exactly these grades and items (none added or deleted since)"""
+        return (
+            {str(g) for g in self.gradeIds or []} == {g._id for g in grades if g.itemId}
+            and {str(i) for i in self.itemIds or []} == {i._id for i in items}
+        )
+
+
+def to_json(value):
+    """Records (also nested in dicts / lists) -> plain JSON-ready values"""
+    if isinstance(value, Record):
+        return value.to_json()
+    if isinstance(value, dict):
+        return {k: to_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [to_json(v) for v in value]
+    return value
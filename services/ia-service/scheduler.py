@@ -0,0 +1,236 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Budgets of the Groq account (requests / tokens per minute). Defaults: the
+# free tier limits of llama-3.3-70b-versatile, set them to the account's plan.
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30"))
+GROQ_TPM = int(os.getenv("GROQ_TPM", "12000"))
+# Completion tokens reserved per call: what an analysis typically returns,
+# not max_tokens (the reservation is corrected with the actual usage)
+GROQ_OUTPUT_ESTIMATE = int(os.getenv("GROQ_OUTPUT_ESTIMATE", "800"))
+GROQ_MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", "4"))
+GROQ_MAX_RETRIES = int(os.getenv("GROQ_MAX_RETRIES", "3"))
+GROQ_BACKOFF_BASE = float(os.getenv("GROQ_BACKOFF_BASE", "1"))
+GROQ_BACKOFF_MAX = float(os.getenv("GROQ_BACKOFF_MAX", "30"))
+
+# Priority lanes: lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+LANES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough prompt size (~4 chars per token) plus the expected completion (at most max_tokens)"""
+    return len(prompt) // 4 + min(max_tokens, GROQ_OUTPUT_ESTIMATE)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.capacity = float(max(per_minute, 1))
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 = now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def drain(self) -> None:
+        """The API said we are over the limit: stop granting until refilled"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class RateLimited(Exception):
+    pass
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429 or "429" in str(error)
+
+
+class GroqScheduler:
+    """
+    Process-wide gate in front of every Groq call.
+
+    A call waits in a priority queue (interactive before batch, FIFO inside
+    a lane) until a concurrency slot, one request from the RPM bucket and
+    its estimated tokens from the TPM bucket are all available. 429s are
+    retried after the server's Retry-After, or a jittered exponential
+    backoff, and go back through the queue.
+    """
+
+    def __init__(self, rpm: int = GROQ_RPM, tpm: int = GROQ_TPM,
+                 max_concurrency: int = GROQ_MAX_CONCURRENCY, max_retries: int = GROQ_MAX_RETRIES):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self._waiters = []  # heap of (priority, seq, tokens, future)
+        self._seq = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        # Counters
+        self.completed = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    # ---------- Public API ----------
+
+    async def run(self, call: Callable[[], Awaitable[Any]], est_tokens: int,
+                  priority: int = PRIORITY_INTERACTIVE) -> Any:
+        """Run `call` within the budgets. Raises the last error when retries are exhausted."""
+        for attempt in range(self.max_retries):
+            await self._acquire(priority, est_tokens)
+            try:
+                result = await call()
+            except Exception as e:
+                error = e
+            else:
+                error = None
+            finally:
+                # Also on cancellation (client gone): the slot must come back
+                self._release()
+
+            if error is None:
+                self.completed += 1
+                self._settle(result, est_tokens)
+                return result
+            if attempt == self.max_retries - 1:
+                self.failed += 1
+                raise error
+            delay = self._backoff(error, attempt)
+            logger.warning(f"Groq call failed (attempt {attempt + 1}/{self.max_retries}), "
+                           f"retrying in {delay:.1f}s: {error}")
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> dict:
+        depth = {name: 0 for name in LANES.values()}
+        for priority, _, _, fut in self._waiters:
+            if not fut.done():
+                depth[LANES.get(priority, str(priority))] += 1
+        return {
+            "queueDepth": depth,
+            "inFlight": self.in_flight,
+            "maxConcurrency": self.max_concurrency,
+            "requestsAvailable": round(self.requests.tokens, 1),
+            "tokensAvailable": round(self.tokens.tokens),
+            "completed": self.completed,
+            "rateLimited": self.rate_limited,
+            "failed": self.failed,
+        }
+
+    # ---------- Internals ----------
+
+    def _backoff(self, error: Exception, attempt: int) -> float:
+        if _is_rate_limit(error):
+            self.rate_limited += 1
+            # Everyone waits, not only this caller
+            self.requests.drain()
+            retry_after = _retry_after(error)
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, 1)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                return delay
+        # Full jitter: spread retries instead of retrying all together
+        return random.uniform(0, min(GROQ_BACKOFF_MAX, GROQ_BACKOFF_BASE * 2 ** (attempt + 1)))
+
+    def _settle(self, result: Any, est_tokens: int) -> None:
+        """Correct the reservation with the actual usage: refund the rest, or charge the overrun"""
+        usage = getattr(result, "usage", None)
+        used = getattr(usage, "total_tokens", None)
+        if used is None:
+            return
+        if used < est_tokens:
+            self.tokens.refund(est_tokens - used)
+        elif used > est_tokens:
+            self.tokens.consume(used - est_tokens)
+
+    async def _acquire(self, priority: int, est_tokens: int) -> None:
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._changed = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+        fut = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), est_tokens, fut))
+        self._changed.set()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted just before cancellation: hand the slot back
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._changed.clear()
+            # Forget callers that gave up
+            while self._waiters and self._waiters[0][3].done():
+                heapq.heappop(self._waiters)
+
+            wait = None
+            if self._waiters and self.in_flight < self.max_concurrency:
+                _, _, est_tokens, fut = self._waiters[0]
+                wait = max(
+                    self._paused_until - time.monotonic(),
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(est_tokens),
+                )
+                if wait <= 0:
+                    heapq.heappop(self._waiters)
+                    self.requests.consume(1)
+                    self.tokens.consume(est_tokens)
+                    self.in_flight += 1
+                    fut.set_result(None)
+                    continue
+
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+groq_scheduler = GroqScheduler()
@@ -0,0 +1,50 @@
+"""
+Regression tests for data_engine.assemble_rows with materialized summaries.
+
+    PYTHONPATH=../shared python -m pytest -q test_data_engine.py
+"""
+from bson import ObjectId
+
+from data_engine import CourseRows, assemble_rows
+from summaries import summarize_course
+
+
+def assemble(graded: int, summarized: int) -> tuple:
+    """
+    One course with 3 items: `graded` of them graded in the live rows, the
+    stored summary computed when `summarized` of them were.
+    """
+    sid, cid, cat = ObjectId(), ObjectId(), ObjectId()
+    items = [{"_id": ObjectId(), "courseId": cid, "categoryId": cat, "title": f"Item {i}", "maxPoints": 10}
+             for i in range(3)]
+    categories = [{"_id": cat, "courseId": cid, "name": "Examens", "weight": 100}]
+    grades = [{"_id": ObjectId(), "studentId": sid, "courseId": cid, "itemId": i["_id"], "score": 8}
+              for i in items]
+    summary = summarize_course(items, categories, grades[:summarized], [sid])[str(sid)]
+
+    rows = CourseRows()
+    for kind, docs in (("items", items), ("categories", categories), ("grades", grades[:graded]),
+                       ("summaries", [{"courseId": cid, **summary}])):
+        for doc in docs:
+            rows.add(kind, doc)
+    courses = assemble_rows([{"courseId": cid}], {cid: {"_id": cid, "title": "Chimie"}}, rows)
+    return courses, summary
+
+
+def test_fresh_summary_stats_are_used():
+    courses, summary = assemble(graded=2, summarized=2)
+    assert len(courses) == 1
+    assert courses[0]["stats"] == summary["stats"]
+
+
+def test_deleted_grade_overrides_a_stale_summary():
+    # Stored before the third grade was deleted: it still says completed
+    courses, summary = assemble(graded=2, summarized=3)
+    assert summary["completed"]
+    assert len(courses) == 1
+    assert courses[0]["stats"] is None
+
+
+def test_completed_course_is_skipped():
+    courses, _ = assemble(graded=3, summarized=3)
+    assert courses == []
@@ -0,0 +1,80 @@
+"""
+Regression tests for scheduler.GroqScheduler.
+
+    python -m pytest -q test_scheduler.py
+"""
+import asyncio
+
+import scheduler as scheduler_module
+from scheduler import GroqScheduler
+
+
+def test_cancelled_call_gives_its_slot_back():
+    async def scenario():
+        scheduler = GroqScheduler(rpm=1000, tpm=10 ** 6, max_concurrency=2)
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(3600)
+
+        for _ in range(2):
+            started.clear()
+            task = asyncio.create_task(scheduler.run(hang, est_tokens=10))
+            await started.wait()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        assert scheduler.in_flight == 0
+
+        async def answer():
+            return "ok"
+
+        assert await asyncio.wait_for(scheduler.run(answer, est_tokens=10), timeout=1) == "ok"
+        assert scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_failed_call_is_retried_and_released():
+    async def scenario():
+        scheduler = GroqScheduler(rpm=1000, tpm=10 ** 6, max_concurrency=1, max_retries=2)
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return "ok"
+
+        base = scheduler_module.GROQ_BACKOFF_BASE
+        scheduler_module.GROQ_BACKOFF_BASE = 0.001
+        try:
+            assert await scheduler.run(flaky, est_tokens=10) == "ok"
+        finally:
+            scheduler_module.GROQ_BACKOFF_BASE = base
+        assert len(calls) == 2 and scheduler.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_reservation_is_settled_with_actual_usage():
+    class Completion:
+        def __init__(self, total_tokens):
+            self.usage = type("Usage", (), {"total_tokens": total_tokens})()
+
+    async def scenario():
+        scheduler = GroqScheduler(rpm=1000, tpm=6000, max_concurrency=1)
+        scheduler.tokens.rate = 0.0  # no refill: only the reservations move the bucket
+
+        async def small():
+            return Completion(300)
+
+        async def large():
+            return Completion(1500)
+
+        await scheduler.run(small, est_tokens=1000)
+        assert scheduler.tokens.tokens == 5700
+        await scheduler.run(large, est_tokens=1000)
+        assert scheduler.tokens.tokens == 4200
+
+    asyncio.run(scenario())
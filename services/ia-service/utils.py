@@ -15,15 +15,34 @@ from prompts import (
     get_both_prompt,
     get_none_prompt
 )
+from doc_cache import doc_cache
+from ingest import get_stored_texts
+from http_client import http_pool
+from analysis_cache import fingerprint
+from scheduler import groq_scheduler, estimate_tokens, PRIORITY_INTERACTIVE
+from records import GradeRecord, ItemRecord, CategoryRecord
+from grade_stats import CourseStats
+from retrieval import retrieval_index
 
 logger = logging.getLogger(__name__)
 
 ACADEMIC_SERVICE_URL = os.getenv("ACADEMIC_SERVICE_URL", "http://academic-service:4002")
+PDF_EXTRACTOR_URL = os.getenv("PDF_EXTRACTOR_URL", "http://pdf-extractor:5001")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 client = AsyncGroq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
 
-def safe_parse_json(text: str) -> Dict[str, Any]:
-    """Parse JSON even with surrounding text"""
+AI_MODEL = "llama-3.3-70b-versatile"
+AI_TEMPERATURE = 0.7
+AI_MAX_TOKENS = 2000
+
+# Only this many characters of each document are sent to the LLM
+# (fallback when the course is not in the retrieval index)
+DOC_CONTENT_CHARS = 2000
+# Indexed chunks of the course documents sent instead of the prefixes
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+
+def parse_json(text: str) -> Optional[Dict[str, Any]]:
+    """Parse JSON even with surrounding text (None if there is none)"""
     try:
         return json.loads(text)
     except:
@@ -33,6 +52,13 @@ def safe_parse_json(text: str) -> Dict[str, Any]:
                 return json.loads(match.group(0))
             except:
                 pass
+    return None
+
+def safe_parse_json(text: str) -> Dict[str, Any]:
+    """Parse JSON even with surrounding text"""
+    parsed = parse_json(text)
+    if parsed is not None:
+        return parsed
     return {
         "risk": "inconnu",
         "shortSummary": "Analyse indisponible",
@@ -41,6 +67,9 @@ def safe_parse_json(text: str) -> Dict[str, Any]:
         "quiz": []
     }
 
+def _format_document(doc_name: str, content: str) -> str:
+    return f"\n--- Document: {doc_name} ---\n{content}"
+
 async def fetch_document_content(client: httpx.AsyncClient, doc_url: str, doc_name: str) -> str:
     """Fetch content for a single document from local storage (or pdf-extractor)"""
     try:
@@ -52,83 +81,185 @@ async def fetch_document_content(client: httpx.AsyncClient, doc_url: str, doc_na
             logger.warning(f"File not found locally: {file_path}")
             return ""
 
+        # Cached text (memory, then disk) - invalidated when the upload changes
+        cached = doc_cache.get(file_path, DOC_CONTENT_CHARS)
+        if cached is not None:
+            return _format_document(doc_name, cached)
+
         # Check extension
         if filename.lower().endswith(".pdf"):
-            # Send to PDF Extractor
-            # Note: We need to use synchronous open inside async function carefully, 
-            # or use run_in_executor, but for simplicity here we open/read.
-            with open(file_path, "rb") as f:
-                files = {"file": f}
-                # We use the client passed in, but it's an httpx.AsyncClient.
-                # requests format for files is different from httpx.
-                # httpx uses `files={'file': open(...)}` too but expects async or bytes.
-                # Let's read bytes first.
-                file_content = f.read()
-                
+            # pdf-extractor sees the same uploads volume: send the path, not the bytes
             resp = await client.post(
-                "http://pdf-extractor:5001/extract",
-                files={"file": (filename, file_content)},
-                timeout=30.0
+                f"{PDF_EXTRACTOR_URL}/extract/path",
+                json={"path": f"documents/{filename}", "max_chars": DOC_CONTENT_CHARS}
             )
+            if resp.status_code == 404:
+                # Extractor without the shared volume: fall back to uploading the file
+                with open(file_path, "rb") as f:
+                    file_content = f.read()
+                resp = await client.post(
+                    f"{PDF_EXTRACTOR_URL}/extract",
+                    params={"max_chars": DOC_CONTENT_CHARS},
+                    files={"file": (filename, file_content)}
+                )
             if resp.status_code == 200:
-                content = resp.json().get("content", "")
-                return f"\n--- Document: {doc_name} ---\n{content[:2000]}"
+                content = resp.json().get("content", "")[:DOC_CONTENT_CHARS]
+                doc_cache.put(file_path, content, DOC_CONTENT_CHARS)
+                return _format_document(doc_name, content)
             else:
                 logger.error(f"PDF Extractor failed: {resp.status_code}")
                 
         else:
             # Text file, read locally
             with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-                return f"\n--- Document: {doc_name} ---\n{content[:2000]}"
+                content = f.read(DOC_CONTENT_CHARS)
+            doc_cache.put(file_path, content, DOC_CONTENT_CHARS)
+            return _format_document(doc_name, content)
 
     except Exception as e:
         logger.error(f"Error reading doc {doc_name}: {e}")
     return ""
 
-async def determine_context(has_grades: bool, reports: list, documents: list) -> tuple:
-    """Determine analysis context based on available resources (Async)"""
+async def fetch_documents_content(client: httpx.AsyncClient, documents: list, db=None) -> Dict[str, str]:
+    """
+    Fetch content for many documents at once (url -> formatted content).
+    Lookup order: text cache, then the pre-extracted store (`documenttexts`,
+    when `db` is given), then pdf-extractor in a single /extract/batch call.
+    """
+    contents = {}
+    misses = []  # (doc, filename, file_path)
+
+    for doc in documents:
+        url = doc.url
+        if not url or url in contents:
+            continue
+        filename = url.split("/")[-1]
+        file_path = f"/app/uploads/documents/{filename}"
+
+        if not os.path.exists(file_path):
+            logger.warning(f"File not found locally: {file_path}")
+            contents[url] = ""
+            continue
+
+        cached = doc_cache.get(file_path, DOC_CONTENT_CHARS)
+        if cached is not None:
+            contents[url] = _format_document(doc.name or "", cached)
+        else:
+            contents[url] = None
+            misses.append((doc, filename, file_path))
+
+    stored = {}
+    if db is not None and misses:
+        try:
+            stored = await get_stored_texts(db, [doc for doc, _, _ in misses])
+        except Exception as e:
+            logger.error(f"Document text store unavailable: {e}")
+
+    pending = {}  # relative path -> (url, name, file_path)
+    for doc, filename, file_path in misses:
+        url, name = doc.url, doc.name or ""
+        if url in stored:
+            content = stored[url][:DOC_CONTENT_CHARS]
+            doc_cache.put(file_path, content, DOC_CONTENT_CHARS)
+            contents[url] = _format_document(name, content)
+        elif filename.lower().endswith(".pdf"):
+            pending[f"documents/{filename}"] = (url, name, file_path)
+        else:
+            contents[url] = await fetch_document_content(client, url, name)
+
+    if not pending:
+        return contents
+
+    try:
+        resp = await client.post(
+            f"{PDF_EXTRACTOR_URL}/extract/batch",
+            json={
+                "documents": [{"id": path, "path": path} for path in pending],
+                "max_chars": DOC_CONTENT_CHARS
+            }
+        )
+        if resp.status_code == 200:
+            for result in resp.json().get("results", []):
+                url, name, file_path = pending.pop(result.get("id"), (None, None, None))
+                if url is None:
+                    continue
+                if "error" in result:
+                    logger.error(f"PDF Extractor failed for {name}: {result['error']}")
+                    contents[url] = ""
+                    continue
+                content = result.get("content", "")[:DOC_CONTENT_CHARS]
+                doc_cache.put(file_path, content, DOC_CONTENT_CHARS)
+                contents[url] = _format_document(name, content)
+        else:
+            logger.error(f"PDF Extractor batch failed: {resp.status_code}")
+    except Exception as e:
+        logger.error(f"PDF Extractor batch error: {e}")
+
+    # Anything the batch did not answer: one request per document
+    if pending:
+        leftovers = list(pending.values())
+        results = await asyncio.gather(*[
+            fetch_document_content(client, url, name) for url, name, _ in leftovers
+        ])
+        for (url, _, _), content in zip(leftovers, results):
+            contents[url] = content
+
+    return contents
+
+async def retrieve_course_content(db, course, reports: list, sync: bool = True) -> Optional[str]:
+    """
+    Chunks of the course documents most relevant to the course and its
+    reports, from the retrieval index (None: course not indexed / no match).
+    `sync=False` when the caller already synced the course.
+    """
+    try:
+        if sync:
+            await retrieval_index.sync_course(db, course._id)
+        query = " ".join([course.title or "", course.description or ""] + [r.report or "" for r in reports[:3]])
+        hits = retrieval_index.search(query, [course._id], RETRIEVAL_TOP_K)
+    except Exception as e:
+        logger.error(f"Retrieval failed for course {course._id}: {e}")
+        return None
+    if not hits:
+        return None
+    return "".join(_format_document(f"{h['name']} (p. {h['page']})", h["text"]) for h in hits)
+
+async def determine_context(has_grades: bool, reports: list, documents: list,
+                            contents: Optional[Dict[str, str]] = None, retrieved: Optional[str] = None) -> tuple:
+    """Determine analysis context based on available resources (Async).
+    `retrieved` holds the relevant indexed chunks (see retrieve_course_content);
+    without them, the prefixes of `contents` (see fetch_documents_content) are used."""
     has_reports = len(reports) > 0
     has_docs = len(documents) > 0
     
     docs_content = ""
-    if has_docs:
-        async with httpx.AsyncClient() as http_client:
-            tasks = []
-            for doc in documents[:3]:
-                if "url" in doc:
-                    tasks.append(fetch_document_content(http_client, doc["url"], doc.get("name", "")))
-            
-            if tasks:
-                results = await asyncio.gather(*tasks)
-                docs_content = "".join(results)
+    if has_docs and retrieved:
+        docs_content = retrieved
+    elif has_docs:
+        context_docs = [doc for doc in documents[:3] if doc.url]
+        missing = [doc for doc in context_docs if contents is None or doc.url not in contents]
+        if missing:
+            contents = {**(contents or {}), **await fetch_documents_content(http_pool.client, missing)}
+        if contents:
+            docs_content = "".join(contents.get(doc.url, "") for doc in context_docs)
     
     if has_reports and has_docs:
-        reports_text = " ".join([r.get("report", "") for r in reports[:3]])
-        doc_names = [d.get("name", "") for d in documents[:5]]
+        reports_text = " ".join([r.report or "" for r in reports[:3]])
+        doc_names = [d.name or "" for d in documents[:5]]
         return "both", {"reports": reports_text[:1000], "documents": doc_names, "content": docs_content}
     elif has_reports:
-        reports_text = " ".join([r.get("report", "") for r in reports[:3]])
+        reports_text = " ".join([r.report or "" for r in reports[:3]])
         return "with_reports", {"reports": reports_text[:1000]}
     elif has_docs:
-        doc_names = [d.get("name", "") for d in documents[:5]]
+        doc_names = [d.name or "" for d in documents[:5]]
         return "with_documents", {"documents": doc_names, "content": docs_content}
     elif has_grades:
         return "graded", {}
     else:
         return "none", {}
 
-async def call_ai(course_summary: str, context_type: str = "graded", context_data: dict = None) -> Dict[str, Any]:
-    """Call Groq AI logic"""
-    if not client:
-        return {
-            "risk": "inconnu",
-            "shortSummary": "Service IA non configuré",
-            "advice": "Contactez l'administrateur",
-            "focusPoints": [],
-            "quiz": []
-        }
-
+def build_prompt(course_summary: str, context_type: str = "graded", context_data: dict = None) -> str:
+    """Render the prompt for a course analysis"""
     if context_data is None:
         context_data = {}
     
@@ -152,28 +283,50 @@ async def call_ai(course_summary: str, context_type: str = "graded", context_dat
         )
     else:  # none
         prompt = get_none_prompt(course_summary)
+    return prompt
 
-    # Retry logic
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            completion = await client.chat.completions.create(
-                model="llama-3.3-70b-versatile",
+async def call_ai(course_summary: str, context_type: str = "graded", context_data: dict = None,
+                  cache=None, priority: int = PRIORITY_INTERACTIVE) -> Dict[str, Any]:
+    """Call Groq AI logic (answers are reused from `cache` when the prompt is unchanged)"""
+    if not client:
+        return {
+            "risk": "inconnu",
+            "shortSummary": "Service IA non configuré",
+            "advice": "Contactez l'administrateur",
+            "focusPoints": [],
+            "quiz": []
+        }
+
+    prompt = build_prompt(course_summary, context_type, context_data)
+
+    cache_key = None
+    if cache is not None:
+        cache_key = fingerprint(AI_MODEL, prompt, temperature=AI_TEMPERATURE, max_tokens=AI_MAX_TOKENS)
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # Rate limiting, priority and retries are handled by the shared scheduler
+    try:
+        completion = await groq_scheduler.run(
+            lambda: client.chat.completions.create(
+                model=AI_MODEL,
                 messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=2000,
-            )
-            response_text = completion.choices[0].message.content
-            parsed = safe_parse_json(response_text)
-            return parsed
-        except Exception as e:
-            if "429" in str(e):
-                logger.warning(f"Rate limit hit (attempt {attempt+1}/{max_retries}). Retrying...")
-                await asyncio.sleep(2 ** (attempt + 1))
-            else:
-                logger.error(f"IA Error (attempt {attempt+1}): {e}")
-                if attempt == max_retries - 1:
-                    break
+                temperature=AI_TEMPERATURE,
+                max_tokens=AI_MAX_TOKENS,
+            ),
+            estimate_tokens(prompt, AI_MAX_TOKENS),
+            priority
+        )
+        response_text = completion.choices[0].message.content
+        parsed = parse_json(response_text)
+        if parsed is None:
+            return safe_parse_json(response_text)
+        if cache_key is not None:
+            await cache.put(cache_key, parsed)
+        return parsed
+    except Exception as e:
+        logger.error(f"IA Error: {e}")
     
     # Fallback response
     try:
@@ -199,43 +352,13 @@ async def call_ai(course_summary: str, context_type: str = "graded", context_dat
         "quiz": []
     }
 
-def calculate_course_stats(grades: List[Dict], items: List[Dict]) -> Dict[str, Any]:
-    """Calculate course average and stats (Weighted)"""
+def calculate_course_stats(grades: List[GradeRecord], items: List[ItemRecord],
+                           categories: Optional[List[CategoryRecord]] = None) -> Dict[str, Any]:
+    """Course average, completion and category breakdown (see grade_stats)"""
     # Assuming items passed here are already valid (maxPoints > 0 etc) from data_engine
-    total_points = sum(item.get("maxPoints", 0) for item in items)
-    # Map item IDs for quick lookup (strings in dicts probably, but let's be safe)
-    graded_item_ids = set(g.get("itemId") for g in grades if g.get("itemId"))
-    
-    earned_points = 0
-    total_evaluated_points = 0
-    
-    for item in items:
-        item_id = item.get("_id")
-        # Handle string/ObjectId mismatch potential if serialized
-        # But assuming inputs are dicts from data_engine which serialized them.
-        if item_id in graded_item_ids:
-            grade = next((g for g in grades if g.get("itemId") == item_id), None)
-            if grade:
-                earned_points += grade.get("score", 0)
-                total_evaluated_points += item.get("maxPoints", 0)
-
-    average = None
-    has_grades = False
-    
-    if total_evaluated_points > 0:
-        average = (earned_points / total_evaluated_points * 100)
-        has_grades = True
-    
-    # Weighted completion
-    if total_points > 0:
-        completion = (total_evaluated_points / total_points * 100)
-    else:
-        completion = 0.0
-
-    return {
-        "average": round(average, 1) if average is not None else None,
-        "completion": round(completion, 1),
-        "totalPoints": total_points,
-        "earnedPoints": earned_points,
-        "hasGrades": has_grades
-    }
+    engine = CourseStats(
+        ((i._id, i.maxPoints, i.categoryId) for i in items),
+        ((c._id, c.name, c.weight) for c in categories or [])
+    )
+    graded = [g for g in grades if g.itemId]
+    return engine.for_student([g.itemId for g in graded], [g.score for g in graded])
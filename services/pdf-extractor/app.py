@@ -1,25 +1,476 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from PyPDF2 import PdfReader
+import io
+import os
+import json
+import mmap
 import sys
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.datastructures import MultiDict
 
 app = Flask(__name__)
 
+# Admission control (per worker process)
+# - EXTRACTOR_CONCURRENCY: extractions running at once (PyPDF2 is CPU bound, keep at 1)
+# - EXTRACTOR_QUEUE_SIZE: requests allowed to wait for a slot, the rest are rejected
+# - EXTRACTOR_QUEUE_TIMEOUT: max seconds to wait, kept well under the callers' 30s timeout
+EXTRACTOR_CONCURRENCY = int(os.getenv("EXTRACTOR_CONCURRENCY", "1"))
+EXTRACTOR_QUEUE_SIZE = int(os.getenv("EXTRACTOR_QUEUE_SIZE", "4"))
+EXTRACTOR_QUEUE_TIMEOUT = float(os.getenv("EXTRACTOR_QUEUE_TIMEOUT", "10"))
+EXTRACTOR_RETRY_AFTER = int(os.getenv("EXTRACTOR_RETRY_AFTER", "2"))
+
+# Shared uploads volume (same files academic-service writes), read-only
+UPLOADS_ROOT = os.path.realpath(os.getenv("UPLOADS_ROOT", "/app/uploads"))
+MONGO_URI = os.getenv("MONGO_URI")
+
+# /extract/batch: documents per request, pool processes per gunicorn worker.
+# The cores are split between the gunicorn workers (half the cores by default,
+# see gunicorn.conf.py), so workers x pool stays at the CPU count: 2 pool
+# processes per worker by default, none on a single core (batch runs in the
+# request thread).
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "64"))
+EXTRACTOR_WORKERS = int(os.getenv("EXTRACTOR_WORKERS", str(max(1, (os.cpu_count() or 1) // 2))))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(max(1, (os.cpu_count() or 1) // max(1, EXTRACTOR_WORKERS)))))
+
+
+class ExtractorBusy(Exception):
+    pass
+
+
+class ExtractionSlots:
+    """Bounded number of running extractions plus a bounded wait queue"""
+
+    def __init__(self, concurrency, queue_size, timeout):
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.queue_size = queue_size
+        self.timeout = timeout
+
+    def acquire(self):
+        # Fast path: a slot is free
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self._waiting >= self.queue_size:
+                raise ExtractorBusy("Extraction queue is full")
+            self._waiting += 1
+        try:
+            if not self._slots.acquire(timeout=self.timeout):
+                raise ExtractorBusy("Timed out waiting for an extraction slot")
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def release(self):
+        self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+slots = ExtractionSlots(EXTRACTOR_CONCURRENCY, EXTRACTOR_QUEUE_SIZE, EXTRACTOR_QUEUE_TIMEOUT)
+
+
+@app.errorhandler(ExtractorBusy)
+def handle_busy(e):
+    resp = jsonify({'error': str(e)})
+    resp.status_code = 503
+    resp.headers['Retry-After'] = str(EXTRACTOR_RETRY_AFTER)
+    return resp
+
+
+def parse_page_spec(spec):
+    """
+    Parse a 1-based page spec like "1-3,7,10-" into (start, end) pairs,
+    end None for an open range. Raises ValueError on a malformed spec.
+    """
+    ranges = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start = int(start) if start.strip() else 1
+                end = int(end) if end.strip() else None
+            else:
+                start = end = int(part)
+        except ValueError:
+            raise ValueError(f"Invalid page range: {part}")
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"Invalid page range: {part}")
+        ranges.append((start, end))
+    return ranges
+
+
+def parse_page_ranges(spec, total_pages):
+    """Parse a 1-based page spec like "1-3,7,10-" into 0-based page indexes"""
+    if not spec:
+        return list(range(total_pages))
+
+    indexes = []
+    seen = set()
+    for start, end in parse_page_spec(spec):
+        end = total_pages if end is None else end
+        for n in range(start, min(end, total_pages) + 1):
+            if n - 1 not in seen:
+                seen.add(n - 1)
+                indexes.append(n - 1)
+    return indexes
+
+
+def parse_limit(values, name):
+    """Optional non-negative integer field"""
+    raw = values.get(name)
+    if raw is None or raw == "":
+        return None
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+    if value < 0:
+        raise ValueError(f"{name} must not be negative")
+    return value
+
+
+def parse_limits(values):
+    """
+    Read max_chars / max_pages / pages from query string or form fields.
+    Everything is validated here, before any (streamed) response starts.
+    """
+    pages = values.get("pages")
+    parse_page_spec(pages)
+    return parse_limit(values, "max_chars"), parse_limit(values, "max_pages"), pages
+
+
+def iter_pages(reader, max_chars=None, max_pages=None, pages=None):
+    """
+    Yield (page_number, text) and stop as soon as the budget is reached.
+    Pages past the budget are never parsed.
+    """
+    indexes = parse_page_ranges(pages, len(reader.pages))
+    if max_pages is not None:
+        indexes = indexes[:max_pages]
+
+    remaining = max_chars
+    for i in indexes:
+        if remaining is not None and remaining <= 0:
+            break
+        text = (reader.pages[i].extract_text() or "") + "\n"
+        if remaining is not None:
+            text = text[:remaining]
+            remaining -= len(text)
+        yield i + 1, text
+
+
+def extract_text(reader, max_chars=None, max_pages=None, pages=None):
+    """Extract text within the budget. Returns (content, page_offsets)."""
+    parts = []
+    offsets = []
+    position = 0
+    for page_number, text in iter_pages(reader, max_chars, max_pages, pages):
+        offsets.append({"page": page_number, "offset": position})
+        parts.append(text)
+        position += len(text)
+    return "".join(parts), offsets
+
+
+def stream_pages(reader, max_chars=None, max_pages=None, pages=None):
+    """NDJSON stream: one line per page, then a final summary line"""
+    count = 0
+    chars = 0
+    try:
+        for page_number, text in iter_pages(reader, max_chars, max_pages, pages):
+            count += 1
+            chars += len(text)
+            yield json.dumps({"page": page_number, "text": text}) + "\n"
+        yield json.dumps({"done": True, "pages": count, "chars": chars,
+                          "totalPages": len(reader.pages)}) + "\n"
+    except Exception as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+
+
+class DocumentNotFound(Exception):
+    pass
+
+
+def resolve_upload_path(relative_path):
+    """Resolve a path relative to UPLOADS_ROOT, refusing anything outside of it"""
+    if not relative_path or os.path.isabs(relative_path):
+        raise ValueError("path must be relative to the uploads root")
+    full_path = os.path.realpath(os.path.join(UPLOADS_ROOT, relative_path))
+    if os.path.commonpath([UPLOADS_ROOT, full_path]) != UPLOADS_ROOT:
+        raise ValueError("path escapes the uploads root")
+    if not os.path.isfile(full_path):
+        raise DocumentNotFound(f"File not found: {relative_path}")
+    return full_path
+
+
+_documents = None
+
+def resolve_document_id(document_id):
+    """Look up a `documents` entry and map its URL to a path under UPLOADS_ROOT"""
+    global _documents
+    if not MONGO_URI:
+        raise ValueError("documentId lookup requires MONGO_URI")
+    if _documents is None:
+        from pymongo import MongoClient
+        _documents = MongoClient(MONGO_URI).get_default_database("edu_platform").documents
+
+    from bson import ObjectId
+    from bson.errors import InvalidId
+    try:
+        doc = _documents.find_one({"_id": ObjectId(document_id)}, {"url": 1})
+    except InvalidId:
+        raise ValueError(f"Invalid documentId: {document_id}")
+    if not doc or not doc.get("url"):
+        raise DocumentNotFound(f"Document not found: {document_id}")
+    # .../uploads/documents/<file> -> documents/<file>
+    return resolve_upload_path(f"documents/{doc['url'].split('/')[-1]}")
+
+
+def open_mapped(full_path):
+    """Map a file read-only so pages are read lazily by the OS, not copied"""
+    with open(full_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Empty file")
+        # mmap keeps its own handle, the file object can be closed right away
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def extract_text_file(full_path, max_chars=None):
+    with open(full_path, "r", encoding="utf-8", errors="ignore") as f:
+        text = f.read(max_chars) if max_chars is not None else f.read()
+    return text, [{"page": 1, "offset": 0}]
+
+
+def extract_file(full_path, max_chars=None, max_pages=None, pages=None):
+    """Extract a file from disk. Returns (content, page_offsets, total_pages)."""
+    if not full_path.lower().endswith(".pdf"):
+        text, offsets = extract_text_file(full_path, max_chars)
+        return text, offsets, 1
+    with open_mapped(full_path) as mm:
+        reader = PdfReader(mm)
+        text, offsets = extract_text(reader, max_chars, max_pages, pages)
+        return text, offsets, len(reader.pages)
+
+
 @app.route('/extract', methods=['POST'])
 def extract_pdf():
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
-        
+
+        try:
+            max_chars, max_pages, pages = parse_limits(request.values)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         file = request.files['file']
-        reader = PdfReader(file)
-        
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        
-        return jsonify({'content': text})
+
+        if request.values.get("stream") in ("1", "true"):
+            slots.acquire()
+            try:
+                # The upload is closed once the view returns, keep our own copy
+                reader = PdfReader(io.BytesIO(file.read()))
+            except Exception:
+                slots.release()
+                raise
+            resp = Response(
+                stream_with_context(stream_pages(reader, max_chars, max_pages, pages)),
+                mimetype="application/x-ndjson"
+            )
+            # Slot is held until the stream is fully sent (or the client goes away)
+            resp.call_on_close(slots.release)
+            return resp
+
+        with slots:
+            reader = PdfReader(file)
+            text, offsets = extract_text(reader, max_chars, max_pages, pages)
+
+        return jsonify({
+            'content': text,
+            'pageOffsets': offsets,
+            'totalPages': len(reader.pages)
+        })
+    except ExtractorBusy:
+        raise
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/extract/path', methods=['POST'])
+def extract_path():
+    """
+    Extract a file that is already on the shared uploads volume.
+    Body: {"path": "documents/<file>"} or {"documentId": "..."},
+    plus the same max_chars / max_pages / pages / stream options as /extract.
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        params = MultiDict(request.args)
+        for key in ("max_chars", "max_pages", "pages", "stream"):
+            if body.get(key) is not None:
+                params[key] = str(body[key]).lower()
+
+        try:
+            max_chars, max_pages, pages = parse_limits(params)
+            if body.get("documentId"):
+                full_path = resolve_document_id(str(body["documentId"]))
+            else:
+                full_path = resolve_upload_path(body.get("path") or params.get("path"))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except DocumentNotFound as e:
+            return jsonify({'error': str(e)}), 404
+
+        if params.get("stream") in ("1", "true") and full_path.lower().endswith(".pdf"):
+            slots.acquire()
+            mm = None
+            try:
+                mm = open_mapped(full_path)
+                reader = PdfReader(mm)
+            except Exception:
+                if mm is not None:
+                    mm.close()
+                slots.release()
+                raise
+            resp = Response(
+                stream_with_context(stream_pages(reader, max_chars, max_pages, pages)),
+                mimetype="application/x-ndjson"
+            )
+            resp.call_on_close(slots.release)
+            resp.call_on_close(mm.close)
+            return resp
+
+        with slots:
+            text, offsets, total_pages = extract_file(full_path, max_chars, max_pages, pages)
+
+        return jsonify({
+            'content': text,
+            'pageOffsets': offsets,
+            'totalPages': total_pages
+        })
+    except ExtractorBusy:
+        raise
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+_batch_pool = None
+
+def init_batch_pool():
+    """
+    Start this worker's batch pool (gunicorn post_worker_init hook, see gunicorn.conf.py).
+    Pool processes are spawned, not forked: the worker already runs threads.
+    """
+    global _batch_pool
+    if _batch_pool is None and BATCH_WORKERS > 1:
+        _batch_pool = ProcessPoolExecutor(
+            max_workers=BATCH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+
+
+def map_batch(jobs):
+    """Results of run_batch_job for `jobs`, in order (in the pool when there is one)"""
+    if _batch_pool is None:
+        return map(run_batch_job, jobs)
+    return _batch_pool.map(run_batch_job, jobs)
+
+
+def run_batch_job(job):
+    """Extract one batch entry (in a pool process, or the request thread without a pool)"""
+    start = time.perf_counter()
+    result = {"id": job["id"]}
+    try:
+        if "data" in job:
+            reader = PdfReader(io.BytesIO(job["data"]))
+            text, offsets = extract_text(reader, job["max_chars"], job["max_pages"], job["pages"])
+            total_pages = len(reader.pages)
+        else:
+            text, offsets, total_pages = extract_file(
+                job["path"], job["max_chars"], job["max_pages"], job["pages"]
+            )
+        result.update({"content": text, "pageOffsets": offsets, "totalPages": total_pages})
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+@app.route('/extract/batch', methods=['POST'])
+def extract_batch():
+    """
+    Extract many documents in one request, in parallel across the worker's pool processes.
+    - JSON: {"documents": [{"id": "...", "path": "..."} | {"id": "...", "documentId": "..."}],
+             "max_chars": ..., "max_pages": ..., "pages": ...}
+    - multipart: several "files" parts (id = filename), options as form fields
+    Results keep the request order and carry either "content" or "error".
+    """
+    start = time.perf_counter()
+    try:
+        body = request.get_json(silent=True) or {}
+        params = MultiDict(request.values)
+        for key in ("max_chars", "max_pages", "pages"):
+            if body.get(key) is not None:
+                params[key] = str(body[key])
+        try:
+            max_chars, max_pages, pages = parse_limits(params)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        limits = {"max_chars": max_chars, "max_pages": max_pages, "pages": pages}
+        jobs = []
+        results = {}
+
+        for i, entry in enumerate(body.get("documents") or []):
+            doc_id = str(entry.get("id") or entry.get("documentId") or entry.get("path") or i)
+            try:
+                if entry.get("documentId"):
+                    full_path = resolve_document_id(str(entry["documentId"]))
+                else:
+                    full_path = resolve_upload_path(entry.get("path"))
+                jobs.append({"id": doc_id, "path": full_path, **limits})
+            except (ValueError, DocumentNotFound) as e:
+                results[len(jobs) + len(results)] = {"id": doc_id, "error": str(e), "elapsed_ms": 0.0}
+
+        for file in request.files.getlist("files"):
+            jobs.append({"id": file.filename, "data": file.read(), **limits})
+
+        total = len(jobs) + len(results)
+        if total == 0:
+            return jsonify({'error': 'No documents provided'}), 400
+        if total > BATCH_MAX_DOCUMENTS:
+            return jsonify({'error': f'Too many documents (max {BATCH_MAX_DOCUMENTS})'}), 400
+
+        with slots:
+            extracted = iter(map_batch(jobs))
+            ordered = [results[i] if i in results else next(extracted) for i in range(total)]
+
+        return jsonify({
+            'results': ordered,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)
+        })
+    except ExtractorBusy:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok', 'service': 'pdf-extractor'})
+
+# Development server only, production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5001)
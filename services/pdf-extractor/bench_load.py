@@ -0,0 +1,177 @@
+"""
+Load benchmark for pdf-extractor.
+
+Starts gunicorn with 1, 2, 4 ... N worker processes and fires concurrent
+/extract requests at each, printing throughput and latency so scaling with
+the number of cores is visible.
+
+    python bench_load.py                      # synthetic 40-page PDF
+    python bench_load.py --pdf course.pdf --requests 200 --concurrency 16
+"""
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import subprocess
+import statistics
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_pdf(pages: int = 40, lines: int = 45) -> bytes:
+    """Minimal text PDF (Helvetica, one content stream per page), no dependencies"""
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")  # patched below
+    pages_obj = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for p in range(pages):
+        ops = ["BT", "/F1 10 Tf", "14 TL", "40 800 Td"]
+        for l in range(lines):
+            ops.append(f"(Page {p + 1} line {l}: lorem ipsum dolor sit amet, consectetur adipiscing elit) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+def multipart(pdf: bytes):
+    boundary = "----benchboundary"
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="bench.pdf"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + pdf + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url: str, timeout: float = 20.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url + "/health", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("pdf-extractor did not start")
+
+
+def one_request(url: str, body: bytes, content_type: str):
+    req = urllib.request.Request(url + "/extract", data=body, headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp:
+            json.loads(resp.read())
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def run(workers: int, pdf: bytes, requests: int, concurrency: int) -> dict:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, EXTRACTOR_WORKERS=str(workers), PORT=str(port),
+               EXTRACTOR_QUEUE_SIZE=str(max(concurrency, 4)), EXTRACTOR_QUEUE_TIMEOUT="30")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+         "--access-logfile", "/dev/null", "app:app"],
+        cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(url)
+        body, content_type = multipart(pdf)
+        one_request(url, body, content_type)  # warm-up
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: one_request(url, body, content_type), range(requests)))
+        elapsed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait(timeout=15)
+
+    ok = sorted(t for status, t in results if status == 200)
+    return {
+        "workers": workers,
+        "ok": len(ok),
+        "rejected": sum(1 for status, _ in results if status == 503),
+        "failed": sum(1 for status, _ in results if status not in (200, 503)),
+        "throughput": len(ok) / elapsed if elapsed else 0.0,
+        "p50": statistics.median(ok) if ok else 0.0,
+        "p99": ok[min(len(ok) - 1, int(len(ok) * 0.99))] if ok else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="PDF to upload (default: synthetic)")
+    parser.add_argument("--pages", type=int, default=40, help="pages in the synthetic PDF")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if args.pdf:
+        with open(args.pdf, "rb") as f:
+            pdf = f.read()
+    else:
+        pdf = build_pdf(args.pages)
+
+    counts = []
+    n = 1
+    while n < args.max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(args.max_workers)
+
+    print(f"PDF: {len(pdf) / 1024:.0f} KiB, {args.requests} requests, concurrency {args.concurrency}")
+    print(f"{'workers':>7} {'req/s':>8} {'speedup':>8} {'p50 ms':>8} {'p99 ms':>8} {'ok':>5} {'503':>5} {'err':>5}")
+    baseline = None
+    for workers in counts:
+        r = run(workers, pdf, args.requests, args.concurrency)
+        baseline = baseline or r["throughput"] or 1.0
+        print(f"{r['workers']:>7} {r['throughput']:>8.1f} {r['throughput'] / baseline:>7.2f}x "
+              f"{r['p50'] * 1000:>8.0f} {r['p99'] * 1000:>8.0f} {r['ok']:>5} {r['rejected']:>5} {r['failed']:>5}")
+
+
+if __name__ == "__main__":
+    main()
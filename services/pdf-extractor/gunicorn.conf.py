@@ -0,0 +1,42 @@
+# Production server settings for pdf-extractor
+# Usage: gunicorn -c gunicorn.conf.py app:app
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# PyPDF2 extraction is CPU bound and holds the GIL: one process per core in
+# total. By default half the cores serve requests and each worker gets a
+# 2-process pool for /extract/batch (app.BATCH_WORKERS = cores // workers).
+workers = int(os.getenv("EXTRACTOR_WORKERS", max(1, multiprocessing.cpu_count() // 2)))
+
+# Threads only accept/queue requests, app.ExtractionSlots decides who runs.
+# Enough threads for the running extractions + the bounded queue + one to
+# answer "busy" quickly.
+worker_class = "gthread"
+threads = (
+    int(os.getenv("EXTRACTOR_CONCURRENCY", "1"))
+    + int(os.getenv("EXTRACTOR_QUEUE_SIZE", "4"))
+    + 1
+)
+
+# Pending connections waiting for a worker thread (kernel accept queue)
+backlog = int(os.getenv("EXTRACTOR_BACKLOG", "64"))
+
+# Hard limit for a single request (large PDFs)
+timeout = int(os.getenv("EXTRACTOR_TIMEOUT", "60"))
+graceful_timeout = 10
+keepalive = 5
+
+# Recycle workers regularly, PyPDF2 can hold on to memory after huge files
+max_requests = int(os.getenv("EXTRACTOR_MAX_REQUESTS", "500"))
+max_requests_jitter = 50
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    # Batch extraction pool, one per worker, sized from the cores left per worker
+    from app import init_batch_pool
+    init_batch_pool()
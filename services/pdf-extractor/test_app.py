@@ -0,0 +1,48 @@
+"""
+Regression tests for the extraction limits of app.py.
+
+    python -m pytest -q test_app.py
+"""
+import io
+
+import pytest
+from PyPDF2 import PdfWriter
+
+from app import app
+
+
+def blank_pdf(pages: int = 2) -> bytes:
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(100, 100)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def extract(**fields):
+    data = {"file": (io.BytesIO(blank_pdf()), "doc.pdf"), **fields}
+    return app.test_client().post("/extract", data=data, content_type="multipart/form-data")
+
+
+@pytest.mark.parametrize("fields", [
+    {"max_chars": "abc"}, {"max_pages": "1.5"}, {"max_chars": "-1"}, {"max_pages": "-2"},
+])
+def test_invalid_limits_are_rejected(fields):
+    for stream in ("false", "true"):
+        resp = extract(stream=stream, **fields)
+        assert resp.status_code == 400
+        assert "error" in resp.get_json()
+
+
+@pytest.mark.parametrize("pages", ["x", "3-1", "0", "1-a"])
+def test_invalid_pages_rejected_before_streaming(pages):
+    resp = extract(stream="true", pages=pages)
+    assert resp.status_code == 400
+    assert resp.get_json()["error"].startswith("Invalid page range")
+
+
+def test_valid_limits_stream():
+    resp = extract(stream="true", pages="2-", max_chars="10")
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True).splitlines()[-1].startswith('{"done": true')
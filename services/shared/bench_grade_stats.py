@@ -0,0 +1,120 @@
+"""
+Benchmark: grade_stats roster computation vs the per-student Python loop.
+
+Builds a course roster (default 1000 students x 40 items, 5 categories,
+a few duplicate grades), checks that the engine returns the same average /
+completion / points as the loop ia-service used before grade_stats
+(calculate_course_stats, where the first of duplicate grades counts), then
+times both.
+
+    python bench_grade_stats.py
+    python bench_grade_stats.py --students 100 1000 5000 --items 60
+"""
+import random
+import argparse
+import statistics
+import time
+
+from grade_stats import CourseStats
+
+
+def legacy_course_stats(grades: list, items: list) -> dict:
+    """Previous calculate_course_stats (dict rows, O(items x grades))"""
+    total_points = sum(item.get("maxPoints", 0) for item in items)
+    graded_item_ids = set(g.get("itemId") for g in grades if g.get("itemId"))
+    earned_points = 0
+    total_evaluated_points = 0
+    for item in items:
+        item_id = item.get("_id")
+        if item_id in graded_item_ids:
+            grade = next((g for g in grades if g.get("itemId") == item_id), None)
+            if grade:
+                earned_points += grade.get("score", 0)
+                total_evaluated_points += item.get("maxPoints", 0)
+    average = None
+    if total_evaluated_points > 0:
+        average = earned_points / total_evaluated_points * 100
+    completion = total_evaluated_points / total_points * 100 if total_points > 0 else 0.0
+    return {
+        "average": round(average, 1) if average is not None else None,
+        "completion": round(completion, 1),
+        "totalPoints": total_points,
+        "earnedPoints": earned_points,
+    }
+
+
+def synthetic_roster(n_students: int, n_items: int, n_categories: int, seed: int = 0) -> tuple:
+    rng = random.Random(seed)
+    categories = [(f"cat{c}", f"Catégorie {c}", 100 // n_categories) for c in range(n_categories)]
+    items = [{"_id": f"item{i}", "maxPoints": rng.choice([10, 20, 50, 100]),
+              "categoryId": categories[i % n_categories][0]} for i in range(n_items)]
+    students = [f"student{s}" for s in range(n_students)]
+    grades = []
+    for sid in students:
+        graded = rng.uniform(0.0, 1.0)
+        for item in items:
+            if rng.random() < graded:
+                grades.append({"studentId": sid, "itemId": item["_id"],
+                               "score": rng.randint(0, item["maxPoints"])})
+                if rng.random() < 0.05:
+                    # Duplicate grade for the same item: only the first one counts
+                    grades.append({"studentId": sid, "itemId": item["_id"],
+                                   "score": rng.randint(0, item["maxPoints"])})
+    rng.shuffle(grades)
+    return students, items, categories, grades
+
+
+def run_legacy(students, items, grades) -> list:
+    by_student = {sid: [] for sid in students}
+    for g in grades:
+        by_student[g["studentId"]].append(g)
+    return [legacy_course_stats(by_student[sid], items) for sid in students]
+
+
+def run_engine(students, items, categories, grades):
+    engine = CourseStats(((i["_id"], i["maxPoints"], i["categoryId"]) for i in items), categories)
+    return engine, engine.for_roster(
+        students, [g["studentId"] for g in grades], [g["itemId"] for g in grades], [g["score"] for g in grades]
+    )
+
+
+def timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'students':>8} {'grades':>8} {'loop ms':>9} {'engine ms':>10} {'compute ms':>11} {'speedup':>8}")
+    for n in args.students:
+        students, items, categories, grades = synthetic_roster(n, args.items, args.categories, seed=n)
+
+        expected = run_legacy(students, items, grades)
+        engine, stats = run_engine(students, items, categories, grades)
+        for row, legacy in enumerate(expected):
+            actual = engine.summary(stats, row)
+            assert {k: actual[k] for k in legacy} == legacy, f"student {row}: {actual} != {legacy}"
+
+        row_of = {sid: row for row, sid in enumerate(students)}
+        matrix = engine.score_matrix(
+            n, [row_of[g["studentId"]] for g in grades], [g["itemId"] for g in grades], [g["score"] for g in grades]
+        )
+        loop = timed(lambda: run_legacy(students, items, grades), args.repeat)
+        full = timed(lambda: run_engine(students, items, categories, grades), args.repeat)
+        compute = timed(lambda: engine.compute(matrix), args.repeat)
+        print(f"{n:>8} {len(grades):>8} {loop * 1000:>9.1f} {full * 1000:>10.1f} "
+              f"{compute * 1000:>11.2f} {loop / full:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: retrieval index build and query latency.
+
+Generates a synthetic corpus (default 10 000+ chunks spread over 50 courses,
+Zipf-distributed vocabulary), writes one segment per course in a temporary
+directory, then times cold segment loads and top-k queries over one course,
+a student's worth of courses and the whole corpus.
+
+    python bench_retrieval.py
+    python bench_retrieval.py --chunks 50000 --courses 100 --queries 500
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+from retrieval import RetrievalIndex, RETRIEVAL_CHUNK_WORDS, RETRIEVAL_CHUNK_OVERLAP
+
+
+def vocabulary(size: int, rng: random.Random) -> list:
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(4, 10))))
+    return sorted(words)
+
+
+def synthetic_course(n_chunks: int, words: list, weights: list, rng: random.Random) -> list:
+    """Documents whose text yields about `n_chunks` chunks"""
+    step = RETRIEVAL_CHUNK_WORDS - RETRIEVAL_CHUNK_OVERLAP
+    documents = []
+    for d in range(max(1, n_chunks // 20)):
+        length = step * 20 + RETRIEVAL_CHUNK_OVERLAP
+        text = " ".join(rng.choices(words, weights, k=length))
+        documents.append({"documentId": f"doc{d}", "name": f"Document {d}.pdf", "text": text,
+                          "pageOffsets": [{"page": 1, "offset": 0}]})
+    return documents
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=10000, help="total chunks")
+    parser.add_argument("--courses", type=int, default=50)
+    parser.add_argument("--vocabulary", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = vocabulary(args.vocabulary, rng)
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    directory = tempfile.mkdtemp(prefix="retrieval-bench-")
+    index = RetrievalIndex(directory)
+
+    start = time.perf_counter()
+    course_ids = [f"course{c}" for c in range(args.courses)]
+    total_chunks = 0
+    for course_id in course_ids:
+        documents = synthetic_course(args.chunks // args.courses, words, weights, rng)
+        total_chunks += index.build_course(course_id, "bench", documents)
+    build = time.perf_counter() - start
+    size = sum(os.path.getsize(index.path(c)) for c in course_ids)
+    print(f"build: {total_chunks} chunks in {args.courses} segments, {build:.1f} s, {size / 1e6:.1f} MB on disk")
+
+    start = time.perf_counter()
+    cold = RetrievalIndex(directory)
+    for course_id in course_ids:
+        cold.segment(course_id)
+    print(f"cold load (mmap + header): {(time.perf_counter() - start) / args.courses * 1000:.2f} ms per segment")
+
+    # Queries mix frequent and rare terms, like real questions
+    queries = [" ".join(rng.choices(words[:2000], k=rng.randint(2, 6))) for _ in range(args.queries)]
+    print(f"{'scope':>16} {'chunks':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, scope in (("1 course", course_ids[:1]), ("8 courses", course_ids[:8]), ("all courses", course_ids)):
+        chunks = sum(cold.segment(c).chunks for c in scope)
+        samples = []
+        for query in queries:
+            t = time.perf_counter()
+            cold.search(query, scope, args.k)
+            samples.append(time.perf_counter() - t)
+        print(f"{label:>16} {chunks:>7} {statistics.median(samples) * 1000:>8.2f} "
+              f"{percentile(samples, 0.99) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
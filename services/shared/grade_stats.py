@@ -0,0 +1,165 @@
+"""
+Grade statistics engine shared by ia-service and chatai-service.
+
+A course is laid out as columns: one row per student, one column per grade
+item. Scores live in a (students x items) matrix with NaN for "not graded",
+item max points and categories are vectors, so averages, completion,
+per-category scores and risk bands are a few array operations for one
+student or a whole roster.
+
+Rules (the ones ia-service used so far):
+- an item counts as evaluated once the student has a grade for it; with
+  several grades for the same item the first one counts
+- average = earned / evaluated points, completion = evaluated / total points
+- category average: same ratio restricted to the category's items;
+  weighted average: category averages weighted by the category weights
+  (categories without an evaluated item are left out)
+- risk, from the average rounded to one decimal (as shown): < 60 "élevé",
+  < 75 "moyen", otherwise "faible" (None: no grades)
+"""
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+RISK_HIGH_BELOW = 60.0
+RISK_MEDIUM_BELOW = 75.0
+RISK_LABELS = ("élevé", "moyen", "faible")
+
+
+def risk_band(average: Optional[float]) -> Optional[str]:
+    if average is None:
+        return None
+    if average < RISK_HIGH_BELOW:
+        return RISK_LABELS[0]
+    if average < RISK_MEDIUM_BELOW:
+        return RISK_LABELS[1]
+    return RISK_LABELS[2]
+
+
+def _number(value) -> Any:
+    """numpy scalar -> int when integral, else float (stable JSON)"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _rounded(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 1)
+
+
+class CourseStats:
+    """
+    Items and categories of one course, ready to score any number of students.
+
+    items: (itemId, maxPoints, categoryId) tuples
+    categories: (categoryId, name, weight) tuples
+    """
+
+    def __init__(self, items: Iterable[tuple], categories: Iterable[tuple] = ()):
+        items = list(items)
+        self.categories = list(categories)
+        self.item_index = {item_id: n for n, (item_id, _, _) in enumerate(items)}
+        self.max_points = np.array([float(m or 0) for _, m, _ in items])
+        self.weights = np.array([float(w or 0) for _, _, w in self.categories])
+
+        # One-hot items x categories (items outside the listed categories: no column)
+        category_index = {cat_id: n for n, (cat_id, _, _) in enumerate(self.categories)}
+        self.category_matrix = np.zeros((len(items), len(self.categories)))
+        for n, (_, _, cat_id) in enumerate(items):
+            column = category_index.get(cat_id)
+            if column is not None:
+                self.category_matrix[n, column] = 1.0
+
+    def score_matrix(self, n_students: int, student_rows: Sequence[int],
+                     item_ids: Sequence, scores: Sequence) -> np.ndarray:
+        """(students x items) scores, NaN where not graded. Unknown items / rows < 0 are ignored."""
+        n = len(item_ids)
+        rows = np.asarray(student_rows, dtype=np.intp).reshape(n)
+        cols = np.fromiter((self.item_index.get(i, -1) for i in item_ids), dtype=np.intp, count=n)
+        values = np.fromiter((s or 0 for s in scores), dtype=float, count=n)
+        keep = (rows >= 0) & (cols >= 0)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+
+        # Several grades for one (student, item): the first one counts. numpy does not
+        # say which write wins for repeated indices, so keep first occurrences explicitly.
+        _, first = np.unique(rows * len(self.item_index) + cols, return_index=True)
+        matrix = np.full((n_students, len(self.item_index)), np.nan)
+        matrix[rows[first], cols[first]] = values[first]
+        return matrix
+
+    def compute(self, scores: np.ndarray) -> Dict[str, np.ndarray]:
+        """Column-wise stats for every row of a score matrix"""
+        graded = ~np.isnan(scores)
+        earned_matrix = np.where(graded, scores, 0.0)
+        evaluated_matrix = graded * self.max_points
+
+        total = self.max_points.sum()
+        earned = earned_matrix.sum(axis=1)
+        evaluated = evaluated_matrix.sum(axis=1)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            average = np.where(evaluated > 0, earned / evaluated * 100, np.nan)
+            completion = evaluated / total * 100 if total > 0 else np.zeros(len(scores))
+
+            cat_earned = earned_matrix @ self.category_matrix
+            cat_evaluated = evaluated_matrix @ self.category_matrix
+            cat_average = np.where(cat_evaluated > 0, cat_earned / cat_evaluated * 100, np.nan)
+
+            counted = ~np.isnan(cat_average)
+            weight_sum = (counted * self.weights).sum(axis=1)
+            weighted = np.where(counted, cat_average, 0.0) @ self.weights
+            weighted_average = np.where(weight_sum > 0, weighted / weight_sum, np.nan)
+
+        # Bands from the rounded average that summary() shows (59.96 -> 60.0 -> "moyen")
+        shown = np.array([np.nan if np.isnan(a) else round(float(a), 1) for a in average], dtype=float)
+        risk = np.select(
+            [np.isnan(shown), shown < RISK_HIGH_BELOW, shown < RISK_MEDIUM_BELOW],
+            [-1, 0, 1], default=2
+        )
+        return {
+            "earned": earned,
+            "evaluated": evaluated,
+            "total": total,
+            "average": average,
+            "completion": completion,
+            "categoryEarned": cat_earned,
+            "categoryEvaluated": cat_evaluated,
+            "categoryAverage": cat_average,
+            "weightedAverage": weighted_average,
+            "risk": risk,
+        }
+
+    def summary(self, stats: Dict[str, np.ndarray], row: int = 0) -> Dict[str, Any]:
+        """One student's stats as plain JSON-ready values"""
+        average = _rounded(stats["average"][row])
+        return {
+            "average": average,
+            "completion": round(float(stats["completion"][row]), 1),
+            "totalPoints": _number(stats["total"]),
+            "earnedPoints": _number(stats["earned"][row]),
+            "hasGrades": average is not None,
+            "weightedAverage": _rounded(stats["weightedAverage"][row]),
+            "risk": RISK_LABELS[stats["risk"][row]] if stats["risk"][row] >= 0 else None,
+            "categories": [
+                {
+                    "categoryId": cat_id,
+                    "name": name,
+                    "weight": weight,
+                    "average": _rounded(stats["categoryAverage"][row, n]),
+                    "evaluatedPoints": _number(stats["categoryEvaluated"][row, n]),
+                }
+                for n, (cat_id, name, weight) in enumerate(self.categories)
+            ],
+        }
+
+    def for_student(self, item_ids: Sequence, scores: Sequence) -> Dict[str, Any]:
+        """Stats of one student from their (itemId, score) grades"""
+        matrix = self.score_matrix(1, [0] * len(item_ids), item_ids, scores)
+        return self.summary(self.compute(matrix))
+
+    def for_roster(self, student_ids: List, grade_students: Sequence,
+                   item_ids: Sequence, scores: Sequence) -> Dict[str, np.ndarray]:
+        """Stats of every student of `student_ids` at once (arrays in that order)"""
+        row_of = {sid: n for n, sid in enumerate(student_ids)}
+        rows = np.fromiter((row_of.get(sid, -1) for sid in grade_students), dtype=np.intp,
+                           count=len(grade_students))
+        return self.compute(self.score_matrix(len(student_ids), rows, item_ids, scores))
@@ -0,0 +1,440 @@
+"""
+Local BM25 retrieval over the extracted text of course documents.
+
+Shared by ia-service (analysis prompts) and chatai-service (chat answers).
+The text comes from the `documenttexts` store that ia-service's ingestor
+fills (see ia-service/ingest.py); it is cut into overlapping word windows
+and indexed per course:
+
+- one segment file per course under RETRIEVAL_INDEX_DIR: a JSON header
+  (vocabulary -> postings range, documents, signature) followed by the
+  numpy arrays (postings, term frequencies, chunk lengths, pages, text).
+  Segments are memory-mapped, so only the pages a query touches are read.
+- updates are incremental per course: a course is rebuilt when the
+  signature of its stored texts changes (new, re-extracted or removed
+  documents). The file is written aside and renamed over the old one, so
+  readers (other workers, the other service) never see half a segment.
+- a query over several courses scores them with the pooled statistics
+  (chunk count, document frequencies, average length) of those courses.
+
+    python retrieval.py --sync            # build / refresh every course
+    python retrieval.py --query "boucles for" --course <courseId>
+"""
+import os
+import re
+import json
+import time
+import bisect
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from bson import ObjectId
+from bson.errors import InvalidId
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_INDEX_DIR = os.getenv("RETRIEVAL_INDEX_DIR", "/app/cache/retrieval")
+RETRIEVAL_CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "120"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "30"))
+# Seconds between two signature checks of the same course on the query path
+RETRIEVAL_SYNC_INTERVAL = float(os.getenv("RETRIEVAL_SYNC_INTERVAL", "60"))
+# Only read the segments (chatai-service: ia-service is the single writer)
+RETRIEVAL_READ_ONLY = os.getenv("RETRIEVAL_READ_ONLY", "false").lower() == "true"
+
+# Written by ia-service/ingest.py
+TEXTS_COLLECTION = "documenttexts"
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MAGIC = b"EDUBM25\x01"
+STOP_WORDS = {
+    "the", "and", "are", "was", "with", "this", "that", "from", "you", "your", "not", "but",
+    "les", "des", "une", "est", "que", "qui", "pour", "dans", "avec", "sur", "par", "pas", "plus",
+    "ces", "ses", "aux", "son", "sont", "elle", "nous", "vous", "ils", "ont", "cette", "mais",
+}
+_WORD = re.compile(r"\S+")
+
+
+def _fold(term: str) -> str:
+    """Plural folding (boucles -> boucle, travaux -> travau): enough for FR / EN course text"""
+    return term[:-1] if len(term) > 3 and term[-1] in "sx" and term[-2] not in "su" else term
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased, accent-free, plural-folded terms (2+ characters, stop words removed)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [_fold(t) for t in re.findall(r"[a-z0-9]{2,}", text) if t not in STOP_WORDS]
+
+
+def chunk_text(text: str, page_offsets: Optional[List[dict]] = None,
+               words: int = RETRIEVAL_CHUNK_WORDS, overlap: int = RETRIEVAL_CHUNK_OVERLAP) -> List[tuple]:
+    """(page, text) windows of `words` words, `overlap` words shared with the previous one"""
+    spans = [m.span() for m in _WORD.finditer(text)]
+    if not spans:
+        return []
+    starts = [o["offset"] for o in page_offsets or []]
+    pages = [o["page"] for o in page_offsets or []]
+    step = max(1, words - overlap)
+    chunks = []
+    for first in range(0, len(spans), step):
+        last = min(first + words, len(spans)) - 1
+        start, end = spans[first][0], spans[last][1]
+        page = pages[bisect.bisect_right(starts, start) - 1] if starts and start >= starts[0] else 1
+        chunks.append((page, text[start:end]))
+        if last == len(spans) - 1:
+            break
+    return chunks
+
+
+def texts_signature(entries: Iterable[dict]) -> str:
+    """Identity of a course's stored texts: changes when one is added, re-extracted or removed"""
+    parts = sorted(f"{e.get('documentId')}:{e.get('mtimeNs')}:{e.get('size')}" for e in entries)
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+
+class Segment:
+    """One course's index, memory-mapped from its segment file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(data[:8]) != MAGIC:
+            raise ValueError(f"{path}: not a retrieval segment")
+        header_len = int(data[8:16].view(np.uint64)[0])
+        header = json.loads(bytes(data[16:16 + header_len]).decode("utf-8"))
+
+        self.course_id = header["courseId"]
+        self.signature = header["signature"]
+        self.documents = header["documents"]
+        self.terms = header["terms"]  # term -> [postings start, document frequency]
+        self.chunks = header["chunks"]
+        self.total_length = header["totalLength"]
+        arrays = {}
+        for name, (offset, dtype, count) in header["arrays"].items():
+            size = np.dtype(dtype).itemsize * count
+            arrays[name] = data[offset:offset + size].view(dtype)
+        self.postings = arrays["postings"]
+        self.freqs = arrays["freqs"]
+        self.lengths = arrays["lengths"]
+        self.chunk_doc = arrays["chunkDoc"]
+        self.chunk_page = arrays["chunkPage"]
+        self.text_offsets = arrays["textOffsets"]
+        self.text = arrays["text"]
+
+    def document_frequency(self, term: str) -> int:
+        entry = self.terms.get(term)
+        return entry[1] if entry else 0
+
+    def scores(self, idf: Dict[str, float], avgdl: float) -> np.ndarray:
+        """BM25 score of every chunk for the query terms of `idf`"""
+        scores = np.zeros(self.chunks, dtype=np.float32)
+        norm = None
+        for term, weight in idf.items():
+            entry = self.terms.get(term)
+            if not entry:
+                continue
+            if norm is None:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / avgdl)
+            start, df = entry
+            ids = self.postings[start:start + df]
+            tf = self.freqs[start:start + df]
+            # A term appears once per chunk in its postings: plain fancy-index add is safe
+            scores[ids] += weight * tf * (BM25_K1 + 1) / (tf + norm[ids])
+        return scores
+
+    def chunk(self, n: int) -> dict:
+        doc = self.documents[int(self.chunk_doc[n])]
+        start, end = int(self.text_offsets[n]), int(self.text_offsets[n + 1])
+        return {
+            "courseId": self.course_id,
+            "documentId": doc["documentId"],
+            "name": doc["name"],
+            "page": int(self.chunk_page[n]),
+            "text": bytes(self.text[start:end]).decode("utf-8"),
+        }
+
+
+def write_segment(path: str, course_id: str, signature: str, documents: List[dict]) -> int:
+    """
+    Index `documents` ({documentId, name, text, pageOffsets}) into the segment
+    file at `path` (atomically replaced). Returns the number of chunks.
+    """
+    postings: Dict[str, List[tuple]] = {}
+    lengths, chunk_doc, chunk_page, texts = [], [], [], []
+    for d, doc in enumerate(documents):
+        for page, text in chunk_text(doc.get("text") or "", doc.get("pageOffsets")):
+            n = len(lengths)
+            terms = tokenize(text)
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, []).append((n, tf))
+            lengths.append(len(terms))
+            chunk_doc.append(d)
+            chunk_page.append(page)
+            texts.append(text.encode("utf-8"))
+
+    terms, ids, freqs = {}, [], []
+    for term, entries in postings.items():
+        terms[term] = [len(ids), len(entries)]
+        ids.extend(n for n, _ in entries)
+        freqs.extend(tf for _, tf in entries)
+    text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in texts], out=text_offsets[1:])
+
+    arrays = {
+        "postings": np.array(ids, dtype=np.int32),
+        "freqs": np.array(freqs, dtype=np.float32),
+        "lengths": np.array(lengths, dtype=np.float32),
+        "chunkDoc": np.array(chunk_doc, dtype=np.int32),
+        "chunkPage": np.array(chunk_page, dtype=np.int32),
+        "textOffsets": text_offsets,
+        "text": np.frombuffer(b"".join(texts), dtype=np.uint8),
+    }
+    header = {
+        "courseId": course_id,
+        "signature": signature,
+        "chunks": len(lengths),
+        "totalLength": int(sum(lengths)),
+        "documents": [{"documentId": d.get("documentId"), "name": d.get("name") or ""} for d in documents],
+        "terms": terms,
+    }
+
+    # Array offsets depend on the header size, which depends on the offsets
+    def layout(header_len: int) -> dict:
+        position = 16 + header_len
+        table = {}
+        for name, array in arrays.items():
+            position += -position % 8
+            table[name] = [position, array.dtype.str, len(array)]
+            position += array.nbytes
+        return table
+
+    # Fixed point; a header that came out shorter is padded with spaces (valid JSON)
+    encoded = b""
+    while True:
+        header["arrays"] = layout(len(encoded))
+        candidate = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(candidate) <= len(encoded):
+            encoded = candidate.ljust(len(encoded))
+            break
+        encoded = candidate
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Unique temporary name: writers in other containers may share the directory (and the PID)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(encoded)).tobytes())
+            f.write(encoded)
+            for name, array in arrays.items():
+                f.write(b"\0" * (header["arrays"][name][0] - f.tell()))
+                f.write(array.tobytes())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(lengths)
+
+
+class RetrievalIndex:
+    """Per-course segments under `directory`, loaded lazily and reloaded when rebuilt"""
+
+    def __init__(self, directory: str = RETRIEVAL_INDEX_DIR, sync_interval: float = RETRIEVAL_SYNC_INTERVAL,
+                 read_only: bool = RETRIEVAL_READ_ONLY):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.read_only = read_only
+        self._segments: Dict[str, tuple] = {}  # courseId -> ((mtime_ns, size), Segment)
+        self._checked: Dict[str, float] = {}   # courseId -> last signature check (monotonic)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.builds = 0
+        self.searches = 0
+
+    def path(self, course_id: str) -> str:
+        return os.path.join(self.directory, f"{course_id}.seg")
+
+    def segment(self, course_id) -> Optional[Segment]:
+        course_id = str(course_id)
+        try:
+            st = os.stat(self.path(course_id))
+        except OSError:
+            self._segments.pop(course_id, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._segments.get(course_id)
+        if cached is None or cached[0] != stamp:
+            try:
+                cached = (stamp, Segment(self.path(course_id)))
+            except (ValueError, OSError) as e:
+                logger.error(f"Retrieval: unreadable segment for course {course_id}: {e}")
+                return None
+            self._segments[course_id] = cached
+        return cached[1]
+
+    def has_course(self, course_id) -> bool:
+        segment = self.segment(course_id)
+        return segment is not None and segment.chunks > 0
+
+    def build_course(self, course_id, signature: str, documents: List[dict]) -> int:
+        if self.read_only:
+            raise RuntimeError("retrieval index opened read-only")
+        chunks = write_segment(self.path(str(course_id)), str(course_id), signature, documents)
+        self.builds += 1
+        return chunks
+
+    def remove_course(self, course_id) -> None:
+        if self.read_only:
+            raise RuntimeError("retrieval index opened read-only")
+        try:
+            os.remove(self.path(str(course_id)))
+        except FileNotFoundError:
+            pass
+        self._segments.pop(str(course_id), None)
+
+    def search(self, query: str, course_ids: Iterable, k: int = 5) -> List[dict]:
+        """Top-k chunks of the given courses for `query`, best first (each with its score)"""
+        segments = [s for s in (self.segment(c) for c in course_ids) if s is not None and s.chunks]
+        terms = set(tokenize(query))
+        if not segments or not terms or k <= 0:
+            return []
+        self.searches += 1
+
+        # Pooled statistics of the searched courses
+        n_chunks = sum(s.chunks for s in segments)
+        avgdl = max(sum(s.total_length for s in segments) / n_chunks, 1.0)
+        idf = {}
+        for term in terms:
+            df = sum(s.document_frequency(term) for s in segments)
+            if df:
+                idf[term] = float(np.log(1 + (n_chunks - df + 0.5) / (df + 0.5)))
+        if not idf:
+            return []
+
+        candidates = []
+        for segment in segments:
+            scores = segment.scores(idf, avgdl)
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            candidates.extend((float(scores[n]), segment, int(n)) for n in top if scores[n] > 0)
+        candidates.sort(key=lambda c: -c[0])
+
+        hits = []
+        for score, segment, n in candidates[:k]:
+            hit = segment.chunk(n)
+            hit["score"] = round(score, 3)
+            hits.append(hit)
+        return hits
+
+    async def sync_course(self, db, course_id, force: bool = False) -> bool:
+        """
+        Rebuild the course's segment if its stored texts changed. Without
+        `force`, a course is checked at most once per sync_interval.
+        Returns True when the segment was rebuilt or removed (never when read-only).
+        """
+        if self.read_only:
+            return False
+        course_id = str(course_id)
+        now = time.monotonic()
+        if not force and now - self._checked.get(course_id, float("-inf")) < self.sync_interval:
+            return False
+        self._checked[course_id] = now
+
+        lock = self._locks.setdefault(course_id, asyncio.Lock())
+        async with lock:
+            query = {"courseId": course_id, "error": None}
+            entries = [e async for e in db[TEXTS_COLLECTION].find(query, {"documentId": 1, "mtimeNs": 1, "size": 1})]
+            segment = self.segment(course_id)
+            if not entries:
+                if segment is None:
+                    return False
+                self.remove_course(course_id)
+                return True
+            signature = texts_signature(entries)
+            if segment is not None and segment.signature == signature:
+                return False
+
+            texts = {}
+            fields = {"documentId": 1, "text": 1, "pageOffsets": 1}
+            async for e in db[TEXTS_COLLECTION].find(query, fields).sort("documentId", 1):
+                texts[e["documentId"]] = e
+            names = {}
+            object_ids = []
+            for document_id in texts:
+                try:
+                    object_ids.append(ObjectId(document_id))
+                except (InvalidId, TypeError):
+                    pass
+            async for d in db.documents.find({"_id": {"$in": object_ids}}, {"name": 1}):
+                names[str(d["_id"])] = d.get("name", "")
+            documents = [{**e, "name": names.get(document_id, "")} for document_id, e in texts.items()]
+
+            # CPU-bound: keep the event loop free
+            chunks = await asyncio.to_thread(self.build_course, course_id, signature, documents)
+            logger.info(f"Retrieval: indexed course {course_id} ({len(documents)} documents, {chunks} chunks)")
+            return True
+
+    async def sync_courses(self, db, course_ids: Iterable, force: bool = False) -> int:
+        """sync_course for several courses at once; returns how many were rebuilt"""
+        async def sync(course_id) -> bool:
+            try:
+                return await self.sync_course(db, course_id, force)
+            except Exception as e:
+                logger.error(f"Retrieval: could not sync course {course_id}: {e}")
+                return False
+
+        return sum(await asyncio.gather(*(sync(c) for c in set(map(str, course_ids)))))
+
+    def stats(self) -> dict:
+        loaded = [entry[1] for entry in self._segments.values()]
+        return {
+            "segmentsLoaded": len(loaded),
+            "chunksLoaded": sum(s.chunks for s in loaded),
+            "builds": self.builds,
+            "searches": self.searches,
+            "readOnly": self.read_only,
+        }
+
+
+retrieval_index = RetrievalIndex()
+
+
+async def _main(args) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    db = AsyncIOMotorClient(os.getenv("MONGO_URI", "mongodb://mongo:27017/edu_platform")).edu_platform
+    index = RetrievalIndex(args.dir)
+    if args.sync:
+        course_ids = args.course or await db[TEXTS_COLLECTION].distinct("courseId", {"error": None})
+        rebuilt = await index.sync_courses(db, course_ids, force=True)
+        print(f"Synced {len(course_ids)} courses, {rebuilt} rebuilt")
+    if args.query:
+        for hit in index.search(args.query, args.course or [], args.k):
+            print(f"[{hit['score']:.2f}] {hit['name']} p.{hit['page']}: {hit['text'][:160]}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Course document retrieval index")
+    parser.add_argument("--dir", default=RETRIEVAL_INDEX_DIR, help="segment directory")
+    parser.add_argument("--sync", action="store_true", help="build / refresh the segments from documenttexts")
+    parser.add_argument("--course", action="append", help="course id (repeatable; default: every course)")
+    parser.add_argument("--query", help="search the given courses")
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if not args.sync and not args.query:
+        parser.error("nothing to do (use --sync and/or --query)")
+    asyncio.run(_main(args))
@@ -0,0 +1,441 @@
+"""
+Materialized per-student course summaries.
+
+Average, completion, category breakdown and risk of every (student, course)
+pair are kept in the `student_course_summaries` collection, so the read
+paths (ia-service data_engine, chatai-service context_engine) fetch them
+with one indexed query instead of recomputing them from raw grades:
+
+- summarize_course: the grade_stats computation for a whole roster, over the
+  items the academic service counts (maxPoints > 0, category of the course).
+  `completed` is its > 99% evaluated rule (finished courses are not analyzed).
+- refresh_course / rebuild: recompute and upsert one course (some of its
+  students or all of them) / every course with enrollments or summaries.
+- SummaryUpdater: started by ia-service. Follows `grades`, `gradeitems`,
+  `gradecategories` and `enrollments` through a change stream and refreshes
+  what changed (a grade: its student, an item or category: the course).
+  Bursts are coalesced per course. On a standalone mongod it polls
+  `updatedAt` instead; deletions leave no trace there, so every
+  SUMMARIES_RECONCILE_INTERVAL it also checks every course against the
+  on-the-fly computation and refreshes the ones that drifted.
+- check_consistency: diffs the stored summaries against the on-the-fly
+  computation.
+
+    python summaries.py --rebuild
+    python summaries.py --check --course <courseId>
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from grade_stats import CourseStats
+
+logger = logging.getLogger(__name__)
+
+SUMMARIES_COLLECTION = "student_course_summaries"
+SUMMARIES_POLL_INTERVAL = float(os.getenv("SUMMARIES_POLL_INTERVAL", "30"))
+SUMMARIES_WORKERS = int(os.getenv("SUMMARIES_WORKERS", "4"))
+# Poll mode: seconds between two full consistency passes (catches deletions)
+SUMMARIES_RECONCILE_INTERVAL = float(os.getenv("SUMMARIES_RECONCILE_INTERVAL", "3600"))
+# Evaluated share of the course points from which a course counts as finished
+COMPLETED_RATIO = 0.99
+
+WATCHED_COLLECTIONS = ("grades", "gradeitems", "gradecategories", "enrollments")
+# Fields the read paths need
+SUMMARY_FIELDS = {"courseId": 1, "stats": 1, "completed": 1}
+
+ITEM_FIELDS = {"courseId": 1, "categoryId": 1, "maxPoints": 1}
+CATEGORY_FIELDS = {"courseId": 1, "name": 1, "weight": 1}
+GRADE_FIELDS = {"courseId": 1, "studentId": 1, "itemId": 1, "score": 1}
+
+
+def _object_id(value) -> ObjectId:
+    return value if isinstance(value, ObjectId) else ObjectId(str(value))
+
+
+def _group(rows: list) -> dict:
+    groups = {}
+    for row in rows:
+        groups.setdefault(str(row.get("courseId")), []).append(row)
+    return groups
+
+
+def summarize_course(items: list, categories: list, grades: list, student_ids: Iterable) -> Dict[str, dict]:
+    """studentId (str) -> {"stats", "completed", "gradeIds", "itemIds"} for one course"""
+    category_ids = {c["_id"] for c in categories}
+    valid = [i for i in items if (i.get("maxPoints") or 0) > 0 and i.get("categoryId") in category_ids]
+    engine = CourseStats(
+        ((str(i["_id"]), i["maxPoints"], str(i["categoryId"])) for i in valid),
+        ((str(c["_id"]), c.get("name"), c.get("weight")) for c in categories)
+    )
+    students = [str(s) for s in student_ids]
+    graded = [g for g in grades if g.get("itemId")]
+    stats = engine.for_roster(students, [str(g.get("studentId")) for g in graded],
+                              [str(g["itemId"]) for g in graded], [g.get("score") for g in graded])
+
+    grade_ids = {}
+    for g in graded:
+        grade_ids.setdefault(str(g.get("studentId")), []).append(g["_id"])
+    item_ids = [i["_id"] for i in items]
+    total = stats["total"]
+    return {
+        student_id: {
+            "stats": engine.summary(stats, row),
+            "completed": bool(total > 0 and stats["evaluated"][row] / total >= COMPLETED_RATIO),
+            "gradeIds": grade_ids.get(student_id, []),
+            "itemIds": item_ids,
+        }
+        for row, student_id in enumerate(students)
+    }
+
+
+async def compute_summaries(db, course_ids: Iterable, student_ids: Optional[Iterable] = None) -> Dict[str, dict]:
+    """
+    On-the-fly summaries, courseId (str) -> studentId (str) -> summary, for the
+    given students or, without `student_ids`, every enrolled student.
+    """
+    course_ids = [_object_id(c) for c in course_ids]
+    if not course_ids:
+        return {}
+    in_courses = {"$in": course_ids}
+    grade_query = {"courseId": in_courses}
+    if student_ids is not None:
+        student_ids = [_object_id(s) for s in student_ids]
+        grade_query["studentId"] = {"$in": student_ids}
+
+    async def roster():
+        if student_ids is not None:
+            return None
+        return [e async for e in db.enrollments.find({"courseId": in_courses}, {"courseId": 1, "studentId": 1})]
+
+    items, categories, grades, enrollments = await asyncio.gather(
+        db.gradeitems.find({"courseId": in_courses}, ITEM_FIELDS).to_list(None),
+        db.gradecategories.find({"courseId": in_courses}, CATEGORY_FIELDS).to_list(None),
+        db.grades.find(grade_query, GRADE_FIELDS).to_list(None),
+        roster(),
+    )
+    items, categories, grades = _group(items), _group(categories), _group(grades)
+    rosters = {}
+    for e in enrollments or []:
+        if e.get("studentId") is not None:
+            rosters.setdefault(str(e["courseId"]), {})[str(e["studentId"])] = None
+
+    result = {}
+    for course_id in map(str, course_ids):
+        students = student_ids if student_ids is not None else list(rosters.get(course_id, {}))
+        result[course_id] = summarize_course(items.get(course_id, []), categories.get(course_id, []),
+                                             grades.get(course_id, []), students)
+    return result
+
+
+async def load_summaries(db, student_id, course_ids: Iterable) -> Dict[str, dict]:
+    """Stored summaries of one student, courseId (str) -> {"stats", "completed"}"""
+    query = {"studentId": _object_id(student_id), "courseId": {"$in": [_object_id(c) for c in course_ids]}}
+    return {str(s["courseId"]): s async for s in db[SUMMARIES_COLLECTION].find(query, SUMMARY_FIELDS)}
+
+
+async def ensure_summary_indexes(db) -> None:
+    collection = db[SUMMARIES_COLLECTION]
+    await collection.create_index([("studentId", 1), ("courseId", 1)], unique=True)
+    await collection.create_index("courseId")
+    # Resolve deletions (the change event only has the deleted _id)
+    await collection.create_index("gradeIds")
+    await collection.create_index("itemIds")
+    await collection.create_index("stats.categories.categoryId")
+    # chatai-service's context cache polls it on a standalone mongod
+    await collection.create_index("updatedAt")
+
+
+async def refresh_course(db, course_id, student_ids: Optional[Iterable] = None) -> int:
+    """
+    Recompute and store the summaries of one course: the given students
+    (those still enrolled) or its whole roster, in which case summaries of
+    students no longer enrolled are dropped. Returns how many were written.
+    """
+    course_id = _object_id(course_id)
+    enrollment_query = {"courseId": course_id}
+    if student_ids is not None:
+        enrollment_query["studentId"] = {"$in": [_object_id(s) for s in student_ids]}
+    enrolled = [e["studentId"] async for e in db.enrollments.find(enrollment_query, {"studentId": 1})
+                if e.get("studentId") is not None]
+    enrolled = list(dict.fromkeys(enrolled))
+
+    collection = db[SUMMARIES_COLLECTION]
+    if student_ids is None:
+        await collection.delete_many({"courseId": course_id, "studentId": {"$nin": enrolled}})
+    if not enrolled:
+        return 0
+
+    summaries = (await compute_summaries(db, [course_id], enrolled))[str(course_id)]
+    now = datetime.now(timezone.utc)
+    await collection.bulk_write([
+        UpdateOne({"studentId": student_id, "courseId": course_id},
+                  {"$set": {**summaries[str(student_id)], "updatedAt": now}}, upsert=True)
+        for student_id in enrolled
+    ], ordered=False)
+    return len(enrolled)
+
+
+async def _all_courses(db) -> list:
+    """Courses with enrollments or stored summaries"""
+    enrolled, stored = await asyncio.gather(db.enrollments.distinct("courseId"),
+                                            db[SUMMARIES_COLLECTION].distinct("courseId"))
+    return list(dict.fromkeys(enrolled + stored))
+
+
+async def rebuild(db, course_ids: Optional[Iterable] = None, workers: int = SUMMARIES_WORKERS) -> Dict[str, int]:
+    """Full refresh of the given courses (default: every course with enrollments or summaries)"""
+    if course_ids is None:
+        course_ids = await _all_courses(db)
+    queue = asyncio.Queue()
+    for course_id in course_ids:
+        queue.put_nowait(course_id)
+    counts = {"courses": queue.qsize(), "summaries": 0, "failed": 0}
+
+    async def worker():
+        while not queue.empty():
+            course_id = queue.get_nowait()
+            try:
+                written = await refresh_course(db, course_id)
+                counts["summaries"] += written
+            except Exception as e:
+                counts["failed"] += 1
+                logger.error(f"Summaries: could not rebuild course {course_id}: {e}")
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    return counts
+
+
+async def check_consistency(db, course_ids: Optional[Iterable] = None, limit: int = 20) -> dict:
+    """
+    Stored summaries vs the on-the-fly computation. Counts missing (enrolled,
+    no summary), stale (differing stats or completion) and orphaned (not
+    enrolled any more) summaries, with up to `limit` "courseId/studentId" samples each.
+    """
+    if course_ids is None:
+        course_ids = await _all_courses(db)
+    report = {"courses": 0, "checked": 0}
+    samples = {"missing": [], "stale": [], "orphaned": []}
+    counts = dict.fromkeys(samples, 0)
+
+    def flag(kind: str, course_id: str, student_id: str) -> None:
+        counts[kind] += 1
+        if len(samples[kind]) < limit:
+            samples[kind].append(f"{course_id}/{student_id}")
+
+    for course_id in course_ids:
+        course_id = str(course_id)
+        expected = (await compute_summaries(db, [course_id]))[course_id]
+        stored = {str(s["studentId"]): s async for s in db[SUMMARIES_COLLECTION].find(
+            {"courseId": _object_id(course_id)}, {"studentId": 1, "stats": 1, "completed": 1})}
+        report["courses"] += 1
+        report["checked"] += len(expected)
+        for student_id, summary in expected.items():
+            entry = stored.get(student_id)
+            if entry is None:
+                flag("missing", course_id, student_id)
+            elif entry.get("stats") != summary["stats"] or entry.get("completed") != summary["completed"]:
+                flag("stale", course_id, student_id)
+        for student_id in stored.keys() - expected.keys():
+            flag("orphaned", course_id, student_id)
+
+    report.update(counts)
+    report["consistent"] = not any(counts.values())
+    report["samples"] = samples
+    return report
+
+
+class SummaryUpdater:
+    """Keeps `student_course_summaries` in step with the grade collections"""
+
+    # collection -> summary field that finds the summaries of a deleted document
+    DELETE_LOOKUPS = {"grades": "gradeIds", "gradeitems": "itemIds", "gradecategories": "stats.categories.categoryId"}
+
+    def __init__(self, db, poll_interval: float = SUMMARIES_POLL_INTERVAL,
+                 reconcile_interval: float = SUMMARIES_RECONCILE_INTERVAL):
+        self.db = db
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self._tasks = []
+        # courseId -> studentIds to refresh (None: the whole roster)
+        self._pending: Dict[str, Optional[set]] = {}
+        self._wakeup = asyncio.Event()
+        self.mode = None
+        self.refreshed = 0
+        self.failed = 0
+        self.reconciled = 0
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._run()),
+            asyncio.create_task(self._refresh_loop()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def mark(self, course_id, student_id=None) -> None:
+        course_id = str(course_id)
+        if student_id is None:
+            self._pending[course_id] = None
+        else:
+            students = self._pending.setdefault(course_id, set())
+            if students is not None:
+                students.add(str(student_id))
+        self._wakeup.set()
+
+    def apply(self, collection: str, doc: dict) -> None:
+        """Mark what one inserted / updated document changes"""
+        if doc.get("courseId") is None:
+            return
+        if collection in ("grades", "enrollments"):
+            if doc.get("studentId") is not None:
+                self.mark(doc["courseId"], doc["studentId"])
+        else:
+            self.mark(doc["courseId"])
+
+    async def apply_delete(self, collection: str, document_id) -> None:
+        """Deleted enrollments are left alone: read paths only ask for enrolled courses"""
+        field = self.DELETE_LOOKUPS.get(collection)
+        if field is None:
+            return
+        value = str(document_id) if collection == "gradecategories" else document_id
+        summary = await self.db[SUMMARIES_COLLECTION].find_one({field: value}, {"studentId": 1, "courseId": 1})
+        if summary is None:
+            return
+        if collection == "grades":
+            self.mark(summary["courseId"], summary["studentId"])
+        else:
+            self.mark(summary["courseId"])
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "pendingCourses": len(self._pending),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "reconciledCourses": self.reconciled,
+        }
+
+    async def reconcile(self) -> int:
+        """Refresh every course whose stored summaries differ from the on-the-fly ones"""
+        drifted = 0
+        for course_id in await _all_courses(self.db):
+            try:
+                if not (await check_consistency(self.db, [course_id], limit=0))["consistent"]:
+                    drifted += 1
+                    self.mark(course_id)
+            except PyMongoError as e:
+                logger.warning(f"Summaries: could not check course {course_id}: {e}")
+        self.reconciled += drifted
+        if drifted:
+            logger.warning(f"Summaries: {drifted} course(s) had drifted (missed deletions), refreshing")
+        return drifted
+
+    async def _refresh_loop(self) -> None:
+        try:
+            await ensure_summary_indexes(self.db)
+            # First start: fill the store (reads compute on the fly meanwhile)
+            if not await self.db[SUMMARIES_COLLECTION].estimated_document_count():
+                logger.info(f"Summaries: store empty, rebuilding: {await rebuild(self.db)}")
+        except PyMongoError as e:
+            logger.warning(f"Summaries: could not prepare the store: {e}")
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            pending, self._pending = self._pending, {}
+            for course_id, students in pending.items():
+                try:
+                    written = await refresh_course(self.db, course_id, students)
+                    self.refreshed += written
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Summaries: could not refresh course {course_id}: {e}")
+
+    async def _run(self) -> None:
+        try:
+            await self._watch()
+        except asyncio.CancelledError:
+            raise
+        except PyMongoError as e:
+            # Standalone mongod: no change streams
+            logger.warning(f"Summaries: change stream unavailable ({e}), polling every {self.poll_interval}s; "
+                           f"deletions are only caught by the reconcile pass every {self.reconcile_interval}s")
+        await self._poll()
+
+    async def _watch(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(WATCHED_COLLECTIONS)}}}]
+        async with self.db.watch(pipeline, full_document="updateLookup") as stream:
+            self.mode = "changeStream"
+            logger.info("Summaries: watching grade collections")
+            async for change in stream:
+                collection = change.get("ns", {}).get("coll")
+                if change["operationType"] in ("insert", "update", "replace") and change.get("fullDocument"):
+                    self.apply(collection, change["fullDocument"])
+                elif change["operationType"] == "delete":
+                    await self.apply_delete(collection, change["documentKey"]["_id"])
+
+    async def _poll(self) -> None:
+        self.mode = "poll"
+        for name in WATCHED_COLLECTIONS:
+            try:
+                await self.db[name].create_index("updatedAt")
+            except PyMongoError as e:
+                logger.warning(f"Summaries: could not index {name}.updatedAt: {e}")
+        since = datetime.now(timezone.utc)
+        reconciled_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            now = datetime.now(timezone.utc)
+            try:
+                for name in WATCHED_COLLECTIONS:
+                    async for doc in self.db[name].find({"updatedAt": {"$gt": since}}, {"studentId": 1, "courseId": 1}):
+                        self.apply(name, doc)
+                since = now
+            except PyMongoError as e:
+                logger.warning(f"Summaries poll failed: {e}")
+            if time.monotonic() - reconciled_at >= self.reconcile_interval:
+                reconciled_at = time.monotonic()
+                await self.reconcile()
+
+
+async def _main(args) -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    db = AsyncIOMotorClient(os.getenv("MONGO_URI", "mongodb://mongo:27017/edu_platform")).edu_platform
+    if args.rebuild:
+        await ensure_summary_indexes(db)
+        print(f"Rebuild done: {await rebuild(db, args.course, args.workers)}")
+    if args.check:
+        report = await check_consistency(db, args.course)
+        print(f"Checked {report['checked']} summaries in {report['courses']} courses: "
+              f"{report['missing']} missing, {report['stale']} stale, {report['orphaned']} orphaned")
+        for kind, keys in report["samples"].items():
+            for key in keys:
+                print(f"  {kind}: {key}")
+        if not report["consistent"]:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Materialized student course summaries")
+    parser.add_argument("--rebuild", action="store_true", help="recompute and store every summary")
+    parser.add_argument("--check", action="store_true", help="diff the store against the on-the-fly computation")
+    parser.add_argument("--course", action="append", help="course id (repeatable; default: every course)")
+    parser.add_argument("--workers", type=int, default=SUMMARIES_WORKERS, help="courses rebuilt concurrently")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    if not args.rebuild and not args.check:
+        parser.error("nothing to do (use --rebuild and/or --check)")
+    asyncio.run(_main(args))
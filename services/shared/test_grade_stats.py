@@ -0,0 +1,29 @@
+"""
+Regression tests for grade_stats.CourseStats.
+
+    python -m pytest -q test_grade_stats.py
+"""
+from grade_stats import CourseStats
+
+
+def course():
+    return CourseStats([("a", 10, "c1"), ("b", 10, "c1")], [("c1", "Examens", 100)])
+
+
+def test_first_duplicate_grade_counts():
+    assert course().for_student(["a", "a"], [5, 9])["earnedPoints"] == 5
+    assert course().for_student(["a", "a", "a"], [5, 9, 7])["earnedPoints"] == 5
+
+
+def test_first_duplicate_grade_counts_per_student_in_roster():
+    engine = course()
+    stats = engine.for_roster(["s1", "s2"], ["s2", "s1", "s2", "s1"], ["a", "a", "a", "b"], [1, 8, 3, 4])
+    assert list(stats["earned"]) == [12, 1]
+    assert list(stats["evaluated"]) == [20, 10]
+
+
+def test_risk_band_follows_the_rounded_average():
+    engine = CourseStats([("a", 10000, "c1")], [("c1", "Examens", 100)])
+    for score, average, risk in ((5996, 60.0, "moyen"), (5994, 59.9, "élevé"), (7496, 75.0, "faible")):
+        summary = engine.for_student(["a"], [score])
+        assert (summary["average"], summary["risk"]) == (average, risk)